@@ -1,14 +1,352 @@
-import os, json
-import requests
-from urllib3.util import Retry
-from requests.adapters import HTTPAdapter
-import utils
+import os, time, asyncio, functools, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlencode
+import log
+import transport
+import resilience
+import token_cache
+import http_cache
+import metrics
+import tracing
 
 FILE_NAME = "api_calls.py"
 INFO = "[INFO]["+ FILE_NAME +"] - " 
 DEBUG = os.getenv('DEBUG','')
+# Maximum number of keep-alive connections kept open against a single host
+POOL_SIZE = int(os.getenv('APIC_POOL_SIZE','10'))
+# Number of resources requested per page when listing a collection
+PAGE_SIZE = int(os.getenv('APIC_PAGE_SIZE','100'))
+# Successful GET responses kept by a client for the rest of the run (0 turns the memoization off)
+MEMO_SIZE = int(os.getenv('APIC_MEMO_SIZE','1000'))
 
-def get_bearer_token(apic_url, apic_username, apic_password, apic_realm, apic_rest_clientid, apic_rest_clientsecret): 
+class RequestMemo:
+    """
+    Per run memoization of GET responses. Identical GETs (same url, same
+    token identity) made while one is in flight wait for it and share its
+    response instead of being sent too (single flight), and successful
+    responses are served again to later identical GETs without any call.
+
+    A write to a url drops the responses of that url, of everything under
+    it, of the collection it belongs to and of the other resources of that
+    collection (the same resource may have been read by name and written by
+    id), so a run always reads its own writes. A response obtained while a write was being made is not kept,
+    as it may predate it. At most size responses are kept, the least
+    recently used ones are dropped first. Pages of collections are not
+    memoized (see iter_pages), so size bounds the memory used too.
+    """
+
+    def __init__(self, size=MEMO_SIZE):
+        self.size = size
+        self.hits = 0
+        self.coalesced = 0
+        self._responses = OrderedDict()
+        self._in_flight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        with self._lock:
+            if key in self._responses:
+                self._responses.move_to_end(key)
+                self.hits += 1
+                return self._responses[key]
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = {"done": threading.Event(), "response": None, "error": None}
+                self._in_flight[key] = flight
+                generation = self._generation
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["response"]
+        try:
+            flight["response"] = fetch()
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if flight["response"] is not None and flight["response"].status_code == 200 and generation == self._generation:
+                    self._responses[key] = flight["response"]
+                    if len(self._responses) > self.size:
+                        self._responses.popitem(last=False)
+            flight["done"].set()
+        return flight["response"]
+
+    def invalidate(self, url):
+        prefix = url.split('?')[0].rstrip('/')
+        collection = prefix.rsplit('/', 1)[0]
+        with self._lock:
+            self._generation += 1
+            for key in list(self._responses.keys()):
+                path = key[0].split('?')[0].rstrip('/')
+                if path == prefix or path.startswith(prefix + '/') or path == collection or path.rsplit('/', 1)[0] == collection:
+                    del self._responses[key]
+
+class APICClient:
+    """
+    Reusable HTTP client for the IBM API Connect REST endpoints.
+
+    Calls go through a transport (see transport.py) that keeps a keep-alive
+    connection pool per host (i.e. the admin url and the API manager url) so
+    that consecutive calls reuse the same TCP and TLS connection instead of
+    paying a new handshake every time.
+
+    Calls are retried, timed out, failed fast and rate limited per host as
+    described in resilience.py, within the run deadline. GET responses are
+    revalidated against the HTTP cache (see http_cache.py) when it is
+    enabled, and memoized for the rest of the run (see RequestMemo) unless
+    memo_size is 0, which callers polling for changes need.
+
+    asyncio code awaits arequest (or amake_api_call), which makes the same
+    call on a thread of the client.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, verify=False, recorder=None, deadline=None, cache=None, transport=None, memo_size=MEMO_SIZE):
+        self.pool_size = pool_size
+        self.verify = verify
+        self.recorder = recorder or metrics.recorder
+        self.deadline = deadline or resilience.run_deadline
+        self.cache = cache or responses
+        self.transport = transport or new_transport(pool_size, verify)
+        self._breakers = {}
+        self._limiters = {}
+        self._async_pool = None
+        self._lock = threading.Lock()
+        self.memo = RequestMemo(memo_size) if memo_size > 0 else None
+        self._write_listeners = [self.cache.invalidate] + ([self.memo.invalidate] if self.memo else [])
+
+    def add_write_listener(self, listener):
+        """
+        Registers a function that gets the url of every write (any verb other
+        than get) made through this client, so that whatever was derived from
+        earlier reads of that url can be dropped.
+        """
+        self._write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        if listener in self._write_listeners:
+            self._write_listeners.remove(listener)
+
+    def base_url(self, url):
+        parts = urlsplit(url)
+        return parts.scheme + "://" + parts.netloc
+
+    def breaker(self, url):
+        base_url = self.base_url(url)
+        with self._lock:
+            if base_url not in self._breakers:
+                self._breakers[base_url] = resilience.CircuitBreaker(base_url)
+            return self._breakers[base_url]
+
+    def limiter(self, url):
+        base_url = self.base_url(url)
+        with self._lock:
+            if base_url not in self._limiters:
+                self._limiters[base_url] = resilience.RateLimiter(base_url)
+            return self._limiters[base_url]
+
+    def request(self, verb, url, headers, data=None, timeout=None, memoize=True):
+        """
+        Makes the call, retrying it as the resilience policy of its kind says.
+        timeout, when given, replaces the read timeout of the policy. Either
+        way it is cut down to what is left of the run deadline. A GET made
+        with memoize set to False always reaches the server (e.g. to poll a
+        status), and its response is not memoized either.
+        """
+        with tracing.span(verb.upper() + " " + metrics.endpoint_template(url), "request", url=url) as span:
+            if verb.lower() != 'get':
+                response = self._send(verb, url, headers, data, timeout)
+            else:
+                bearer_token = headers.get("Authorization", "").replace("Bearer ", "")
+                identity = tokens.identity(bearer_token) or bearer_token
+                if self.memo is None or not memoize:
+                    response = self._get(url, identity, headers, timeout)
+                else:
+                    response = self.memo.get((url, identity), lambda: self._get(url, identity, headers, timeout))
+            span["status"] = response.status_code
+            return response
+
+    def run_async(self, function, *args, **kwargs):
+        """
+        Runs function on a thread of the pool the client keeps for asyncio
+        callers (one thread per pooled connection) and returns an awaitable
+        of its result.
+        """
+        with self._lock:
+            if self._async_pool is None:
+                self._async_pool = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="apic-async")
+            pool = self._async_pool
+        return asyncio.get_running_loop().run_in_executor(pool, functools.partial(function, *args, **kwargs))
+
+    async def arequest(self, verb, url, headers, data=None, timeout=None, memoize=True):
+        """
+        request for asyncio code, so that many calls can be awaited at once
+        (e.g. with asyncio.gather) with the same retries, circuit breaker,
+        rate limiter, cache and memo as any other call.
+        """
+        return await self.run_async(self.request, verb, url, headers, data, timeout, memoize)
+
+    def _get(self, url, identity, headers, timeout=None):
+        cached = self.cache.get(url, identity)
+        if cached is not None:
+            headers = dict(headers, **self.cache.validators(cached))
+        response = self._send('get', url, headers, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            return self.cache.response(cached, response)
+        if response.status_code == 200:
+            self.cache.put(url, identity, response)
+        return response
+
+    def _send(self, verb, url, headers, data=None, timeout=None):
+        breaker = self.breaker(url)
+        limiter = self.limiter(url)
+        policy = resilience.policy_for(verb, url)
+        opened = self._opened(url)
+        start = time.time()
+        response = None
+        attempt = 0
+        try:
+            while True:
+                breaker.before()
+                last = attempt == policy.attempts - 1
+                waited = limiter.acquire(self.deadline)
+                self.recorder.record_queue_wait(self.base_url(url), waited)
+                try:
+                    # Cut down after the wait for the rate limiter, which counts against the deadline too
+                    timeouts = self.deadline.timeout(resilience.CONNECT_TIMEOUT, timeout or policy.read_timeout)
+                    with tracing.span("attempt " + str(attempt + 1), "attempt", queued=round(waited, 3)) as span:
+                        response = self.transport.request(verb.upper(), url, headers, data, timeouts)
+                        span["status"] = response.status_code
+                except transport.TransportError as e:
+                    breaker.failure()
+                    if last or not policy.retries_error(e):
+                        raise
+                    delay = policy.delay(attempt)
+                    log.debug(INFO + "%s %s failed with %r, retrying in %.1fs", verb.upper(), url, e, delay)
+                else:
+                    if response.status_code >= 500:
+                        breaker.failure()
+                    else:
+                        breaker.success()
+                    delay = policy.delay(attempt, response)
+                    if response.status_code == 429 or resilience.retry_after(response) is not None:
+                        # The whole host is held, not only this call
+                        limiter.throttle(delay)
+                        self.recorder.record_throttle(self.base_url(url))
+                    if last or response.status_code not in policy.statuses:
+                        return response
+                    log.debug(INFO + "%s %s answered %s, retrying in %.1fs", verb.upper(), url, response.status_code, delay)
+                    response.close()
+                    response = None
+                finally:
+                    limiter.release()
+                with tracing.span("backoff", "retry", delay=round(delay, 3)):
+                    self.deadline.sleep(delay)
+                attempt += 1
+        finally:
+            self._record(verb, url, start, response, self._opened(url) > opened, attempt)
+            # Even a failed write may have changed something on the server side
+            if verb.lower() != 'get' and not url.endswith('/api/token'):
+                for listener in self._write_listeners:
+                    listener(url)
+
+    def _opened(self, url):
+        return self.transport.stats().get(self.base_url(url), {}).get("opened", 0)
+
+    def _record(self, verb, url, start, response, new_connection, retries):
+        # With concurrent calls on the same host, new_connection can be attributed to the wrong call, totals are right
+        if response is None:
+            self.recorder.record_call(verb, url, "error", time.time() - start, retries=retries, new_connection=new_connection)
+            return
+        body = response.request.body or b''
+        received = response.headers.get('Content-Length')
+        self.recorder.record_call(verb, url, response.status_code, time.time() - start,
+                                  retries=retries,
+                                  bytes_sent=len(body),
+                                  bytes_received=int(received) if received else len(response.content),
+                                  new_connection=new_connection)
+
+    def connection_stats(self):
+        """
+        Returns, per host, how many connections have been opened and how many
+        requests went through an already open (reused) connection.
+        """
+        stats = {}
+        for base_url, transport_stats in self.transport.stats().items():
+            stats[base_url] = {
+                "opened": transport_stats["opened"],
+                "reused": max(transport_stats["requests"] - transport_stats["opened"], 0),
+                "requests": transport_stats["requests"]
+            }
+        return stats
+
+    def rate_limit_stats(self):
+        """
+        Returns, per host, how many calls the rate limiter let through, how
+        many of them had to wait and for how long, the longest queue of
+        calls waiting, and how many times the host throttled the calls.
+        """
+        with self._lock:
+            limiters = dict(self._limiters)
+        return dict((base_url, dict(limiter.stats)) for base_url, limiter in limiters.items())
+
+    def close(self):
+        with self._lock:
+            pool = self._async_pool
+            self._async_pool = None
+        if pool is not None:
+            pool.shutdown()
+        self.transport.close()
+
+class APIResponse:
+    """
+    A requests Response whose JSON body is parsed only once, however many
+    times json() is called (e.g. to log it and then to use it). The parsed
+    body is shared by every caller, so it must not be modified.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self._json = None
+        self._parsed = False
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def json(self):
+        if not self._parsed:
+            self._json = self.response.json()
+            self._parsed = True
+        return self._json
+
+# Bearer tokens and cached responses are shared by every client, they are keyed by host anyway
+tokens = token_cache.TokenManager(token_cache.default_cache_file())
+responses = http_cache.HTTPCache(http_cache.default_cache_dir())
+
+def new_transport(pool_size=POOL_SIZE, verify=False):
+    return transport.new_transport(pool_size, verify)
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_client():
+    """
+    Returns the client shared by every caller that does not provide its own one.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = APICClient()
+        return _default_client
+
+def get_bearer_token(apic_url, apic_username, apic_password, apic_realm, apic_rest_clientid, apic_rest_clientsecret, client=None): 
 
     try:
         url = "https://" + apic_url + "/api/token"
@@ -25,74 +363,100 @@ def get_bearer_token(apic_url, apic_username, apic_password, apic_realm, apic_re
             "client_secret": apic_rest_clientsecret,
             "grant_type": "password"
         }
-        if DEBUG:
-          print(INFO + "Get Bearer Token")
-          print(INFO + "----------------")
-          print(INFO + "Url:", url)
-          print(INFO + "Username:", apic_username)
-          print(INFO + "Client ID:", apic_rest_clientid)
-        s = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[ 500, 502, 503, 504 ])
-        s.mount(url, HTTPAdapter(max_retries=retries))
-        response = s.post(url, headers=reqheaders, json=reqJson, verify=False, timeout=20)
-        resp_json = response.json()
-        if DEBUG:
-          print(INFO + "This is the request made:")
-          utils.pretty_print_request(response.request)
-          print(INFO + "This is the response's status_code:", response.status_code)
-          print(INFO + "This is the response in json:", resp_json)
-        if response.status_code != 200:
-          raise Exception("Return code for getting the Bearer token isn't 200. It is " + str(response.status_code))
-        return resp_json['access_token']
+        client = client or get_client()
+
+        def fetch():
+            log.debug(INFO + "Get Bearer Token from %s for %s (client ID %s)", url, apic_username, apic_rest_clientid)
+            response = APIResponse(client.request('post', url, reqheaders, reqJson))
+            resp_json = response.json()
+            log.debug(INFO + "Request: %s", log.Request(response.request))
+            log.debug(INFO + "Response: %s %s", response.status_code, log.Body(resp_json))
+            if response.status_code != 200:
+              raise Exception("Return code for getting the Bearer token isn't 200. It is " + str(response.status_code))
+            return resp_json['access_token'], resp_json.get('expires_in')
+
+        with tracing.span("token " + apic_username, "token", url=url):
+            return tokens.get(token_cache.token_key(apic_url, apic_username, apic_realm, apic_rest_clientid), fetch)
     except Exception as e:
         raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
 
-def make_api_call(url, bearer_token, verb, data=None):
+def make_api_call(url, bearer_token, verb, data=None, client=None, memoize=True):
 
     try:
+        # Tokens obtained through get_bearer_token are swapped for a fresh one when they are about to expire
+        bearer_token = tokens.current(bearer_token)
         if data:
             reqheaders = {
                 "Accept" : "application/json",
+                "Accept-Encoding" : "gzip",
                 "Content-Type" : "application/json",
                 "Authorization" : "Bearer " + bearer_token
             }
         else:
            reqheaders = {
                 "Accept" : "application/json",
+                "Accept-Encoding" : "gzip",
                 "Authorization" : "Bearer " + bearer_token
             } 
-        s = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[ 502, 503, 504 ])
-        s.mount(url, HTTPAdapter(max_retries=retries))
-
-        if verb == "get":
-            if data:
-                response = s.get(url, headers=reqheaders, json=data, verify=False, timeout=300)
-            else:
-                response = s.get(url, headers=reqheaders, verify=False, timeout=300)
-        if verb == "post":
-            if data:
-                response = s.post(url, headers=reqheaders, json=data, verify=False, timeout=300)
-            else:
-                response = s.post(url, headers=reqheaders, verify=False, timeout=300)
-        if verb == "put":
-            if data:
-                response = s.put(url, headers=reqheaders, json=data, verify=False, timeout=300)
-            else:
-                response = s.put(url, headers=reqheaders, verify=False, timeout=300)
-        if verb == "patch":
-            if data:
-                response = s.patch(url, headers=reqheaders, json=data, verify=False, timeout=300)
-            else:
-                response = s.patch(url, headers=reqheaders, verify=False, timeout=300)
+        client = client or get_client()
+        response = client.request(verb, url, reqheaders, data, memoize=memoize)
+        if response.status_code == 401:
+            # The token may have been revoked or expired early, so get a new one and try once more
+            new_token = tokens.refresh(bearer_token)
+            if new_token:
+                reqheaders["Authorization"] = "Bearer " + new_token
+                response = client.request(verb, url, reqheaders, data, memoize=memoize)
 
-        if DEBUG:
-            print(INFO + "This is the request made:")
-            utils.pretty_print_request(response.request)
-            print(INFO + "This is the response's status_code", response.status_code)
-            print(INFO + "This is the response in json", json.dumps(response.json(), indent=4, sort_keys=False))
+        response = APIResponse(response)
+        if log.enabled(log.DEBUG):
+            log.debug(INFO + "Request: %s", log.Request(response.request))
+            log.debug(INFO + "Response: %s %s", response.status_code, log.Body(response.json() if response.content else ""))
 
     except Exception as e:
         raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
 
-    return response
\ No newline at end of file
+    return response
+
+async def amake_api_call(url, bearer_token, verb, data=None, client=None, memoize=True):
+    """
+    make_api_call for asyncio code, with the same token refresh.
+    """
+    client = client or get_client()
+    return await client.run_async(make_api_call, url, bearer_token, verb, data, client, memoize)
+
+def iter_pages(url, bearer_token, fields=None, page_size=PAGE_SIZE, client=None):
+    """
+    Yields the responses of the pages of a collection (any url answering
+    with total and results), requesting the next page only when asked for it.
+    Pages are not memoized, as keeping them would make the memory used grow
+    with the size of the collections listed.
+    """
+    offset = 0
+    while True:
+        params = {"limit": page_size, "offset": offset}
+        if fields:
+            params["fields"] = ",".join(fields)
+        page_url = url + ('&' if '?' in url else '?') + urlencode(params)
+        response = make_api_call(page_url, bearer_token, 'get', client=client, memoize=False)
+        if response.status_code != 200:
+            raise Exception("[ERROR] - Exception in " + FILE_NAME + ": Return code for listing " + url + " isn't 200. It is " + str(response.status_code))
+        yield response
+        page = response.json()
+        results = page.get('results', [])
+        total = page.get('total')
+        offset += len(results)
+        # Stop when the server says so, or on a short page for servers that do not send the total
+        if not results or (total is not None and offset >= total) or (total is None and len(results) < page_size):
+            return
+
+def iter_collection(url, bearer_token, fields=None, page_size=PAGE_SIZE, client=None):
+    """
+    Yields the resources of a collection (any url answering with total and
+    results) one page at a time, asking only for the given fields when
+    provided. Pages are requested lazily, so stopping the iteration once
+    the resource being looked for shows up saves the remaining pages and
+    memory use does not grow with the size of the collection.
+    """
+    for response in iter_pages(url, bearer_token, fields, page_size, client):
+        for resource in response.json().get('results', []):
+            yield resource
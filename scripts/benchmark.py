@@ -0,0 +1,138 @@
+import os, sys, json, time, argparse, warnings
+import api_calls
+import reconcile
+import config_apicv10
+import mock_apic
+
+"""
+
+End to end benchmark of config_apicv10.py against the mock IBM API Connect server (mock_apic.py). Every run configures a
+brand new mock and reports the wall time, the number of requests and writes the server got and the number of
+connections the client opened. With --reconcile-rerun, a reconcile pass is also measured right after every run.
+
+    python3 benchmark.py --runs 5 --latency 0.05 --tls-profiles 500 --max-requests 20
+
+Thresholds (--max-*) make the benchmark fail when exceeded, so round-trip regressions can be caught offline.
+
+"""
+
+FILE_NAME = "benchmark.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+
+# The configuration steps read the email server and the provider organization details from the environment
+BENCHMARK_ENVIRONMENT = {
+    "EMAIL_HOST": "smtp.example.com",
+    "EMAIL_PORT": "25",
+    "EMAIL_USERNAME": "smtp-user",
+    "EMAIL_PASSWORD": "smtp-password",
+    "PROV_ORG_OWNER_USERNAME": "owner",
+    "PROV_ORG_OWNER_EMAIL": "owner@example.com",
+    "PROV_ORG_OWNER_FIRST_NAME": "Provider",
+    "PROV_ORG_OWNER_LAST_NAME": "Owner",
+    "PROV_ORG_OWNER_PASSWORD": "owner-password",
+    "PROV_ORG_TITLE": "Benchmark Org"
+}
+
+def measure(mock, host, client_factory):
+    """
+    Runs the whole configuration once against the mock and returns what it cost.
+    """
+    client = client_factory()
+    requests_before = mock.stats["requests"]
+    writes_before = mock.stats["writes"]
+    connections_before = mock.stats["connections"]
+    start = time.time()
+    outcome = "OK"
+    try:
+        config_apicv10.configure(mock_apic.environment_config(host), mock_apic.toolkit_credentials(), client=client)
+    except Exception as e:
+        outcome = "FAILED: " + repr(e)
+    finally:
+        client.close()
+    return {
+        "wall_time": round(time.time() - start, 3),
+        "requests": mock.stats["requests"] - requests_before,
+        "writes": mock.stats["writes"] - writes_before,
+        "connections": mock.stats["connections"] - connections_before,
+        "outcome": outcome
+    }
+
+def run_benchmark(runs=3, reconcile_rerun=False, **mock_options):
+    results = []
+    for i in range(runs):
+        server, host = mock_apic.start(**mock_options)
+        try:
+            reconcile.RECONCILE = ''
+            result = {"run": i + 1, "pass": "initial"}
+            result.update(measure(server.mock, host, api_calls.APICClient))
+            results.append(result)
+            if reconcile_rerun:
+                reconcile.RECONCILE = 'True'
+                result = {"run": i + 1, "pass": "reconcile"}
+                result.update(measure(server.mock, host, api_calls.APICClient))
+                results.append(result)
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+def print_results(results):
+    print(INFO + "Run  Pass       Wall time  Requests  Writes  Connections  Outcome")
+    for result in results:
+        print(INFO + str(result["run"]).ljust(5) + result["pass"].ljust(11) + ("%.3fs" % result["wall_time"]).rjust(9)
+              + str(result["requests"]).rjust(10) + str(result["writes"]).rjust(8) + str(result["connections"]).rjust(13)
+              + "  " + result["outcome"])
+
+def check_thresholds(results, max_wall_time=None, max_requests=None, max_connections=None):
+    """
+    Returns the list of threshold violations of the initial passes.
+    """
+    violations = []
+    for result in results:
+        if result["pass"] != "initial":
+            continue
+        if result["outcome"] != "OK":
+            violations.append("run " + str(result["run"]) + " failed")
+        if max_wall_time is not None and result["wall_time"] > max_wall_time:
+            violations.append("run " + str(result["run"]) + " took " + str(result["wall_time"]) + "s")
+        if max_requests is not None and result["requests"] > max_requests:
+            violations.append("run " + str(result["run"]) + " made " + str(result["requests"]) + " requests")
+        if max_connections is not None and result["connections"] > max_connections:
+            violations.append("run " + str(result["run"]) + " opened " + str(result["connections"]) + " connections")
+    return violations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the IBM API Connect configuration against a mock server")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every request takes on the mock")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum extra random seconds every request takes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="Status code of the injected errors")
+    parser.add_argument("--retry-after", type=int, help="Seconds sent in a Retry-After header along with the injected errors")
+    parser.add_argument("--error-methods", help="Comma separated methods errors are injected into (all by default)")
+    parser.add_argument("--tls-profiles", type=int, default=0, help="Number of extra TLS server and client profiles")
+    parser.add_argument("--provider-orgs", type=int, default=0, help="Number of extra provider organizations")
+    parser.add_argument("--reconcile-rerun", action="store_true", help="Also measure a reconcile pass after every run")
+    parser.add_argument("--max-wall-time", type=float, help="Fail if a run takes longer than this many seconds")
+    parser.add_argument("--max-requests", type=int, help="Fail if a run makes more requests than this")
+    parser.add_argument("--max-connections", type=int, help="Fail if a run opens more connections than this")
+    parser.add_argument("--output", help="File to write the results into as JSON")
+    args = parser.parse_args()
+
+    for name, value in BENCHMARK_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    # The mock serves a self-signed certificate
+    warnings.filterwarnings("ignore", message="Unverified HTTPS request")
+
+    results = run_benchmark(args.runs, args.reconcile_rerun, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, error_status=args.error_status,
+                            error_methods=args.error_methods.split(",") if args.error_methods else None, retry_after=args.retry_after,
+                            tls_profiles=args.tls_profiles, provider_orgs=args.provider_orgs)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    violations = check_thresholds(results, args.max_wall_time, args.max_requests, args.max_connections)
+    if violations:
+        print(INFO + "Thresholds exceeded: " + "; ".join(violations))
+        sys.exit(1)
@@ -0,0 +1,194 @@
+import os, csv, json, argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import log
+import api_calls
+import executor
+import provider_orgs
+import config_apicv10
+import readiness
+
+"""
+
+Onboards many Provider Organizations at once: for every record of a manifest, the owner user is registered in the
+default Provider User Registry and the Provider Organization is created with it (as in step 10 of config_apicv10.py).
+
+    python3 bulk_onboarding.py onboarding.csv --workers 16
+
+The manifest is either a CSV file with a header or a JSONL file (one JSON object per line) with these fields:
+
+    org_title, org_name (optional, computed from org_title otherwise), owner_username, owner_email,
+    owner_first_name, owner_last_name and owner_password or owner_password_env (the name of the environment
+    variable holding it)
+
+The manifest is streamed, so it can be as large as needed. Every record ends up in the results file (JSONL, one line
+per record with its status and the urls of the owner and the organization) as soon as it is done. A failed record does
+not stop the others, and running again with the same results file only retries the records that have not succeeded.
+
+"""
+
+FILE_NAME = "bulk_onboarding.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+RESULTS_FILE_NAME = "onboarding-results.jsonl"
+REQUIRED_FIELDS = ["org_title", "owner_username", "owner_email", "owner_first_name", "owner_last_name"]
+
+def read_manifest(path):
+    """
+    Yields the records of the manifest one at a time along with their line
+    number and the error met parsing them (None when there is none), so
+    that a malformed line fails alone.
+    """
+    with open(path, newline='') as f:
+        if path.endswith(".csv"):
+            # The header is line 1
+            for line_number, record in enumerate(csv.DictReader(f), 2):
+                yield line_number, record, None
+        else:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError("not a JSON object")
+                except ValueError as e:
+                    yield line_number, None, e
+                    continue
+                yield line_number, record, None
+
+def org_name(record):
+    # Same naming as create_provider_org in config_apicv10.py
+    return record.get("org_name") or provider_orgs.name_from_title(record["org_title"])
+
+def succeeded_orgs(results_file):
+    """
+    Returns the names of the organizations the last attempt succeeded for.
+    """
+    succeeded = set()
+    if not os.path.isfile(results_file):
+        return succeeded
+    with open(results_file) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line)
+                status, name = result["status"], result["org_name"]
+            except (ValueError, TypeError, KeyError) as e:
+                # e.g. the last line, cut short when a previous run was killed: its record is onboarded again
+                log.warning(INFO + "Skipping line %s of %s, which cannot be read: %r", line_number, results_file, e)
+                continue
+            if status == "OK":
+                succeeded.add(name)
+            else:
+                succeeded.discard(name)
+    return succeeded
+
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def onboard(record, ctx):
+    """
+    Registers the owner and creates the organization of a record. Both are
+    reconciled, so a record that half succeeded before is completed.
+    """
+    missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+    if missing:
+        raise Exception("missing " + ", ".join(missing))
+    if record.get("owner_password"):
+        password = record["owner_password"]
+    elif os.getenv(record.get("owner_password_env") or ""):
+        password = os.environ[record["owner_password_env"]]
+    else:
+        raise Exception("no owner_password nor an owner_password_env set in the environment")
+
+    owner = {
+        "username": record["owner_username"],
+        "email": record["owner_email"],
+        "first_name": record["owner_first_name"],
+        "last_name": record["owner_last_name"],
+        "password": password
+    }
+    owner, _ = provider_orgs.ensure_owner(ctx["provider_user_registry_default_url"], owner, ctx["admin_bearer_token"], client=ctx["client"])
+    provider_org, _ = provider_orgs.ensure_provider_org('https://' + ctx["environment_config"]["APIC_ADMIN_URL"], org_name(record), record["org_title"],
+                                                        owner['url'], ctx["admin_bearer_token"], client=ctx["client"])
+    return owner['url'], provider_org['url']
+
+def run_onboarding(manifest, results_file, environment_config, toolkit_credentials, client=None, workers=executor.MAX_WORKERS):
+    """
+    Onboards every record of the manifest that has not succeeded yet according
+    to the results file and returns how many succeeded, failed and were skipped.
+    At most twice as many records as workers are read ahead of the pool.
+    """
+    client = client or api_calls.get_client()
+    readiness.wait_for(environment_config, ["management"])
+    ctx = {"environment_config": environment_config, "toolkit_credentials": toolkit_credentials, "client": client}
+    ctx.update(config_apicv10.get_admin_bearer_token(ctx))
+    ctx.update(config_apicv10.get_provider_user_registry(ctx))
+
+    done_orgs = succeeded_orgs(results_file)
+    counts = {"OK": 0, "FAILED": 0, "SKIPPED": 0}
+    running = {}
+
+    def write(result):
+        counts[result["status"]] += 1
+        print(INFO + "Line " + str(result["line"]) + " (" + result["org_name"] + "): " + result["status"] + (" " + result["error"] if result["error"] else ""))
+        # Written as soon as the record is done, so nothing is lost if the run is killed
+        results.write(json.dumps(result) + "\n")
+        results.flush()
+
+    def collect(futures):
+        for future in futures:
+            line_number, name = running.pop(future)
+            result = {"line": line_number, "org_name": name, "status": "OK", "owner_url": "", "org_url": "", "error": ""}
+            try:
+                result["owner_url"], result["org_url"] = future.result()
+            except Exception as e:
+                result["status"] = "FAILED"
+                result["error"] = repr(e)
+            write(result)
+
+    with open(results_file, "a") as results, ThreadPoolExecutor(max_workers=workers) as pool:
+        if results.tell() and not ends_with_newline(results_file):
+            # The last line was cut short by a run that was killed, the results of this one start on a line of their own
+            results.write("\n")
+        try:
+            for line_number, record, error in read_manifest(manifest):
+                if error is not None:
+                    write({"line": line_number, "org_name": "", "status": "FAILED", "owner_url": "", "org_url": "", "error": repr(error)})
+                    continue
+                try:
+                    name = org_name(record)
+                except Exception:
+                    name = ""
+                if name and name in done_orgs:
+                    counts["SKIPPED"] += 1
+                    continue
+                if len(running) >= 2 * workers:
+                    done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                    collect(done)
+                running[pool.submit(onboard, record, ctx)] = (line_number, name)
+        finally:
+            # Even if reading the manifest fails, the records already sent are waited for and written
+            collect(list(running.keys()))
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Onboard many Provider Organizations and their owners into IBM API Connect")
+    parser.add_argument("manifest", help="CSV or JSONL file with one owner and organization per record")
+    parser.add_argument("--workers", type=int, default=executor.MAX_WORKERS, help="Maximum number of records onboarded at the same time")
+    parser.add_argument("--results", help="Results file, " + RESULTS_FILE_NAME + " in the configuration files directory by default")
+    args = parser.parse_args()
+
+    results_file = args.results or os.path.join(os.environ["CONFIG_FILES_DIR"], RESULTS_FILE_NAME)
+    try:
+        environment_config, toolkit_credentials = config_apicv10.load_configuration(os.environ["CONFIG_FILES_DIR"])
+        client = api_calls.APICClient(pool_size=max(args.workers, api_calls.POOL_SIZE))
+        counts = run_onboarding(args.manifest, results_file, environment_config, toolkit_credentials, client=client, workers=args.workers)
+    except Exception as e:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
+    print(INFO + str(counts["OK"]) + " records onboarded, " + str(counts["FAILED"]) + " failed and " + str(counts["SKIPPED"]) + " skipped as already onboarded. Results in " + results_file)
+    if counts["FAILED"]:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + str(counts["FAILED"]) + " records failed, run again to retry them")
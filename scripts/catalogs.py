@@ -0,0 +1,108 @@
+import os
+from functools import partial
+import api_calls
+import executor
+import reconcile
+
+"""
+
+Provisions many catalogs of a provider organization at once, each attached to one or more gateway services, e.g. with
+the APIC_CATALOGS entry of config.json (see config_apicv10.py):
+
+    "APIC_CATALOGS": [
+      {"name": "team-a-dev", "title": "Team A Development", "gateway_services": ["default-gateway-service"]},
+      {"name": "team-a-prod", "title": "Team A Production", "gateway_services": ["zone-1-gateway-service", "zone-2-gateway-service"]}
+    ]
+
+Every catalog is created when missing and its configured gateway services are listed once, then the missing
+associations are all posted at the same time, together with those of the other catalogs. A catalog that fails does not
+stop the others and every catalog gets its own outcome.
+
+"""
+
+FILE_NAME = "catalogs.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+
+def catalog_url(api_manager_url, provider_org_id, name):
+    return api_manager_url + '/api/catalogs/' + provider_org_id + '/' + name
+
+def ensure_catalog(api_manager_url, provider_org_id, catalog, bearer_token, client=None):
+    """
+    Makes sure the catalog exists with its title, read by its name. Returns
+    the catalog and the action taken: created, updated or unchanged.
+    """
+    url = api_manager_url + '/api/orgs/' + provider_org_id + '/catalogs'
+    data = {
+        "name": catalog["name"],
+        "title": catalog.get("title", catalog["name"])
+    }
+    return reconcile.ensure_resource(url, bearer_token, catalog["name"], data, client=client,
+                                     resource_url=catalog_url(api_manager_url, provider_org_id, catalog["name"]))
+
+def associated_gateway_services(configured_gateway_services_url, bearer_token, client=None):
+    """
+    Returns the ids of the gateway services already configured in the catalog.
+    """
+    return set(str(member.get('gateway_service_url', '')).rstrip('/').split('/')[-1]
+               for member in api_calls.iter_collection(configured_gateway_services_url, bearer_token, client=client))
+
+def associate(configured_gateway_services_url, gateway_service_url, bearer_token, client=None):
+    response = api_calls.make_api_call(configured_gateway_services_url, bearer_token, 'post', {"gateway_service_url": gateway_service_url}, client=client)
+    if response.status_code != 201:
+        raise Exception("Return code for associating " + gateway_service_url + " to " + configured_gateway_services_url + " isn't 201. It is " + str(response.status_code))
+
+def provision(catalogs, api_manager_url, provider_org_id, gateway_service_ids, bearer_token, client=None, workers=executor.MAX_WORKERS):
+    """
+    Provisions the catalogs, attaching each of them to the gateway services
+    it lists by name (gateway_service_ids maps every name to its id), and
+    returns the outcome of every catalog: its status (OK or FAILED), what
+    was done to it and to each of its gateway services, and the error.
+    """
+    client = client or api_calls.get_client()
+    gateway_service_urls = dict((name, api_manager_url + '/api/orgs/' + provider_org_id + '/gateway-services/' + gateway_service_id)
+                                for name, gateway_service_id in gateway_service_ids.items())
+    outcomes = dict((catalog["name"], {"catalog": catalog["name"], "status": "OK", "action": "", "gateway_services": {}, "error": ""})
+                    for catalog in catalogs)
+
+    def failed(catalog, e):
+        outcomes[catalog["name"]]["status"] = "FAILED"
+        outcomes[catalog["name"]]["error"] = repr(e)
+
+    def provision_catalog(catalog):
+        outcome = outcomes[catalog["name"]]
+        try:
+            unknown = [name for name in catalog["gateway_services"] if name not in gateway_service_urls]
+            if unknown:
+                raise Exception("Unknown gateway services: " + ", ".join(unknown))
+            resource, outcome["action"] = ensure_catalog(api_manager_url, provider_org_id, catalog, bearer_token, client)
+            url = catalog_url(api_manager_url, provider_org_id, resource["id"]) + '/configured-gateway-services'
+            # A catalog that has just been created has no gateway service yet
+            associated = set() if outcome["action"] == "created" else associated_gateway_services(url, bearer_token, client)
+        except Exception as e:
+            failed(catalog, e)
+            return []
+        tasks = []
+        for name in catalog["gateway_services"]:
+            if gateway_service_ids[name] in associated:
+                outcome["gateway_services"][name] = "unchanged"
+            else:
+                tasks.append(partial(associate_gateway_service, catalog, name, url))
+        return tasks
+
+    def associate_gateway_service(catalog, name, url):
+        try:
+            associate(url, gateway_service_urls[name], bearer_token, client)
+        except Exception as e:
+            failed(catalog, e)
+            return
+        outcomes[catalog["name"]]["gateway_services"][name] = "created"
+
+    # Failures are caught by the tasks themselves, so a catalog that fails does not stop the crawl of the others
+    executor.Crawler(workers).run([partial(provision_catalog, catalog) for catalog in catalogs])
+
+    for outcome in outcomes.values():
+        print(INFO + "Catalog " + outcome["catalog"] + ": " + outcome["status"] + " " + outcome["action"]
+              + "".join(", " + name + " " + action for name, action in sorted(outcome["gateway_services"].items()))
+              + (" " + outcome["error"] if outcome["error"] else ""))
+    return list(outcomes.values())
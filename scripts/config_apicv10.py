@@ -1,95 +1,125 @@
-import os, json
+import os, argparse
+from functools import partial
 import utils
+import log
 import api_calls
+import executor
+import reconcile
+import resolver
+import metrics
+import resilience
+import readiness
+import catalogs
+import provider_orgs
+import tracing
+import gateway_sync
 
 """
 
 API Connect v10 post install configuration steps --> https://www.ibm.com/docs/en/api-connect/10.0.x?topic=environment-cloud-manager-configuration-checklist
 
+Each configuration step below is a function that takes the context (environment configuration, toolkit credentials,
+the APIC client and resource resolver, and the outputs of the steps it depends on) and returns a dict with its own outputs. The STEPS list
+declares what each step requires and provides so that the executor can run the independent steps concurrently.
+
+The gateway, analytics and portal services are registered in every availability zone of the topology (see
+get_topology), all zones at the same time, so a multi-zone deployment takes about as long as a single zone.
+
+When RECONCILE is set, every step reads the resource it manages first and only creates or patches it if it is missing
+or differs from the desired one, so a rerun against an already configured instance does not write anything.
+
+The outputs of every step are saved to config-state.json in the configuration files directory (or in APIC_STATE_DIR,
+which must outlive the run, e.g. a persistent workspace in the Tekton task) as soon as the step succeeds. With --resume, the steps a previous run completed are only checked (one cheap GET at most) and the run goes
+on from the first step that is not complete.
+
+Before a step talks to a subsystem, the subsystem is probed until it answers (see readiness.py), so the configuration can
+start right after the installation.
+
 """
 
 FILE_NAME = "config_apicv10.py"
 DEBUG = os.getenv('DEBUG','')
 # This is the default out of the box catalog that gets created when a Provider Organization is created.
 catalog_name = "sandbox"
+# The availability zone that comes out of the box, the only one unless APIC_TOPOLOGY says otherwise
+DEFAULT_ZONE = "availability-zone-default"
+STATE_FILE_NAME = "config-state.json"
 
 def info(step):
-    return "[INFO]["+ FILE_NAME +"][STEP " + str(step) + "] - " 
+    return "[INFO]["+ FILE_NAME +"][STEP " + str(step) + "] - "
+
+def banner(step, title):
+    # Steps may run concurrently, so the banner is printed at once to keep its lines together
+    line = "# Step " + str(step) + " - " + title + " #"
+    print("\n".join([info(step) + "#" * len(line), info(step) + line, info(step) + "#" * len(line)]))
 
-try:
+def resource_exists(ctx, url, token):
+    """
+    Used to validate the outputs saved by a previous run before resuming after them.
+    """
+    response = api_calls.make_api_call(url, ctx[token], 'get', client=ctx["client"])
+    return response.status_code == 200
+
+def debug_data(step, data):
+    log.debug(info(step) + "Data: %s", log.Body(data))
 
 ######################################################################################
 # Step 1 - Get the IBM API Connect Toolkit credentials and environment configuration #
 ######################################################################################
 
-    print(info(1) + "######################################################################################")
-    print(info(1) + "# Step 1 - Get the IBM API Connect Toolkit credentials and environment configuration #")
-    print(info(1) + "######################################################################################")
+def load_configuration(config_files_dir):
+    banner(1, "Get the IBM API Connect Toolkit credentials and environment configuration")
 
-    toolkit_credentials = utils.get_toolkit_credentials(os.environ["CONFIG_FILES_DIR"])
-    environment_config = utils.get_env_config(os.environ["CONFIG_FILES_DIR"])
-    if DEBUG:
-        print(info(1) + "These are the IBM API Connect Toolkit Credentials")
-        print(info(1) + "-------------------------------------------------")
-        print(info(1), json.dumps(toolkit_credentials, indent=4, sort_keys=False))
-        print(info(1) + "These is the environment configuration")
-        print(info(1) + "--------------------------------------")
-        print(info(1), json.dumps(environment_config, indent=4, sort_keys=False))
+    toolkit_credentials = utils.get_toolkit_credentials(config_files_dir)
+    environment_config = utils.get_env_config(config_files_dir)
+    log.debug(info(1) + "IBM API Connect Toolkit Credentials: %s", log.Body(toolkit_credentials))
+    log.debug(info(1) + "Environment configuration: %s", log.Body(environment_config))
+    return environment_config, toolkit_credentials
 
 ##################################################################
 # Step 2 - Get the IBM API Connect Cloud Management Bearer Token #
 ##################################################################
 
-    print(info(2) + "##################################################################")
-    print(info(2) + "# Step 2 - Get the IBM API Connect Cloud Management Bearer Token #")
-    print(info(2) + "##################################################################")
-    
+def get_admin_bearer_token(ctx):
+    banner(2, "Get the IBM API Connect Cloud Management Bearer Token")
+    environment_config = ctx["environment_config"]
+    toolkit_credentials = ctx["toolkit_credentials"]
+
     admin_bearer_token = api_calls.get_bearer_token(environment_config["APIC_ADMIN_URL"],
                                                     "admin",
                                                     environment_config["APIC_ADMIN_PASSWORD"],
                                                     "admin/default-idp-1",
                                                     toolkit_credentials["toolkit"]["client_id"],
-                                                    toolkit_credentials["toolkit"]["client_secret"])
-    if DEBUG:
-        print(info(2) + "This is the Bearer Token to work against the IBM API Connect Cloud Management endpoints")
-        print(info(2) + "--------------------------------------------------------------------------------------")
-        print(info(2), admin_bearer_token)
+                                                    toolkit_credentials["toolkit"]["client_secret"],
+                                                    client=ctx["client"])
+    log.debug(info(2) + "Bearer Token to work against the IBM API Connect Cloud Management endpoints: %s", log.mask(admin_bearer_token))
+    return {"admin_bearer_token": admin_bearer_token}
 
 #################################
 # Step 3 - Get the Admin org ID #
 #################################
 
-    print(info(3) + "#################################")
-    print(info(3) + "# Step 3 - Get the Admin org ID #")
-    print(info(3) + "#################################")
-    
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/cloud/orgs'
+def get_admin_org_id(ctx):
+    banner(3, "Get the Admin org ID")
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'get')
-    
-    found = False
-    admin_org_id = ''
-    if response.status_code != 200:
-          raise Exception("Return code for getting the Admin org ID isn't 200. It is " + str(response.status_code))
-    for org in response.json()['results']:
-        if org['org_type'] == "admin":
-            found = True
-            admin_org_id = org['id']
-    if not found:
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/cloud/orgs'
+
+    org = ctx["resolver"].find(url, ctx["admin_bearer_token"], 'org_type', "admin")
+    if org is None:
         raise Exception("[ERROR] - The Admin Organization was not found in the IBM API Connect Cluster instance")
-    if DEBUG:
-        print(info(3) + "Admin Org ID: " + admin_org_id)
+    admin_org_id = org['id']
+    log.debug(info(3) + "Admin Org ID: %s", admin_org_id)
+    return {"admin_org_id": admin_org_id}
 
 ####################################
 # Step 4 - Create the Email Server #
 ####################################
 
-    print(info(4) + "####################################")
-    print(info(4) + "# Step 4 - Create the Email Server #")
-    print(info(4) + "####################################")
-    
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/orgs/' + admin_org_id + '/mail-servers'
-    
+def create_email_server(ctx):
+    banner(4, "Create the Email Server")
+
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/orgs/' + ctx["admin_org_id"] + '/mail-servers'
+
     # Create the data object
     data = {}
     data['title'] = 'Default Email Server'
@@ -103,124 +133,170 @@ try:
     data['tls_client_profile_url'] = None
     data['secure'] = False
 
-    if DEBUG:
-        print(info(4) + "This is the data object:")
-        print(info(4), data)
-        print(info(4) + "This is the JSON dump:")
-        print(info(4), json.dumps(data))
+    debug_data(4, data)
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'post', data)
+    if reconcile.RECONCILE:
+        email_server, _ = reconcile.ensure_resource(url, ctx["admin_bearer_token"], data['name'], data, client=ctx["client"])
+        email_server_url = email_server['url']
+    else:
+        response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'post', data, client=ctx["client"])
 
-    if response.status_code != 201:
-          raise Exception("Return code for creating the Email Server isn't 201. It is " + str(response.status_code))
-    email_server_url = response.json()['url']
-    if DEBUG:
-        print(info(4) + "Email Server url: " + email_server_url)
+        if response.status_code != 201:
+              raise Exception("Return code for creating the Email Server isn't 201. It is " + str(response.status_code))
+        email_server_url = response.json()['url']
+    log.debug(info(4) + "Email Server url: %s", email_server_url)
+    return {"email_server_url": email_server_url}
 
 ##################################################
 # Step 5 - Sender and Email Server Configuration #
 ##################################################
 
-    print(info(5) + "##################################################")
-    print(info(5) + "# Step 5 - Sender and Email Server Configuration #")
-    print(info(5) + "##################################################")
+def configure_email_sender(ctx):
+    banner(5, "Sender and Email Server Configuration")
+
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/cloud/settings'
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/cloud/settings'
-    
     # Create the data object
     # Ideally this would also be loaded from a sealed secret
     data = {}
-    data['mail_server_url'] = email_server_url
+    data['mail_server_url'] = ctx["email_server_url"]
     email_sender = {}
     email_sender['name'] = 'APIC Administrator'
     email_sender['address'] = 'test@test.com'
     data['email_sender'] = email_sender
 
-    if DEBUG:
-        print(info(5) + "This is the data object:")
-        print(info(5), data)
-        print(info(5) + "This is the JSON dump:")
-        print(info(5), json.dumps(data))
+    debug_data(5, data)
+
+    if reconcile.RECONCILE:
+        reconcile.ensure_fields(url, ctx["admin_bearer_token"], data, verb='put', client=ctx["client"])
+        return {}
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'put', data)
+    response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'put', data, client=ctx["client"])
 
     if response.status_code != 200:
           raise Exception("Return code for Sender and Email Server configuration isn't 200. It is " + str(response.status_code))
+    return {}
+
+#######################################################
+# Step 6 - Register the Gateway Service of every zone #
+#######################################################
+
+def get_topology(environment_config):
+    """
+    Returns the availability zones to register services in, from the
+    APIC_TOPOLOGY entry of config.json when there is one:
+
+        "APIC_TOPOLOGY": [{"name": "zone-a", "gateway_manager_url": "...", "gateway_url": "...",
+                           "analytics_console_url": "...", "portal_director_url": "...", "portal_web_url": "..."}, ...]
+
+    and otherwise the default availability zone with the APIC_*_URL entries.
+    The analytics and portal urls are optional, a zone without them only
+    gets a gateway service. The services are called default-<kind>-service
+    in the default zone and <zone>-<kind>-service in any other.
+    """
+    zones = environment_config.get("APIC_TOPOLOGY")
+    if not zones:
+        zones = [{
+            "name": DEFAULT_ZONE,
+            "gateway_manager_url": environment_config["APIC_GATEWAY_MANAGER_URL"],
+            "gateway_url": environment_config["APIC_GATEWAY_URL"],
+            "analytics_console_url": environment_config.get("APIC_ANALYTICS_CONSOLE_URL"),
+            "portal_director_url": environment_config.get("APIC_PORTAL_DIRECTOR_URL"),
+            "portal_web_url": environment_config.get("APIC_PORTAL_WEB_URL")
+        }]
+    topology = []
+    for zone in zones:
+        zone = dict(zone)
+        prefix = "default" if zone["name"] == DEFAULT_ZONE else zone["name"]
+        title = "Default" if zone["name"] == DEFAULT_ZONE else zone.get("title", zone["name"])
+        for kind in ["gateway", "analytics", "portal"]:
+            zone.setdefault(kind + "_service", prefix + "-" + kind + "-service")
+            zone.setdefault(kind + "_service_title", title + " " + kind.capitalize() + " Service")
+        topology.append(zone)
+    return topology
+
+def zone_url(ctx, zone):
+    return 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/orgs/' + ctx["admin_org_id"] + '/availability-zones/' + zone["name"]
+
+# Any availability zone other than the default one has to be created first
+def create_availability_zone(zone, ctx):
+    banner(6, "Create the " + zone["name"] + " availability zone")
+
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/orgs/' + ctx["admin_org_id"] + '/availability-zones'
+
+    data = {}
+    data['name'] = zone["name"]
+    data['title'] = zone.get("title", zone["name"])
+
+    debug_data(6, data)
 
-#################################################
-# Step 6 - Register the Default Gateway Service #
-#################################################
+    if reconcile.RECONCILE:
+        availability_zone, _ = reconcile.ensure_resource(url, ctx["admin_bearer_token"], data['name'], data, client=ctx["client"])
+        return {"availability_zone:" + zone["name"]: availability_zone['url']}
 
-    print(info(6) + "#################################################")
-    print(info(6) + "# Step 6 - Register the Default Gateway Service #")
-    print(info(6) + "#################################################")
+    response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'post', data, client=ctx["client"])
 
-    # First, we need to get the Datapower API Gateway instances details
+    if response.status_code != 201:
+          raise Exception("Return code for creating the " + zone["name"] + " availability zone isn't 201. It is " + str(response.status_code))
+    return {"availability_zone:" + zone["name"]: response.json()['url']}
+
+# First, we need to get the Datapower API Gateway instances details
+def get_datapower_api_gateway_integration(ctx):
+    banner(6, "Get the Datapower API Gateway instances details")
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/cloud/integrations/gateway-service/datapower-api-gateway'
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/cloud/integrations/gateway-service/datapower-api-gateway'
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'get')
+    response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'get', client=ctx["client"])
 
     if response.status_code != 200:
           raise Exception("Return code for getting the Datapower API Gateway instances details isn't 200. It is " + str(response.status_code))
 
     datapower_api_gateway_url = response.json()['url']
-    if DEBUG:
-        print(info(6) + "Email Server url: " + datapower_api_gateway_url)
-
-    # Second, we need to get the TLS server profiles
+    log.debug(info(6) + "Datapower API Gateway integration url: %s", datapower_api_gateway_url)
+    return {"datapower_api_gateway_url": datapower_api_gateway_url}
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/orgs/' + admin_org_id + '/tls-server-profiles'
+# Second, we need to get the TLS server profiles
+def get_tls_server_profile(ctx):
+    banner(6, "Get the default TLS server profile")
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'get')
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/orgs/' + ctx["admin_org_id"] + '/tls-server-profiles'
 
-    found = False
-    tls_server_profile_url = ''
-    if response.status_code != 200:
-          raise Exception("Return code for getting the TLS server profiles isn't 200. It is " + str(response.status_code))
-    for profile in response.json()['results']:
-        if profile['name'] == "tls-server-profile-default":
-            found = True
-            tls_server_profile_url = profile['url']
-    if not found:
+    profile = ctx["resolver"].find(url, ctx["admin_bearer_token"], 'name', "tls-server-profile-default")
+    if profile is None:
         raise Exception("[ERROR] - The default TLS server profile was not found in the IBM API Connect Cluster instance")
+    tls_server_profile_url = profile['url']
 
-    if DEBUG:
-        print(info(6) + "Default TLS server profile url: " + tls_server_profile_url)
-
-    # Third, we need to get the TLS client profiles
+    log.debug(info(6) + "Default TLS server profile url: %s", tls_server_profile_url)
+    return {"tls_server_profile_url": tls_server_profile_url}
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/orgs/' + admin_org_id + '/tls-client-profiles'
+# Third, we need to get the TLS client profiles
+def get_tls_client_profile(ctx):
+    banner(6, "Get the Gateway Management TLS client profile")
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'get')
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/orgs/' + ctx["admin_org_id"] + '/tls-client-profiles'
 
-    found = False
-    tls_client_profile_url = ''
-    if response.status_code != 200:
-          raise Exception("Return code for getting the TLS client profiles isn't 200. It is " + str(response.status_code))
-    for profile in response.json()['results']:
-        if profile['name'] == "gateway-management-client-default":
-            found = True
-            tls_client_profile_url = profile['url']
-    if not found:
+    profile = ctx["resolver"].find(url, ctx["admin_bearer_token"], 'name', "gateway-management-client-default")
+    if profile is None:
         raise Exception("[ERROR] - The Gateway Management TLS client profile was not found in the IBM API Connect Cluster instance")
+    tls_client_profile_url = profile['url']
 
-    if DEBUG:
-        print(info(6) + "Gateway Management TLS server profile url: " + tls_client_profile_url)
+    log.debug(info(6) + "Gateway Management TLS client profile url: %s", tls_client_profile_url)
+    return {"tls_client_profile_url": tls_client_profile_url}
 
+# Finally, we can actually make the REST call to get the zone's Gateway Service registered
+def register_gateway_service(zone, ctx):
+    banner(6, "Register the " + zone["gateway_service_title"] + " in " + zone["name"])
 
-    # Finally, we can actually make the REST call to get the Default Gateway Service registered
+    url = zone_url(ctx, zone) + '/gateway-services'
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/orgs/' + admin_org_id + '/availability-zones/availability-zone-default/gateway-services'
-    
     # Create the data object
     data = {}
-    data['name'] = "default-gateway-service"
-    data['title'] = "Default Gateway Service"
-    data['summary'] = "Default Gateway Service that comes out of the box with API Connect Cluster v10"
-    data['endpoint'] = 'https://' + environment_config["APIC_GATEWAY_MANAGER_URL"]
-    data['api_endpoint_base'] = 'https://' + environment_config["APIC_GATEWAY_URL"]
-    data['tls_client_profile_url'] = tls_client_profile_url
+    data['name'] = zone["gateway_service"]
+    data['title'] = zone["gateway_service_title"]
+    data['summary'] = zone["gateway_service_title"] + " that comes out of the box with API Connect Cluster v10"
+    data['endpoint'] = 'https://' + zone["gateway_manager_url"]
+    data['api_endpoint_base'] = 'https://' + zone["gateway_url"]
+    data['tls_client_profile_url'] = ctx["tls_client_profile_url"]
     data['gateway_service_type'] = 'datapower-api-gateway'
     visibility = {}
     visibility['type'] = 'public'
@@ -228,142 +304,141 @@ try:
     sni = []
     sni_inner={}
     sni_inner['host'] = '*'
-    sni_inner['tls_server_profile_url'] = tls_server_profile_url
+    sni_inner['tls_server_profile_url'] = ctx["tls_server_profile_url"]
     sni.append(sni_inner)
     data['sni'] = sni
-    data['integration_url'] = datapower_api_gateway_url
+    data['integration_url'] = ctx["datapower_api_gateway_url"]
 
-    if DEBUG:
-        print(info(6) + "This is the data object:")
-        print(info(6), data)
-        print(info(6) + "This is the JSON dump:")
-        print(info(6), json.dumps(data))
+    debug_data(6, data)
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'post', data)
+    if reconcile.RECONCILE:
+        gateway_service, _ = reconcile.ensure_resource(url, ctx["admin_bearer_token"], data['name'], data, client=ctx["client"])
+    else:
+        response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'post', data, client=ctx["client"])
 
-    if response.status_code != 201:
-          raise Exception("Return code for registering the Default Gateway Service isn't 201. It is " + str(response.status_code))
+        if response.status_code != 201:
+              raise Exception("Return code for registering the " + zone["gateway_service_title"] + " isn't 201. It is " + str(response.status_code))
+        gateway_service = response.json()
 
     # This will be needed in the last step when we associate this Gateway Service to the Sandbox catalog
-    gateway_service_id = response.json()['id']
-    if DEBUG:
-        print(info(6) + "Default Gateway Service ID: " + gateway_service_id)
+    gateway_service_id = gateway_service['id']
+    log.debug(info(6) + zone["gateway_service_title"] + " ID: %s", gateway_service_id)
+    return {"gateway_service_id:" + zone["name"]: gateway_service_id}
+
+#########################################################
+# Step 7 - Register the Analytics Service of every zone #
+#########################################################
 
-###################################################
-# Step 7 - Register the Default Analytics Service #
-###################################################
+def register_analytics_service(zone, ctx):
+    banner(7, "Register the " + zone["analytics_service_title"] + " in " + zone["name"])
 
-    print(info(7) + "###################################################")
-    print(info(7) + "# Step 7 - Register the Default Analytics Service #")
-    print(info(7) + "###################################################")
+    url = zone_url(ctx, zone) + '/analytics-services'
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/orgs/' + admin_org_id + '/availability-zones/availability-zone-default/analytics-services'
-    
     # Create the data object
     data = {}
-    data['name'] = "default-analytics-service"
-    data['title'] = "Default Analytics Service"
-    data['summary'] = "Default Analytics Service that comes out of the box with API Connect Cluster v10"
-    data['endpoint'] = 'https://' + environment_config["APIC_ANALYTICS_CONSOLE_URL"]
+    data['name'] = zone["analytics_service"]
+    data['title'] = zone["analytics_service_title"]
+    data['summary'] = zone["analytics_service_title"] + " that comes out of the box with API Connect Cluster v10"
+    data['endpoint'] = 'https://' + zone["analytics_console_url"]
 
-    if DEBUG:
-        print(info(7) + "This is the data object:")
-        print(info(7), data)
-        print(info(7) + "This is the JSON dump:")
-        print(info(7), json.dumps(data))
+    debug_data(7, data)
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'post', data)
+    if reconcile.RECONCILE:
+        analytics_service, _ = reconcile.ensure_resource(url, ctx["admin_bearer_token"], data['name'], data, client=ctx["client"])
+        analytics_service_url = analytics_service['url']
+    else:
+        response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'post', data, client=ctx["client"])
 
-    if response.status_code != 201:
-          raise Exception("Return code for registering the Default Analytics Service isn't 201. It is " + str(response.status_code))
+        if response.status_code != 201:
+              raise Exception("Return code for registering the " + zone["analytics_service_title"] + " isn't 201. It is " + str(response.status_code))
 
-    analytics_service_url = response.json()['url']
-    if DEBUG:
-        print(info(6) + "Default Analytics Service url: " + analytics_service_url)
+        analytics_service_url = response.json()['url']
+    log.debug(info(7) + zone["analytics_service_title"] + " url: %s", analytics_service_url)
+    return {"analytics_service_url:" + zone["name"]: analytics_service_url}
 
-#############################################################################
-# Step 8 - Associate Default Analytics Service with Default Gateway Service #
-#############################################################################
+##############################################################################
+# Step 8 - Associate every zone's Analytics Service with its Gateway Service #
+##############################################################################
 
-    print(info(8) + "#############################################################################")
-    print(info(8) + "# Step 8 - Associate Default Analytics Service with Default Gateway Service #")
-    print(info(8) + "#############################################################################")
+def associate_analytics_service(zone, ctx):
+    banner(8, "Associate the " + zone["analytics_service_title"] + " with the " + zone["gateway_service_title"])
+
+    url = zone_url(ctx, zone) + '/gateway-services/' + zone["gateway_service"]
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/orgs/' + admin_org_id + '/availability-zones/availability-zone-default/gateway-services/default-gateway-service'
-    
     # Create the data object
     data = {}
-    data['analytics_service_url'] = analytics_service_url
+    data['analytics_service_url'] = ctx["analytics_service_url:" + zone["name"]]
+
+    debug_data(8, data)
 
-    if DEBUG:
-        print(info(8) + "This is the data object:")
-        print(info(8), data)
-        print(info(8) + "This is the JSON dump:")
-        print(info(8), json.dumps(data))
+    if reconcile.RECONCILE:
+        reconcile.ensure_fields(url, ctx["admin_bearer_token"], data, client=ctx["client"])
+        return {}
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'patch', data)
+    response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'patch', data, client=ctx["client"])
 
     if response.status_code != 200:
-          raise Exception("Return code for associating the Default Analytics Service with the Default Gateway Service isn't 200. It is " + str(response.status_code))
+          raise Exception("Return code for associating the " + zone["analytics_service_title"] + " with the " + zone["gateway_service_title"] + " isn't 200. It is " + str(response.status_code))
+    return {}
+
+######################################################
+# Step 9 - Register the Portal Service of every zone #
+######################################################
 
-################################################
-# Step 9 - Register the Default Portal Service #
-################################################
+def register_portal_service(zone, ctx):
+    banner(9, "Register the " + zone["portal_service_title"] + " in " + zone["name"])
 
-    print(info(9) + "################################################")
-    print(info(9) + "# Step 9 - Register the Default Portal Service #")
-    print(info(9) + "################################################")
+    url = zone_url(ctx, zone) + '/portal-services'
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/orgs/' + admin_org_id + '/availability-zones/availability-zone-default/portal-services'
-    
     # Create the data object
     data = {}
-    data['title'] = "Default Portal Service"
-    data['name'] = "default-portal-service"
-    data['summary'] = "Default Portal Service that comes out of the box with API Connect Cluster v10"
-    data['endpoint'] = 'https://' + environment_config["APIC_PORTAL_DIRECTOR_URL"]
-    data['web_endpoint_base'] = 'https://' + environment_config["APIC_PORTAL_WEB_URL"]
+    data['title'] = zone["portal_service_title"]
+    data['name'] = zone["portal_service"]
+    data['summary'] = zone["portal_service_title"] + " that comes out of the box with API Connect Cluster v10"
+    data['endpoint'] = 'https://' + zone["portal_director_url"]
+    data['web_endpoint_base'] = 'https://' + zone["portal_web_url"]
     visibility = {}
     visibility['group_urls'] = None
     visibility['org_urls'] = None
     visibility['type'] = 'public'
     data['visibility'] = visibility
 
-    if DEBUG:
-        print(info(9) + "This is the data object:")
-        print(info(9), data)
-        print(info(9) + "This is the JSON dump:")
-        print(info(9), json.dumps(data))
+    debug_data(9, data)
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'post', data)
+    if reconcile.RECONCILE:
+        reconcile.ensure_resource(url, ctx["admin_bearer_token"], data['name'], data, client=ctx["client"])
+        return {}
+
+    response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'post', data, client=ctx["client"])
 
     if response.status_code != 201:
-          raise Exception("Return code for registering the Default Portal Service isn't 201. It is " + str(response.status_code))
+          raise Exception("Return code for registering the " + zone["portal_service_title"] + " isn't 201. It is " + str(response.status_code))
+    return {}
 
 ############################################
 # Step 10 - Create a Provider Organization #
 ############################################
 
-    print(info(10) + "############################################")
-    print(info(10) + "# Step 10 - Create a Provider Organization #")
-    print(info(10) + "############################################")
-
-    # First, we need to get the user registries so that we can create a new user who will be the Provider Organization Owner
+# First, we need to get the user registries so that we can create a new user who will be the Provider Organization Owner
+def get_provider_user_registry(ctx):
+    banner(10, "Get the default Provider User Registry")
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/cloud/settings/user-registries'
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/cloud/settings/user-registries'
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'get')
+    response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'get', client=ctx["client"])
 
     if response.status_code != 200:
           raise Exception("Return code for retrieving the user registries isn't 200. It is " + str(response.status_code))
-    
+
     provider_user_registry_default_url = response.json()['provider_user_registry_default_url']
-    if DEBUG:
-        print(info(10) + "Default Provider User Registry url: " + provider_user_registry_default_url)
+    log.debug(info(10) + "Default Provider User Registry url: %s", provider_user_registry_default_url)
+    return {"provider_user_registry_default_url": provider_user_registry_default_url}
 
-    # Then, we need to register the user that will be the Provider Organization owner
+# Then, we need to register the user that will be the Provider Organization owner
+def register_provider_org_owner(ctx):
+    banner(10, "Register the Provider Organization owner")
 
-    url = provider_user_registry_default_url + '/users'
+    url = ctx["provider_user_registry_default_url"] + '/users'
 
     # Create the data object
     # Ideally this should be loaded from a sealed secret.
@@ -375,144 +450,355 @@ try:
     data['last_name'] = os.environ["PROV_ORG_OWNER_LAST_NAME"]
     data['password'] = os.environ["PROV_ORG_OWNER_PASSWORD"]
 
-    if DEBUG:
-        print(info(10) + "This is the data object:")
-        print(info(10), data)
-        print(info(10) + "This is the JSON dump:")
-        print(info(10), json.dumps(data))
+    debug_data(10, data)
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'post', data)
+    if reconcile.RECONCILE:
+        owner, _ = provider_orgs.ensure_owner(ctx["provider_user_registry_default_url"], data, ctx["admin_bearer_token"], client=ctx["client"])
+        owner_url = owner['url']
+    else:
+        response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'post', data, client=ctx["client"])
 
-    if response.status_code != 201:
-          raise Exception("Return code for registering the provider organization owner user isn't 201. It is " + str(response.status_code))
-    
-    owner_url = response.json()['url']
-    if DEBUG:
-        print(info(10) + "Provider Organization Owner url: " + owner_url)
-    
-    # Finally, we can create the Provider Organization with the previous owner
+        if response.status_code != 201:
+              raise Exception("Return code for registering the provider organization owner user isn't 201. It is " + str(response.status_code))
+
+        owner_url = response.json()['url']
+    log.debug(info(10) + "Provider Organization Owner url: %s", owner_url)
+    return {"owner_url": owner_url}
+
+# The name of the Provider Organization is computed from its title
+def provider_org_name():
+    return provider_orgs.name_from_title(os.environ["PROV_ORG_TITLE"])
 
-    url = 'https://' + environment_config["APIC_ADMIN_URL"] + '/api/cloud/orgs'
+# Finally, we can create the Provider Organization with the previous owner
+def create_provider_org(ctx):
+    banner(10, "Create a Provider Organization")
 
-    # Compute the name of the Provider Organization from the title
-    po_name=os.environ["PROV_ORG_TITLE"].strip().replace(" ","-")
+    url = 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/cloud/orgs'
 
     # Create the data object
     # Ideally this should be loaded from a sealed secret.
     # Using defaults for now.
     data = {}
     data['title'] = os.environ["PROV_ORG_TITLE"]
-    data['name'] = po_name.lower()
-    data['owner_url'] = owner_url
+    data['name'] = provider_org_name()
+    data['owner_url'] = ctx["owner_url"]
 
-    if DEBUG:
-        print(info(10) + "This is the data object:")
-        print(info(10), data)
-        print(info(10) + "This is the JSON dump:")
-        print(info(10), json.dumps(data))
+    debug_data(10, data)
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'post', data)
+    if reconcile.RECONCILE:
+        provider_org, _ = provider_orgs.ensure_provider_org('https://' + ctx["environment_config"]["APIC_ADMIN_URL"], data['name'], data['title'],
+                                                            data['owner_url'], ctx["admin_bearer_token"], client=ctx["client"])
+        return {"provider_org_url": provider_org['url']}
+
+    response = api_calls.make_api_call(url, ctx["admin_bearer_token"], 'post', data, client=ctx["client"])
 
     if response.status_code != 201:
           raise Exception("Return code for creating the provider organization isn't 201. It is " + str(response.status_code))
+    return {"provider_org_url": response.json()['url']}
 
 ###############################################################
 # Step 11 - Get the IBM API Connect Provider API Bearer Token #
 ###############################################################
 
-    print(info(11) + "###############################################################")
-    print(info(11) + "# Step 11 - Get the IBM API Connect Provider API Bearer Token #")
-    print(info(11) + "###############################################################")
-    
+def get_provider_bearer_token(ctx):
+    banner(11, "Get the IBM API Connect Provider API Bearer Token")
+    toolkit_credentials = ctx["toolkit_credentials"]
+
     # Ideally, the username and password for getting the Bearer Token below would come from a sealed secret (that woul also be used
     # in the previous step 10 when registering the new user for the provider organization owner)
     # Using defaults for now.
-    admin_bearer_token = api_calls.get_bearer_token(environment_config["APIC_API_MANAGER_URL"],
-                                                    os.environ["PROV_ORG_OWNER_USERNAME"],
-                                                    os.environ["PROV_ORG_OWNER_PASSWORD"],
-                                                    "provider/default-idp-2",
-                                                    toolkit_credentials["toolkit"]["client_id"],
-                                                    toolkit_credentials["toolkit"]["client_secret"])
-    if DEBUG:
-        print(info(11) + "This is the Bearer Token to work against the IBM API Connect API Management endpoints")
-        print(info(11) + "-------------------------------------------------------------------------------------")
-        print(info(11), admin_bearer_token)
-
-#########################################################################
-# Step 12 - Associate Default Gateway Services with the Sandbox catalog #
-#########################################################################
-
-    print(info(12) + "#########################################################################")
-    print(info(12) + "# Step 12 - Associate Default Gateway Services with the Sandbox catalog #")
-    print(info(12) + "#########################################################################")
-
-    # First, we need to get the organization ID
-
-    url = 'https://' + environment_config["APIC_API_MANAGER_URL"] + '/api/orgs'
-
-    response = api_calls.make_api_call(url, admin_bearer_token, 'get')
-    
-    found = False
-    provider_org_id = ''
-    if response.status_code != 200:
-          raise Exception("Return code for getting the Provider Org ID isn't 200. It is " + str(response.status_code))
-    for org in response.json()['results']:
-        if org['org_type'] == "provider":
-            found = True
-            provider_org_id = org['id']
-    if not found:
-        raise Exception("[ERROR] - The Provider Organization was not found in the IBM API Connect Cluster instance")
-    if DEBUG:
-        print(info(12) + "Provider Org ID: " + provider_org_id)
-
-    # Then, we need to get the Sandbox catalog ID
-
-    url = 'https://' + environment_config["APIC_API_MANAGER_URL"] + '/api/orgs/' + provider_org_id + '/catalogs'
-
-    response = api_calls.make_api_call(url, admin_bearer_token, 'get')
-    
-    found = False
-    catalog_id = ''
-    if response.status_code != 200:
-          raise Exception("Return code for getting the Sandbox catalog ID isn't 200. It is " + str(response.status_code))
-    for catalog in response.json()['results']:
-        if catalog['name'] == catalog_name:
-            found = True
-            catalog_id = catalog['id']
-    if not found:
+    provider_bearer_token = api_calls.get_bearer_token(ctx["environment_config"]["APIC_API_MANAGER_URL"],
+                                                       os.environ["PROV_ORG_OWNER_USERNAME"],
+                                                       os.environ["PROV_ORG_OWNER_PASSWORD"],
+                                                       "provider/default-idp-2",
+                                                       toolkit_credentials["toolkit"]["client_id"],
+                                                       toolkit_credentials["toolkit"]["client_secret"],
+                                                       client=ctx["client"])
+    log.debug(info(11) + "Bearer Token to work against the IBM API Connect API Management endpoints: %s", log.mask(provider_bearer_token))
+    return {"provider_bearer_token": provider_bearer_token}
+
+#####################################################################
+# Step 12 - Associate the Gateway Services with the Sandbox catalog #
+#####################################################################
+
+# First, we need to get the organization ID
+def get_provider_org_id(ctx):
+    banner(12, "Get the Provider Organization ID")
+
+    # The organization created in step 10 when it ran, otherwise the one named after PROV_ORG_TITLE, as the owner may see others
+    if ctx.get("provider_org_url"):
+        provider_org_id = ctx["provider_org_url"].rstrip('/').split('/')[-1]
+    else:
+        url = 'https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"] + '/api/orgs'
+        org = ctx["resolver"].find(url, ctx["provider_bearer_token"], 'name', provider_org_name(), direct_url=url + '/' + provider_org_name())
+        if org is None:
+            raise Exception("[ERROR] - The Provider Organization " + provider_org_name() + " was not found in the IBM API Connect Cluster instance")
+        provider_org_id = org['id']
+    log.debug(info(12) + "Provider Org ID: %s", provider_org_id)
+    return {"provider_org_id": provider_org_id}
+
+# Then, we need to get the Sandbox catalog ID
+def get_catalog_id(ctx):
+    banner(12, "Get the Sandbox catalog ID")
+
+    url = 'https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"] + '/api/orgs/' + ctx["provider_org_id"] + '/catalogs'
+    # A catalog can be read straight by its name
+    direct_url = 'https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"] + '/api/catalogs/' + ctx["provider_org_id"] + '/' + catalog_name
+
+    catalog = ctx["resolver"].find(url, ctx["provider_bearer_token"], 'name', catalog_name, direct_url=direct_url)
+    if catalog is None:
         raise Exception("[ERROR] - The Sandbox catalog was not found in the IBM API Connect Cluster instance")
-    if DEBUG:
-        print(info(12) + "Sandbox catalog ID: " + catalog_id)
+    catalog_id = catalog['id']
+    log.debug(info(12) + "Sandbox catalog ID: %s", catalog_id)
+    return {"catalog_id": catalog_id}
 
-    # Finally, we can associate the Default Gateway Service to the Sandbox catalog
+# Finally, we can associate the Gateway Service of every zone to the Sandbox catalog
+def associate_gateway_service_to_catalog(zone, ctx):
+    banner(12, "Associate the " + zone["gateway_service_title"] + " with the Sandbox catalog")
+    environment_config = ctx["environment_config"]
+    provider_org_id = ctx["provider_org_id"]
 
-    url = 'https://' + environment_config["APIC_API_MANAGER_URL"] + '/api/catalogs/' + provider_org_id + '/' + catalog_id + '/configured-gateway-services'
+    url = 'https://' + environment_config["APIC_API_MANAGER_URL"] + '/api/catalogs/' + provider_org_id + '/' + ctx["catalog_id"] + '/configured-gateway-services'
 
     # Create the data object
     # Ideally this could also be loaded from a sealed secret.
     # Using defaults for now.
+    gateway_service_id = ctx["gateway_service_id:" + zone["name"]]
     gateway_service_url = 'https://' + environment_config["APIC_API_MANAGER_URL"] + '/api/orgs/' + provider_org_id + '/gateway-services/' + gateway_service_id
     data = {}
     data['gateway_service_url'] = gateway_service_url
 
-    if DEBUG:
-        print(info(12) + "This is the data object:")
-        print(info(12), data)
-        print(info(12) + "This is the JSON dump:")
-        print(info(12), json.dumps(data))
+    debug_data(12, data)
+
+    if reconcile.RECONCILE:
+        reconcile.ensure_member(url, ctx["provider_bearer_token"], 'gateway_service_url', gateway_service_id, data, client=ctx["client"])
+        return {"catalog_gateway_association:" + zone["name"]: True}
 
-    response = api_calls.make_api_call(url, admin_bearer_token, 'post', data)
+    response = api_calls.make_api_call(url, ctx["provider_bearer_token"], 'post', data, client=ctx["client"])
 
     if response.status_code != 201:
-          raise Exception("Return code for associating the Default Gateway Service to the Sandbox catalog isn't 201. It is " + str(response.status_code))
+          raise Exception("Return code for associating the " + zone["gateway_service_title"] + " to the Sandbox catalog isn't 201. It is " + str(response.status_code))
+    return {"catalog_gateway_association:" + zone["name"]: True}
+
+# Then, the other catalogs listed in config.json, if any
+def get_catalogs(environment_config):
+    """
+    Returns the catalogs of the APIC_CATALOGS entry of config.json (see
+    catalogs.py). A catalog that does not list its gateway services gets
+    the one of every availability zone. Raises if a catalog is listed more
+    than once.
+    """
+    topology = get_topology(environment_config)
+    names = [catalog["name"] for catalog in environment_config.get("APIC_CATALOGS", [])]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise Exception("[ERROR] - APIC_CATALOGS lists these catalogs more than once: " + ", ".join(duplicates))
+    return [dict(catalog, gateway_services=catalog.get("gateway_services") or [zone["gateway_service"] for zone in topology])
+            for catalog in environment_config.get("APIC_CATALOGS", [])]
+
+def provision_catalogs(ctx):
+    banner(12, "Provision the catalogs")
+    environment_config = ctx["environment_config"]
+
+    gateway_service_ids = dict((zone["gateway_service"], ctx["gateway_service_id:" + zone["name"]]) for zone in get_topology(environment_config))
+    outcomes = catalogs.provision(get_catalogs(environment_config), 'https://' + environment_config["APIC_API_MANAGER_URL"], ctx["provider_org_id"],
+                                  gateway_service_ids, ctx["provider_bearer_token"], client=ctx["client"])
+    failed = [outcome["catalog"] for outcome in outcomes if outcome["status"] != "OK"]
+    if failed:
+        raise Exception("[ERROR] - " + str(len(failed)) + " catalogs could not be provisioned: " + ", ".join(failed))
+    return {"catalogs_provisioned": True}
+
+def catalog_names(environment_config):
+    return [catalog_name] + [catalog["name"] for catalog in get_catalogs(environment_config) if catalog["name"] != catalog_name]
+
+###########################################################
+# Step 13 - Verify the configuration reached the gateways #
+###########################################################
+
+def verify_gateway_sync(ctx):
+    banner(13, "Verify the configuration reached the gateways")
+
+    gateway_sync.verify('https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"], ctx["provider_org_id"],
+                        catalog_names(ctx["environment_config"]), ctx["provider_bearer_token"], client=ctx["client"])
+    return {}
+
+STEPS = [
+    readiness.readiness_step("management"),
+    readiness.readiness_step("api_manager"),
+    executor.Step("admin_bearer_token", get_admin_bearer_token,
+                  requires=["environment_config", "toolkit_credentials", "management_ready"],
+                  provides=["admin_bearer_token"],
+                  persist=False),
+    executor.Step("admin_org", get_admin_org_id,
+                  requires=["admin_bearer_token"],
+                  provides=["admin_org_id"],
+                  validate=lambda ctx, saved: resource_exists(ctx, 'https://' + ctx["environment_config"]["APIC_ADMIN_URL"] + '/api/cloud/orgs/' + saved["admin_org_id"], "admin_bearer_token")),
+    executor.Step("email_server", create_email_server,
+                  requires=["admin_bearer_token", "admin_org_id"],
+                  provides=["email_server_url"],
+                  validate=lambda ctx, saved: resource_exists(ctx, saved["email_server_url"], "admin_bearer_token")),
+    executor.Step("email_sender", configure_email_sender,
+                  requires=["admin_bearer_token", "email_server_url"]),
+    executor.Step("datapower_api_gateway_integration", get_datapower_api_gateway_integration,
+                  requires=["admin_bearer_token"],
+                  provides=["datapower_api_gateway_url"],
+                  persist=False),
+    executor.Step("tls_server_profile", get_tls_server_profile,
+                  requires=["admin_bearer_token", "admin_org_id"],
+                  provides=["tls_server_profile_url"],
+                  persist=False),
+    executor.Step("tls_client_profile", get_tls_client_profile,
+                  requires=["admin_bearer_token", "admin_org_id"],
+                  provides=["tls_client_profile_url"],
+                  persist=False),
+    executor.Step("provider_user_registry", get_provider_user_registry,
+                  requires=["admin_bearer_token"],
+                  provides=["provider_user_registry_default_url"],
+                  persist=False),
+    executor.Step("provider_org_owner", register_provider_org_owner,
+                  requires=["admin_bearer_token", "provider_user_registry_default_url"],
+                  provides=["owner_url"],
+                  validate=lambda ctx, saved: resource_exists(ctx, saved["owner_url"], "admin_bearer_token")),
+    executor.Step("provider_org", create_provider_org,
+                  requires=["admin_bearer_token", "owner_url"],
+                  provides=["provider_org_url"],
+                  validate=lambda ctx, saved: resource_exists(ctx, saved["provider_org_url"], "admin_bearer_token")),
+    executor.Step("provider_bearer_token", get_provider_bearer_token,
+                  requires=["toolkit_credentials", "owner_url", "api_manager_ready"],
+                  provides=["provider_bearer_token"],
+                  persist=False),
+    executor.Step("provider_org_id", get_provider_org_id,
+                  requires=["provider_bearer_token", "provider_org_url"],
+                  provides=["provider_org_id"],
+                  validate=lambda ctx, saved: resource_exists(ctx, 'https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"] + '/api/orgs/' + saved["provider_org_id"], "provider_bearer_token")),
+    executor.Step("catalog", get_catalog_id,
+                  requires=["provider_bearer_token", "provider_org_id"],
+                  provides=["catalog_id"],
+                  validate=lambda ctx, saved: resource_exists(ctx, 'https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"] + '/api/catalogs/' + ctx["provider_org_id"] + '/' + saved["catalog_id"], "provider_bearer_token")),
+]
+
+def zone_steps(zone):
+    """
+    Returns the steps that register the services of an availability zone.
+    They only depend on the shared lookups (e.g. the TLS profiles) and on
+    the zone itself, so every zone is registered at the same time. Every
+    endpoint is waited for by a readiness step of its own.
+    """
+    name = zone["name"]
+    requires = ["admin_bearer_token", "admin_org_id"]
+    steps = []
+    if name != DEFAULT_ZONE:
+        steps.append(executor.Step("availability_zone:" + name, partial(create_availability_zone, zone),
+                                   requires=requires,
+                                   provides=["availability_zone:" + name],
+                                   validate=lambda ctx, saved: resource_exists(ctx, saved["availability_zone:" + name], "admin_bearer_token")))
+        requires = requires + ["availability_zone:" + name]
+    steps.append(readiness.readiness_step("gateway_manager", zone["gateway_manager_url"], "gateway_manager:" + zone["gateway_manager_url"]))
+    steps.append(executor.Step("gateway_service:" + name, partial(register_gateway_service, zone),
+                               requires=requires + ["datapower_api_gateway_url", "tls_server_profile_url", "tls_client_profile_url", "gateway_manager:" + zone["gateway_manager_url"] + "_ready"],
+                               provides=["gateway_service_id:" + name],
+                               validate=lambda ctx, saved: resource_exists(ctx, zone_url(ctx, zone) + '/gateway-services/' + saved["gateway_service_id:" + name], "admin_bearer_token")))
+    if zone.get("analytics_console_url"):
+        steps.append(readiness.readiness_step("analytics", zone["analytics_console_url"], "analytics:" + zone["analytics_console_url"]))
+        steps.append(executor.Step("analytics_service:" + name, partial(register_analytics_service, zone),
+                                   requires=requires + ["analytics:" + zone["analytics_console_url"] + "_ready"],
+                                   provides=["analytics_service_url:" + name],
+                                   validate=lambda ctx, saved: resource_exists(ctx, saved["analytics_service_url:" + name], "admin_bearer_token")))
+        steps.append(executor.Step("analytics_association:" + name, partial(associate_analytics_service, zone),
+                                   requires=requires + ["gateway_service_id:" + name, "analytics_service_url:" + name]))
+    if zone.get("portal_director_url"):
+        steps.append(readiness.readiness_step("portal", zone["portal_director_url"], "portal:" + zone["portal_director_url"]))
+        steps.append(executor.Step("portal_service:" + name, partial(register_portal_service, zone),
+                                   requires=requires + ["portal:" + zone["portal_director_url"] + "_ready"]))
+    steps.append(executor.Step("catalog_gateway_association:" + name, partial(associate_gateway_service_to_catalog, zone),
+                               requires=["provider_bearer_token", "provider_org_id", "catalog_id", "gateway_service_id:" + name],
+                               provides=["catalog_gateway_association:" + name]))
+    return steps
+
+def build_steps(environment_config):
+    """
+    Returns STEPS along with the steps of every availability zone of the
+    topology, the provisioning of the catalogs and the verification that the
+    gateways are synced. Zones sharing an endpoint share the step that waits
+    for it.
+    """
+    steps = dict((step.name, step) for step in STEPS)
+    topology = get_topology(environment_config)
+    for zone in topology:
+        for step in zone_steps(zone):
+            steps.setdefault(step.name, step)
+    associations = ["catalog_gateway_association:" + zone["name"] for zone in topology]
+    # Read here so that a wrong APIC_CATALOGS entry fails the run before any step
+    if get_catalogs(environment_config):
+        steps["catalogs"] = executor.Step("catalogs", provision_catalogs,
+                                          requires=["provider_bearer_token", "provider_org_id"] + ["gateway_service_id:" + zone["name"] for zone in topology],
+                                          provides=["catalogs_provisioned"])
+        associations.append("catalogs_provisioned")
+    if gateway_sync.VERIFY_GATEWAY_SYNC:
+        # Not persisted, the gateways have to be checked again on every run
+        steps["gateway_sync"] = executor.Step("gateway_sync", verify_gateway_sync,
+                                              requires=["provider_bearer_token", "provider_org_id"] + associations,
+                                              persist=False)
+    return list(steps.values())
+
+def configure(environment_config, toolkit_credentials, client=None, max_workers=executor.MAX_WORKERS, state=None):
+    """
+    Runs steps 2 to 12 against the IBM API Connect instance described by the environment
+    configuration and returns the resulting context. See executor.run_steps for the state.
+    """
+    client = client or api_calls.get_client()
+    resource_resolver = resolver.ResourceResolver(client)
+    context = {
+        "environment_config": environment_config,
+        "toolkit_credentials": toolkit_credentials,
+        "client": client,
+        "resolver": resource_resolver,
+        "readiness_deadline": resilience.Deadline(readiness.READINESS_TIMEOUT)
+    }
+    try:
+        with tracing.span("configure", "run", admin_url=environment_config.get("APIC_ADMIN_URL")):
+            return executor.run_steps(build_steps(environment_config), context, max_workers, state=state)
+    finally:
+        resource_resolver.close()
+
+def load_state(config_files_dir, environment_config, resume=False):
+    return executor.StepState(os.path.join(config_files_dir, STATE_FILE_NAME), environment_config.get("APIC_ADMIN_URL"), resume)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IBM API Connect v10 post install configuration")
+    parser.add_argument("--resume", action="store_true", help="Resume from the steps a previous run completed")
+    args = parser.parse_args()
+
+    # Metrics go to the configuration files directory (the workspace) unless told otherwise
+    metrics_dir = os.getenv('APIC_METRICS_DIR', os.environ["CONFIG_FILES_DIR"])
+    try:
+        environment_config, toolkit_credentials = load_configuration(os.environ["CONFIG_FILES_DIR"])
+        state = load_state(os.getenv('APIC_STATE_DIR', os.environ["CONFIG_FILES_DIR"]), environment_config, args.resume)
+        with tracing.profile():
+            configure(environment_config, toolkit_credentials, state=state)
 
 #######
 # END #
 #######
 
-    print("#######")
-    print("# END #")
-    print("#######")
-
-except Exception as e:
-    raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
\ No newline at end of file
+        print("#######")
+        print("# END #")
+        print("#######")
+
+        for base_url, stats in api_calls.get_client().connection_stats().items():
+            print("[INFO][" + FILE_NAME + "] - " + base_url + ": " + str(stats['requests']) + " requests, "
+                  + str(stats['opened']) + " connections opened, " + str(stats['reused']) + " reused")
+        for base_url, stats in api_calls.get_client().rate_limit_stats().items():
+            if stats['waited'] or stats['throttled']:
+                print("[INFO][" + FILE_NAME + "] - " + base_url + ": " + str(stats['waited']) + " requests waited " + ("%.1f" % stats['wait_seconds'])
+                      + "s in all to be sent (up to " + str(stats['max_queued']) + " queued), throttled " + str(stats['throttled']) + " times")
+        memo = api_calls.get_client().memo
+        if memo is not None:
+            print("[INFO][" + FILE_NAME + "] - " + str(memo.hits) + " GETs served from the run memo, " + str(memo.coalesced) + " coalesced with one in flight")
+
+    except Exception as e:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
+    finally:
+        metrics.recorder.write(metrics_dir)
+        if tracing.tracer.enabled:
+            tracing.tracer.write(tracing.TRACE_FILE)
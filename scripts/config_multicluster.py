@@ -0,0 +1,72 @@
+import os, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+import api_calls
+import config_apicv10
+import metrics
+
+"""
+
+Configures several IBM API Connect instances at once. Each argument is a configuration files directory holding the
+config.json and toolkit-creds.json files that config.sh produces for one cluster:
+
+    python3 config_multicluster.py /source/config-dallas /source/config-frankfurt /source/config-tokyo
+
+The rest of the configuration (email server, provider organization...) is read from the environment as usual.
+
+"""
+
+FILE_NAME = "config_multicluster.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Maximum number of clusters being configured at the same time
+CLUSTER_WORKERS = int(os.getenv('APIC_CLUSTER_WORKERS','4'))
+
+def configure_cluster(config_files_dir, resume=False):
+    """
+    Configures a single cluster with its own client and state file so that a
+    failure or a slow cluster does not affect the others. Never raises, the
+    outcome is returned instead.
+    """
+    start = time.time()
+    client = api_calls.APICClient()
+    result = {"cluster": config_files_dir, "outcome": "OK", "error": ""}
+    try:
+        environment_config, toolkit_credentials = config_apicv10.load_configuration(config_files_dir)
+        state = config_apicv10.load_state(config_files_dir, environment_config, resume)
+        config_apicv10.configure(environment_config, toolkit_credentials, client=client, state=state)
+    except Exception as e:
+        result["outcome"] = "FAILED"
+        result["error"] = repr(e)
+    finally:
+        client.close()
+    result["duration"] = time.time() - start
+    return result
+
+def configure_clusters(config_files_dirs, workers=CLUSTER_WORKERS, resume=False):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda config_files_dir: configure_cluster(config_files_dir, resume), config_files_dirs))
+
+def print_summary(results):
+    width = max([len("Cluster")] + [len(result["cluster"]) for result in results])
+    print(INFO + "Cluster".ljust(width) + "  Duration  Outcome")
+    print(INFO + "-" * width + "  --------  -------")
+    for result in results:
+        print(INFO + result["cluster"].ljust(width) + "  " + ("%.1fs" % result["duration"]).rjust(8) + "  " + result["outcome"])
+    for result in results:
+        if result["error"]:
+            print(INFO + result["cluster"] + ": " + result["error"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Configure several IBM API Connect instances in parallel")
+    parser.add_argument("config_files_dirs", nargs="+", help="Configuration files directory (config.json and toolkit-creds.json) of each cluster")
+    parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS, help="Maximum number of clusters configured at the same time")
+    parser.add_argument("--resume", action="store_true", help="Resume every cluster from the steps a previous run completed")
+    args = parser.parse_args()
+
+    results = configure_clusters(args.config_files_dirs, args.workers, args.resume)
+    print_summary(results)
+    if os.getenv('APIC_METRICS_DIR'):
+        metrics.recorder.write(os.environ['APIC_METRICS_DIR'])
+    failed = [result["cluster"] for result in results if result["outcome"] != "OK"]
+    if failed:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": the configuration failed for " + ", ".join(failed))
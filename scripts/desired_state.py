@@ -0,0 +1,228 @@
+import os, json, argparse
+from functools import partial
+import api_calls
+import executor
+import reconcile
+import resolver
+import config_apicv10
+import catalogs
+import provider_orgs
+import resilience
+import readiness
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+"""
+
+Applies a desired state of provider organizations, their owners, catalogs and the gateway services attached to each
+catalog to the IBM API Connect instance described by the configuration files directory (CONFIG_FILES_DIR).
+
+    python3 desired_state.py desired-state.json --workers 32
+
+The desired state is a JSON file (or YAML if PyYAML is installed) like:
+
+    {
+      "provider_orgs": [
+        {
+          "name": "team-a",
+          "title": "Team A",
+          "owner": {
+            "username": "team-a-owner",
+            "email": "team-a@example.com",
+            "first_name": "Team",
+            "last_name": "A",
+            "password_env": "TEAM_A_OWNER_PASSWORD"
+          },
+          "catalogs": [
+            {"name": "sandbox", "gateway_services": ["default-gateway-service", "zone-1-gateway-service"]},
+            {"name": "dev", "title": "Development", "gateway_services": ["default-gateway-service"]}
+          ]
+        }
+      ]
+    }
+
+Gateway services are named as they are registered, in any availability zone of the topology (APIC_TOPOLOGY, see
+config_apicv10.py). Owner passwords are read from the environment variable named by password_env (or given inline as password). Every
+resource is reconciled: created if missing, patched if different and left untouched otherwise. The work is split in
+steps (owner, org, owner token, catalog, gateway association...) that the executor runs as soon as their inputs are
+ready, so the orgs are applied in parallel and the total time is about the one of the slowest org.
+
+"""
+
+FILE_NAME = "desired_state.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+PROVIDER_REALM = "provider/default-idp-2"
+
+def load_desired_state(path):
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise Exception("[ERROR] - PyYAML is needed to read " + path + ". Install it or use a JSON file")
+            desired_state = yaml.safe_load(f)
+        else:
+            desired_state = json.load(f)
+    check_desired_state(desired_state)
+    return desired_state
+
+def check_desired_state(desired_state):
+    names = set()
+    for org in desired_state.get("provider_orgs", []):
+        for field in ["name", "owner"]:
+            if field not in org:
+                raise Exception("[ERROR] - Provider organization without " + field + ": " + json.dumps(org))
+        if org["name"] in names:
+            raise Exception("[ERROR] - Provider organization " + org["name"] + " is declared more than once")
+        names.add(org["name"])
+        for field in ["username", "email", "first_name", "last_name"]:
+            if field not in org["owner"]:
+                raise Exception("[ERROR] - The owner of " + org["name"] + " has no " + field)
+        if "password" not in org["owner"] and not os.getenv(org["owner"].get("password_env", "")):
+            raise Exception("[ERROR] - The owner of " + org["name"] + " has no password nor a password_env set in the environment")
+        catalog_names = [catalog["name"] for catalog in org.get("catalogs", [])]
+        if len(set(catalog_names)) != len(catalog_names):
+            raise Exception("[ERROR] - Provider organization " + org["name"] + " declares a catalog more than once")
+
+def owner_password(owner):
+    return owner["password"] if "password" in owner else os.environ[owner["password_env"]]
+
+def ensure_owner(owner, ctx):
+    user, _ = provider_orgs.ensure_owner(ctx["provider_user_registry_default_url"], dict(owner, password=owner_password(owner)),
+                                         ctx["admin_bearer_token"], client=ctx["client"])
+    return {"owner_url:" + owner["username"]: user["url"]}
+
+def get_owner_bearer_token(owner, ctx):
+    token = api_calls.get_bearer_token(ctx["environment_config"]["APIC_API_MANAGER_URL"],
+                                       owner["username"],
+                                       owner_password(owner),
+                                       PROVIDER_REALM,
+                                       ctx["toolkit_credentials"]["toolkit"]["client_id"],
+                                       ctx["toolkit_credentials"]["toolkit"]["client_secret"],
+                                       client=ctx["client"])
+    return {"provider_bearer_token:" + owner["username"]: token}
+
+def ensure_org(org, ctx):
+    provider_org, _ = provider_orgs.ensure_provider_org('https://' + ctx["environment_config"]["APIC_ADMIN_URL"], org["name"], org.get("title", org["name"]),
+                                                        ctx["owner_url:" + org["owner"]["username"]], ctx["admin_bearer_token"], client=ctx["client"])
+    return {"provider_org_id:" + org["name"]: provider_org["id"]}
+
+def ensure_catalog(org, catalog, ctx):
+    provider_org_id = ctx["provider_org_id:" + org["name"]]
+    token = ctx["provider_bearer_token:" + org["owner"]["username"]]
+    resource, _ = catalogs.ensure_catalog('https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"], provider_org_id, catalog, token, client=ctx["client"])
+    return {"catalog_id:" + org["name"] + "/" + catalog["name"]: resource["id"]}
+
+def get_gateway_service_id(gateway_service_name, ctx):
+    """
+    Looks the gateway service up by name in every availability zone of the
+    topology (see config_apicv10.get_topology).
+    """
+    found = []
+    for zone in config_apicv10.get_topology(ctx["environment_config"]):
+        gateway_service = ctx["resolver"].find(config_apicv10.zone_url(ctx, zone) + '/gateway-services', ctx["admin_bearer_token"], 'name', gateway_service_name)
+        if gateway_service is not None:
+            found.append((zone["name"], gateway_service))
+    if not found:
+        raise Exception("[ERROR] - The gateway service " + gateway_service_name + " was not found in any availability zone of the IBM API Connect Cluster instance")
+    if len(found) > 1:
+        raise Exception("[ERROR] - The gateway service " + gateway_service_name + " is registered in several availability zones: " + ", ".join(zone for zone, _ in found))
+    return {"gateway_service_id:" + gateway_service_name: found[0][1]["id"]}
+
+def ensure_gateway_association(org, catalog, gateway_service_name, ctx):
+    provider_org_id = ctx["provider_org_id:" + org["name"]]
+    gateway_service_id = ctx["gateway_service_id:" + gateway_service_name]
+    api_manager_url = 'https://' + ctx["environment_config"]["APIC_API_MANAGER_URL"]
+    url = api_manager_url + '/api/catalogs/' + provider_org_id + '/' + ctx["catalog_id:" + org["name"] + "/" + catalog["name"]] + '/configured-gateway-services'
+    data = {"gateway_service_url": api_manager_url + '/api/orgs/' + provider_org_id + '/gateway-services/' + gateway_service_id}
+    reconcile.ensure_member(url, ctx["provider_bearer_token:" + org["owner"]["username"]], 'gateway_service_url', gateway_service_id, data, client=ctx["client"])
+    return {}
+
+def build_steps(desired_state):
+    """
+    Turns the desired state into executor steps. Owners shared by several
+    orgs are only registered once and their token is only requested once,
+    and every gateway service is only looked up once.
+    """
+    steps = [
+        readiness.readiness_step("management"),
+        readiness.readiness_step("api_manager"),
+        executor.Step("admin_bearer_token", config_apicv10.get_admin_bearer_token,
+                      requires=["environment_config", "toolkit_credentials", "management_ready"],
+                      provides=["admin_bearer_token"]),
+        executor.Step("provider_user_registry", config_apicv10.get_provider_user_registry,
+                      requires=["admin_bearer_token"],
+                      provides=["provider_user_registry_default_url"]),
+        executor.Step("admin_org_id", config_apicv10.get_admin_org_id,
+                      requires=["admin_bearer_token"],
+                      provides=["admin_org_id"])
+    ]
+    owners = set()
+    gateway_services = set()
+    for org in desired_state.get("provider_orgs", []):
+        owner = org["owner"]
+        username = owner["username"]
+        if username not in owners:
+            owners.add(username)
+            steps.append(executor.Step("owner:" + username, partial(ensure_owner, owner),
+                                       requires=["admin_bearer_token", "provider_user_registry_default_url"],
+                                       provides=["owner_url:" + username]))
+            steps.append(executor.Step("owner_token:" + username, partial(get_owner_bearer_token, owner),
+                                       requires=["toolkit_credentials", "owner_url:" + username, "api_manager_ready"],
+                                       provides=["provider_bearer_token:" + username]))
+        steps.append(executor.Step("org:" + org["name"], partial(ensure_org, org),
+                                   requires=["admin_bearer_token", "owner_url:" + username],
+                                   provides=["provider_org_id:" + org["name"]]))
+        for catalog in org.get("catalogs", []):
+            catalog_key = org["name"] + "/" + catalog["name"]
+            steps.append(executor.Step("catalog:" + catalog_key, partial(ensure_catalog, org, catalog),
+                                       requires=["provider_bearer_token:" + username, "provider_org_id:" + org["name"]],
+                                       provides=["catalog_id:" + catalog_key]))
+            for gateway_service_name in catalog.get("gateway_services", []):
+                if gateway_service_name not in gateway_services:
+                    gateway_services.add(gateway_service_name)
+                    steps.append(executor.Step("gateway_service:" + gateway_service_name, partial(get_gateway_service_id, gateway_service_name),
+                                               requires=["admin_bearer_token", "admin_org_id"],
+                                               provides=["gateway_service_id:" + gateway_service_name]))
+                steps.append(executor.Step("gateway_association:" + catalog_key + "/" + gateway_service_name,
+                                           partial(ensure_gateway_association, org, catalog, gateway_service_name),
+                                           requires=["provider_bearer_token:" + username, "provider_org_id:" + org["name"], "catalog_id:" + catalog_key,
+                                                     "gateway_service_id:" + gateway_service_name]))
+    return steps
+
+def apply(desired_state, environment_config, toolkit_credentials, client=None, max_workers=executor.MAX_WORKERS):
+    """
+    Applies the desired state and returns the resulting context, which holds
+    the id of every org and catalog.
+    """
+    client = client or api_calls.get_client()
+    resource_resolver = resolver.ResourceResolver(client)
+    context = {
+        "environment_config": environment_config,
+        "toolkit_credentials": toolkit_credentials,
+        "client": client,
+        "resolver": resource_resolver,
+        "readiness_deadline": resilience.Deadline(readiness.READINESS_TIMEOUT)
+    }
+    try:
+        return executor.run_steps(build_steps(desired_state), context, max_workers)
+    finally:
+        resource_resolver.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a desired state of provider organizations and catalogs to IBM API Connect")
+    parser.add_argument("desired_state_file", help="JSON (or YAML) desired state file")
+    parser.add_argument("--workers", type=int, default=executor.MAX_WORKERS, help="Maximum number of steps running at the same time")
+    args = parser.parse_args()
+
+    try:
+        desired_state = load_desired_state(args.desired_state_file)
+        environment_config, toolkit_credentials = config_apicv10.load_configuration(os.environ["CONFIG_FILES_DIR"])
+        client = api_calls.APICClient(pool_size=max(args.workers, api_calls.POOL_SIZE))
+        context = apply(desired_state, environment_config, toolkit_credentials, client=client, max_workers=args.workers)
+        org_ids = [value for value in context if value.startswith("provider_org_id:")]
+        catalog_ids = [value for value in context if value.startswith("catalog_id:")]
+        print(INFO + "Desired state applied: " + str(len(org_ids)) + " provider organizations and " + str(len(catalog_ids)) + " catalogs")
+    except Exception as e:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
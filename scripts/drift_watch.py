@@ -0,0 +1,301 @@
+import os, json, time, hashlib, tempfile, argparse
+from concurrent.futures import ThreadPoolExecutor
+import log
+import utils
+import api_calls
+import executor
+import resolver
+import http_cache
+import readiness
+import config_apicv10
+
+"""
+
+Watches the resources config_apicv10.py manages for changes made by hand (e.g. in the Cloud Manager or API Manager UI)
+after the configuration run:
+
+    python3 drift_watch.py --interval 60
+
+The first poll is the baseline. On every poll after it, each watched collection is listed page by page and the raw
+pages are hashed into a digest of the whole collection. Only the collections whose digest changed are parsed and
+compared resource by resource, with a digest per resource, so an unchanged collection costs one round trip per page and
+no parsing. Pages are revalidated with their ETag (see http_cache.py), so an unchanged page is not even transferred.
+
+Every change is reported as a JSON line in drift-events.jsonl in the configuration files directory:
+
+    {"time": ..., "collection": "mail_servers", "added": [], "removed": [], "changed": {"default-email-server": {"host": {"before": "smtp.example.com", "after": "smtp.other.com"}}}}
+
+and apic-drift.prom (for the node exporter textfile collector) holds, per collection, how many resources differ from
+the baseline and how many of its polls failed, along with the number of polls and of collections compared. A collection
+that fails to be polled (e.g. the server is unavailable) does not stop the watch nor the other collections of the poll,
+it is polled again on the next one.
+
+"""
+
+FILE_NAME = "drift_watch.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Seconds between the start of two polls
+INTERVAL = float(os.getenv('APIC_DRIFT_INTERVAL','60'))
+EVENTS_FILE_NAME = "drift-events.jsonl"
+PROMETHEUS_FILE_NAME = "apic-drift.prom"
+# Fields the server changes along with any change, or that tell nothing about the configuration
+IGNORED_FIELDS = ['created_at', 'updated_at', 'created_by', 'updated_by']
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def resource_key(resource):
+    # Associations (e.g. configured gateway services) are not always named
+    return str(resource.get('name') or resource.get('username') or resource.get('id') or resource.get('url'))
+
+def fields_of(resource):
+    return dict((key, value) for key, value in resource.items() if key not in IGNORED_FIELDS)
+
+def field_changes(before, after):
+    changes = {}
+    for key in sorted(set(before) | set(after)):
+        if before.get(key) != after.get(key):
+            changes[key] = {"before": before.get(key), "after": after.get(key)}
+    return changes
+
+class WatchedCollection:
+    """
+    A collection (or a single resource when single is set) and what the
+    last polls saw of it: the digest of its raw pages, and the fields and
+    digest of every resource, as in the baseline and as last seen.
+    """
+
+    def __init__(self, name, url, token, single=False):
+        self.name = name
+        self.url = url
+        self.token = token
+        self.single = single
+        self.digest = None
+        self.errors = 0
+        self.resources = None
+        self.digests = None
+        self.baseline = None
+
+    def fetch(self, ctx):
+        """
+        Returns the raw pages of the collection.
+        """
+        if self.single:
+            response = api_calls.make_api_call(self.url, ctx[self.token], 'get', client=ctx["client"])
+            if response.status_code != 200:
+                raise Exception("Return code for getting " + self.url + " isn't 200. It is " + str(response.status_code))
+            return [response]
+        return list(api_calls.iter_pages(self.url, ctx[self.token], client=ctx["client"]))
+
+    def parse(self, pages):
+        if self.single:
+            return {self.name: fields_of(pages[0].json())}
+        resources = {}
+        for page in pages:
+            for resource in page.json().get('results', []):
+                resources[resource_key(resource)] = fields_of(resource)
+        return resources
+
+    def poll(self, ctx):
+        """
+        Polls the collection and returns its drift event since the last
+        poll, None when nothing changed (or on the first poll).
+        """
+        pages = self.fetch(ctx)
+        collection_digest = digest(b''.join(page.content for page in pages))
+        if collection_digest == self.digest:
+            return None
+        resources = self.parse(pages)
+        # Only once parsed, so that pages that could not be parsed are parsed again on the next poll
+        self.digest = collection_digest
+        digests = dict((key, digest(json.dumps(resource, sort_keys=True).encode('utf-8'))) for key, resource in resources.items())
+        previous, previous_digests = self.resources, self.digests
+        self.resources, self.digests = resources, digests
+        if previous is None:
+            self.baseline = digests
+            return None
+        event = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "collection": self.name,
+            "added": sorted(key for key in digests if key not in previous_digests),
+            "removed": sorted(key for key in previous_digests if key not in digests),
+            "changed": dict((key, field_changes(previous[key], resources[key])) for key in sorted(digests)
+                            if key in previous_digests and digests[key] != previous_digests[key])
+        }
+        if not (event["added"] or event["removed"] or event["changed"]):
+            # e.g. the same resources listed in another order
+            return None
+        return event
+
+    def drifted(self):
+        """
+        Returns how many resources differ from the baseline.
+        """
+        if self.baseline is None:
+            return 0
+        keys = set(self.baseline) | set(self.digests)
+        return sum(1 for key in keys if self.baseline.get(key) != self.digests.get(key))
+
+def watched_collections(ctx):
+    environment_config = ctx["environment_config"]
+    admin_url = 'https://' + environment_config["APIC_ADMIN_URL"]
+    admin_org_url = admin_url + '/api/orgs/' + ctx["admin_org_id"]
+    collections = [
+        WatchedCollection("cloud_settings", admin_url + '/api/cloud/settings', "admin_bearer_token", single=True),
+        WatchedCollection("mail_servers", admin_org_url + '/mail-servers', "admin_bearer_token"),
+        WatchedCollection("availability_zones", admin_org_url + '/availability-zones', "admin_bearer_token")
+    ]
+    for zone in config_apicv10.get_topology(environment_config):
+        for kind in ["gateway-services", "analytics-services", "portal-services"]:
+            collections.append(WatchedCollection(kind.replace('-', '_') + ":" + zone["name"], config_apicv10.zone_url(ctx, zone) + '/' + kind, "admin_bearer_token"))
+    return collections + [
+        WatchedCollection("provider_org_owners", ctx["provider_user_registry_default_url"] + '/users', "admin_bearer_token"),
+        WatchedCollection("provider_orgs", admin_url + '/api/cloud/orgs', "admin_bearer_token"),
+        WatchedCollection("configured_gateway_services", 'https://' + environment_config["APIC_API_MANAGER_URL"] + '/api/catalogs/'
+                          + ctx["provider_org_id"] + '/' + ctx["catalog_id"] + '/configured-gateway-services', "provider_bearer_token")
+    ]
+
+class DriftWatcher:
+    """
+    Polls the watched collections concurrently every interval seconds and
+    reports what changed.
+    """
+
+    def __init__(self, ctx, collections, events_file, prometheus_file, workers=executor.MAX_WORKERS):
+        self.ctx = ctx
+        self.collections = collections
+        self.events_file = events_file
+        self.prometheus_file = prometheus_file
+        self.workers = workers
+        self.polls = 0
+        self.compared = 0
+        self.events = 0
+        self.errors = 0
+
+    def poll_collection(self, collection):
+        try:
+            return collection.poll(self.ctx)
+        except Exception as e:
+            # The other collections are still compared, this one is polled again on the next poll
+            collection.errors += 1
+            log.warning(INFO + "Polling %s failed, trying again in the next poll: %r", collection.name, e)
+            return None
+
+    def poll(self):
+        """
+        Polls every collection once and returns the drift events. A
+        collection that fails is counted and left for the next poll.
+        """
+        self.polls += 1
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            digests = dict((collection.name, collection.digest) for collection in self.collections)
+            events = [event for event in pool.map(self.poll_collection, self.collections) if event]
+        self.compared += sum(1 for collection in self.collections if digests[collection.name] not in (None, collection.digest))
+        self.events += len(events)
+        if events:
+            with open(self.events_file, 'a') as f:
+                for event in events:
+                    f.write(json.dumps(event, sort_keys=True) + "\n")
+        for event in events:
+            print(INFO + "Drift in " + event["collection"] + ": " + str(len(event["added"])) + " added, "
+                  + str(len(event["removed"])) + " removed, " + str(len(event["changed"])) + " changed")
+            log.debug(INFO + "%s", log.Body(event))
+        self.write_metrics()
+        return events
+
+    def prometheus(self):
+        lines = [
+            "# HELP apic_drift_resources Resources that differ from the baseline",
+            "# TYPE apic_drift_resources gauge"
+        ]
+        for collection in self.collections:
+            lines.append('apic_drift_resources{collection="' + collection.name + '"} ' + str(collection.drifted()))
+        lines.append("# TYPE apic_drift_polls_total counter")
+        lines.append("apic_drift_polls_total " + str(self.polls))
+        lines.append("# HELP apic_drift_collections_compared_total Collections whose digest changed and were compared resource by resource")
+        lines.append("# TYPE apic_drift_collections_compared_total counter")
+        lines.append("apic_drift_collections_compared_total " + str(self.compared))
+        lines.append("# TYPE apic_drift_events_total counter")
+        lines.append("apic_drift_events_total " + str(self.events))
+        lines.append("# HELP apic_drift_collection_errors_total Polls of a collection that failed (e.g. the server was unavailable) and were skipped")
+        lines.append("# TYPE apic_drift_collection_errors_total counter")
+        for collection in self.collections:
+            lines.append('apic_drift_collection_errors_total{collection="' + collection.name + '"} ' + str(collection.errors))
+        lines.append("# HELP apic_drift_poll_errors_total Polls that failed as a whole (e.g. the events file could not be written)")
+        lines.append("# TYPE apic_drift_poll_errors_total counter")
+        lines.append("apic_drift_poll_errors_total " + str(self.errors))
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        # The textfile collector may read the file at any time
+        utils.write_atomically(self.prometheus_file, self.prometheus())
+
+    def run(self, interval=INTERVAL, polls=0):
+        """
+        Polls until stopped, or polls times when it is more than 0. A failed
+        poll is counted and the next one happens as usual, as the server
+        being unavailable for a while must not end the watch.
+        """
+        try:
+            while True:
+                start = time.time()
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.errors += 1
+                    log.warning(INFO + "Poll failed, trying again in the next one: %r", e)
+                    self.write_metrics()
+                if polls and self.polls >= polls:
+                    return
+                time.sleep(max(interval - (time.time() - start), 0))
+        except KeyboardInterrupt:
+            print(INFO + "Stopped after " + str(self.polls) + " polls and " + str(self.events) + " drift events")
+
+def context(environment_config, toolkit_credentials, client):
+    """
+    Finds the resources the configuration run created, with the same read
+    only steps it uses.
+    """
+    ctx = {
+        "environment_config": environment_config,
+        "toolkit_credentials": toolkit_credentials,
+        "client": client,
+        "resolver": resolver.ResourceResolver(client)
+    }
+    try:
+        for step in [config_apicv10.get_admin_bearer_token, config_apicv10.get_admin_org_id, config_apicv10.get_provider_user_registry,
+                     config_apicv10.get_provider_bearer_token, config_apicv10.get_provider_org_id, config_apicv10.get_catalog_id]:
+            ctx.update(step(ctx))
+    finally:
+        ctx["resolver"].close()
+    return ctx
+
+def new_client(workers):
+    # Pages are always revalidated with their ETag, in the configured HTTP cache or in a temporary one, and never
+    # memoized as every poll must see the changes
+    cache = api_calls.responses
+    if not cache.directory:
+        cache = http_cache.HTTPCache(tempfile.mkdtemp(prefix='apic-drift-'))
+    return api_calls.APICClient(pool_size=max(workers, api_calls.POOL_SIZE), cache=cache, memo_size=0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch the IBM API Connect configuration for changes made by hand")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="Seconds between the start of two polls")
+    parser.add_argument("--polls", type=int, default=0, help="Stop after this many polls, the first one being the baseline (0 never stops)")
+    parser.add_argument("--workers", type=int, default=executor.MAX_WORKERS, help="Maximum number of collections polled at the same time")
+    args = parser.parse_args()
+
+    try:
+        environment_config, toolkit_credentials = config_apicv10.load_configuration(os.environ["CONFIG_FILES_DIR"])
+        readiness.wait_for(environment_config, ["management", "api_manager"])
+        client = new_client(args.workers)
+        ctx = context(environment_config, toolkit_credentials, client)
+        watcher = DriftWatcher(ctx, watched_collections(ctx),
+                               os.path.join(os.environ["CONFIG_FILES_DIR"], EVENTS_FILE_NAME),
+                               os.path.join(os.environ["CONFIG_FILES_DIR"], PROMETHEUS_FILE_NAME),
+                               args.workers)
+        print(INFO + "Watching " + str(len(watcher.collections)) + " collections every " + str(args.interval) + "s")
+        watcher.run(args.interval, args.polls)
+    except Exception as e:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
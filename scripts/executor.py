@@ -0,0 +1,195 @@
+import os, json
+import log
+import utils
+import metrics
+import tracing
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+FILE_NAME = "executor.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Maximum number of steps that can be running at the same time
+MAX_WORKERS = int(os.getenv('APIC_MAX_WORKERS','8'))
+
+class Step:
+    """
+    A named unit of work. The function gets a copy of the context, which is
+    guaranteed to hold every value listed in requires, and must return a dict
+    with every value listed in provides.
+
+    Steps whose outputs must not be written to disk (e.g. bearer tokens) or
+    are as cheap to compute again as to check are created with persist set
+    to False. validate, when given, gets the context and the outputs saved
+    by a previous run and tells whether they still hold.
+    """
+
+    def __init__(self, name, func, requires=(), provides=(), persist=True, validate=None):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.provides = list(provides)
+        self.persist = persist
+        self.validate = validate
+
+class StepState:
+    """
+    Outputs of the steps completed so far, saved to a JSON file after every
+    step so that a failed run can be resumed where it stopped. The file
+    belongs to a target (e.g. the admin url) and is ignored if it was
+    written for another one or if resume is not set.
+    """
+
+    def __init__(self, path, target, resume=False):
+        self.path = path
+        self.target = target
+        self.completed = {}
+        if resume and os.path.isfile(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("target") == target:
+                self.completed = state.get("completed", {})
+            else:
+                print(INFO + "Ignoring " + path + " as it belongs to " + str(state.get("target")))
+        self.save()
+
+    def record(self, step, outputs):
+        self.completed[step.name] = dict((value, outputs[value]) for value in step.provides)
+        self.save()
+
+    def save(self):
+        utils.write_atomically(self.path, json.dumps({"target": self.target, "completed": self.completed}, indent=2), private=True)
+
+def check_steps(steps, context):
+    """
+    Makes sure every step can eventually run: step names are unique, every
+    required value is either already in the context or provided by exactly
+    one step, and there are no dependency cycles.
+    """
+    names = set()
+    providers = {}
+    for step in steps:
+        if step.name in names:
+            raise Exception("[ERROR] - Duplicated step name: " + step.name)
+        names.add(step.name)
+        for value in step.provides:
+            if value in providers or value in context:
+                raise Exception("[ERROR] - The value " + value + " is provided more than once (step " + step.name + ")")
+            providers[value] = step.name
+    available = set(context.keys())
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if set(step.requires) <= available]
+        if not ready:
+            for step in pending:
+                missing = [value for value in step.requires if value not in available and value not in providers]
+                if missing:
+                    raise Exception("[ERROR] - Step " + step.name + " requires values nobody provides: " + ", ".join(missing))
+            raise Exception("[ERROR] - There is a dependency cycle among the steps: " + ", ".join(step.name for step in pending))
+        for step in ready:
+            available.update(step.provides)
+            pending.remove(step)
+
+def run_step(step, context, recorder, saved=None, parent=None):
+    """
+    Runs the step, unless it has saved outputs that still hold, in which
+    case those are returned along with True. parent is the trace span the
+    step belongs to.
+    """
+    with recorder.step(step.name), tracing.span(step.name, "step", parent):
+        if saved is not None and (step.validate is None or step.validate(context, saved)):
+            print(INFO + "Step " + step.name + " already completed, resuming after it")
+            return saved, True
+        return step.func(context), False
+
+def run_steps(steps, context=None, max_workers=MAX_WORKERS, recorder=None, state=None):
+    """
+    Runs every step as soon as all the values it requires are available, so
+    independent steps run concurrently and the total time is bounded by the
+    critical path rather than by the sum of all the steps.
+
+    Returns the context with every provided value added to it. If a step fails,
+    no further steps are started, the running ones are waited for and the first
+    error is raised.
+
+    The wall-clock time of every step goes to the recorder (by default the
+    shared metrics recorder), and to a trace span whose parent is the span
+    open in the calling thread.
+
+    With a state, the outputs of every persisted step are saved as soon as
+    it succeeds, and steps completed by a previous run are only validated,
+    unless any of their inputs came out different this time.
+    """
+    recorder = recorder or metrics.recorder
+    context = dict(context or {})
+    check_steps(steps, context)
+    parent = tracing.current()
+    pending = list(steps)
+    running = {}
+    errors = []
+    changed = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            if not errors:
+                for step in [step for step in pending if all(value in context for value in step.requires)]:
+                    log.debug(INFO + "Starting step %s", step.name)
+                    saved = None
+                    if state is not None and step.persist and not changed.intersection(step.requires):
+                        saved = state.completed.get(step.name)
+                    running[pool.submit(run_step, step, dict(context), recorder, saved, parent)] = step
+                    pending.remove(step)
+            if not running:
+                break
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    outputs, restored = future.result()
+                    outputs = outputs or {}
+                    missing = [value for value in step.provides if value not in outputs]
+                    if missing:
+                        raise Exception("Step did not return " + ", ".join(missing))
+                except Exception as e:
+                    errors.append((step, e))
+                    continue
+                log.debug(INFO + "Finished step %s", step.name)
+                for value in step.provides:
+                    context[value] = outputs[value]
+                if state is not None and step.persist and not restored:
+                    previous = state.completed.get(step.name) or {}
+                    changed.update(value for value in step.provides if previous.get(value) != outputs[value])
+                    state.record(step, outputs)
+
+    if errors:
+        step, e = errors[0]
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": step " + step.name + " failed: " + repr(e))
+    return context
+
+class Crawler:
+    """
+    Runs tasks on a bounded pool of workers. A task may return more tasks
+    (e.g. listing the catalogs of every org just listed, see
+    export_config.py), which are started right away. The first failure
+    stops the crawl.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+
+    def run(self, tasks):
+        running = set()
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            running.update(pool.submit(task) for task in tasks)
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        children = future.result() or []
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    if not errors:
+                        running.update(pool.submit(task) for task in children)
+        if errors:
+            raise errors[0]
@@ -0,0 +1,199 @@
+import os, json, argparse
+from urllib.parse import urlsplit
+import api_calls
+import executor
+import reconcile
+import readiness
+import metrics
+import config_apicv10
+
+"""
+
+Exports the configuration of a live IBM API Connect instance into a snapshot file, the starting point to make another
+cluster a replica of it:
+
+    python3 export_config.py --output /source/apic-snapshot.json --workers 16
+
+With the Cloud Manager admin token it exports the cloud settings, the user registry settings, the admin organization's
+mail servers, TLS profiles, user registries and availability zones (with their gateway, analytics and portal services)
+and the list of provider organizations. When PROV_ORG_OWNER_USERNAME and PROV_ORG_OWNER_PASSWORD are set, the catalogs
+and configured gateway services of every provider organization that user can see are exported with its own token.
+
+Collections are listed page by page and every listing runs on a bounded pool of workers as soon as the resource it
+belongs to is known. The owner of every provider organization is exported along with it. The snapshot is normalized
+so that two exports of equivalent clusters are byte for byte equal: server generated ids, urls and timestamps are
+dropped, references to other exported resources are replaced by their path in the snapshot (e.g.
+admin/tls_server_profiles/tls-server-profile-default), even when they point at the resource through another url (a
+gateway service is referred to under its organization rather than under its availability zone), lists are sorted by
+name and keys are sorted. Endpoints and hosts are configuration and are kept as they are, and references to resources
+that were not exported are kept as the template of their url prefixed with unresolved:.
+
+"""
+
+FILE_NAME = "export_config.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+SNAPSHOT_FILE_NAME = "apic-snapshot.json"
+# Fields generated by the server, which differ from one cluster to another
+GENERATED_FIELDS = ['id', 'url', 'created_at', 'updated_at', 'created_by', 'updated_by']
+
+def get_resource(url, bearer_token, client):
+    response = api_calls.make_api_call(url, bearer_token, 'get', client=client)
+    if response.status_code != 200:
+        raise Exception("Return code for getting " + url + " isn't 200. It is " + str(response.status_code))
+    return response.json()
+
+def list_collection(url, bearer_token, client):
+    return list(api_calls.iter_collection(url, bearer_token, client=client))
+
+def export(environment_config, toolkit_credentials, client=None, workers=executor.MAX_WORKERS):
+    """
+    Crawls the instance and returns its raw (not normalized) snapshot.
+    """
+    client = client or api_calls.get_client()
+    ctx = {"environment_config": environment_config, "toolkit_credentials": toolkit_credentials, "client": client}
+    readiness.wait_for(environment_config, ["management", "api_manager"])
+    admin_token = config_apicv10.get_admin_bearer_token(ctx)["admin_bearer_token"]
+    admin_url = 'https://' + environment_config["APIC_ADMIN_URL"]
+    api_manager_url = 'https://' + environment_config["APIC_API_MANAGER_URL"]
+    snapshot = {"admin": {}, "provider_orgs": []}
+    catalogs = {}
+
+    def resource_task(url, token, target, key):
+        def task():
+            target[key] = get_resource(url, token, client)
+        return task
+
+    def collection_task(url, token, target, key, expand=None):
+        def task():
+            target[key] = list_collection(url, token, client)
+            return [child for resource in target[key] for child in (expand(resource) if expand else [])]
+        return task
+
+    def expand_availability_zone(zone):
+        zone_url = admin_url + '/api/orgs/' + admin_org['id'] + '/availability-zones/' + zone['name']
+        return [collection_task(zone_url + '/' + kind, admin_token, zone, kind.replace('-', '_'))
+                for kind in ['gateway-services', 'analytics-services', 'portal-services']]
+
+    def expand_owner(org):
+        if not org.get('owner_url') or org.get('org_type') == 'admin':
+            return []
+        return [resource_task(org['owner_url'], admin_token, org, 'owner')]
+
+    def expand_provider_org(org):
+        org_catalogs = catalogs.setdefault(org['name'], {})
+        return [collection_task(api_manager_url + '/api/orgs/' + org['id'] + '/catalogs', provider_token, org_catalogs, 'catalogs', expand_catalog(org))]
+
+    def expand_catalog(org):
+        def expand(catalog):
+            url = api_manager_url + '/api/catalogs/' + org['id'] + '/' + catalog['id'] + '/configured-gateway-services'
+            return [collection_task(url, provider_token, catalog, 'configured_gateway_services')]
+        return expand
+
+    admin_org = next((org for org in api_calls.iter_collection(admin_url + '/api/cloud/orgs', admin_token, client=client) if org.get('org_type') == 'admin'), None)
+    if admin_org is None:
+        raise Exception("[ERROR] - The Admin Organization was not found in the IBM API Connect Cluster instance")
+    admin_org_url = admin_url + '/api/orgs/' + admin_org['id']
+    admin = snapshot["admin"]
+    tasks = [
+        resource_task(admin_url + '/api/cloud/settings', admin_token, admin, 'settings'),
+        resource_task(admin_url + '/api/cloud/settings/user-registries', admin_token, admin, 'user_registry_settings'),
+        collection_task(admin_org_url + '/mail-servers', admin_token, admin, 'mail_servers'),
+        collection_task(admin_org_url + '/tls-server-profiles', admin_token, admin, 'tls_server_profiles'),
+        collection_task(admin_org_url + '/tls-client-profiles', admin_token, admin, 'tls_client_profiles'),
+        collection_task(admin_org_url + '/user-registries', admin_token, admin, 'user_registries'),
+        collection_task(admin_org_url + '/availability-zones', admin_token, admin, 'availability_zones', expand_availability_zone),
+        collection_task(admin_url + '/api/cloud/orgs', admin_token, snapshot, 'provider_orgs', expand_owner)
+    ]
+    provider_token = None
+    if os.getenv("PROV_ORG_OWNER_USERNAME") and os.getenv("PROV_ORG_OWNER_PASSWORD"):
+        provider_token = config_apicv10.get_provider_bearer_token(ctx)["provider_bearer_token"]
+        tasks.append(collection_task(api_manager_url + '/api/orgs', provider_token, {}, 'orgs', expand_provider_org))
+    else:
+        print(INFO + "PROV_ORG_OWNER_USERNAME and PROV_ORG_OWNER_PASSWORD are not set, the catalogs are not exported")
+    executor.Crawler(workers).run(tasks)
+
+    snapshot["provider_orgs"] = [org for org in snapshot["provider_orgs"] if org.get('org_type') != 'admin']
+    for org in snapshot["provider_orgs"]:
+        if org['name'] in catalogs:
+            org['catalogs'] = catalogs[org['name']].get('catalogs', [])
+    return snapshot
+
+def resource_kind(url):
+    """
+    Returns the collection and the id (or name) a resource url ends with,
+    e.g. ('gateway-services', '<id>'), which is the same whichever url the
+    resource is referred to through.
+    """
+    segments = urlsplit(url).path.rstrip('/').split('/')
+    # The organization may come between the collection and the resource, e.g. /api/user-registries/<org id>/<name>
+    collections = [segment for segment in segments[:-1] if segment and not metrics.ID_PATTERN.match(segment)]
+    if not collections:
+        return None
+    return collections[-1], segments[-1]
+
+def references(node, path, index):
+    """
+    Indexes the url of every resource in the snapshot by its path in it,
+    and its collection along with its id and its name too. A collection and
+    name shared by several resources (e.g. the sandbox catalog of every
+    organization) refers to none of them.
+    """
+    if isinstance(node, dict):
+        if isinstance(node.get('url'), str):
+            index[node['url'].rstrip('/')] = path
+            for key in [node.get('id'), node.get('name')]:
+                if key:
+                    kind = (resource_kind(node['url'])[0], key)
+                    index[kind] = path if index.get(kind, path) == path else None
+        for key, value in node.items():
+            references(value, path + '/' + key, index)
+    elif isinstance(node, list):
+        for item in node:
+            name = item.get('name', item.get('title', '')) if isinstance(item, dict) else ''
+            references(item, path + '/' + str(name), index)
+
+def normalize(node, index):
+    """
+    Returns the snapshot without what is specific to the cluster it comes
+    from, in a deterministic order.
+    """
+    if isinstance(node, dict):
+        return dict((key, normalize(value, index)) for key, value in node.items()
+                    if key not in GENERATED_FIELDS and key not in reconcile.SECRET_FIELDS)
+    if isinstance(node, list):
+        items = [normalize(item, index) for item in node]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True) if not isinstance(item, dict)
+                      else str(item.get('name', '')) + '|' + json.dumps(item, sort_keys=True))
+    if isinstance(node, str) and node.startswith('https://') and urlsplit(node).path.startswith('/api/'):
+        if node.rstrip('/') in index:
+            return index[node.rstrip('/')]
+        if index.get(resource_kind(node)):
+            return index[resource_kind(node)]
+        # Urls of resources that were not exported, without their host and ids
+        return "unresolved:" + metrics.endpoint_template(node)
+    # Anything else, e.g. the endpoint of a service, is configuration
+    return node
+
+def snapshot_json(snapshot):
+    index = {}
+    references(snapshot, '', index)
+    index = dict((key, path.lstrip('/') if path is not None else None) for key, path in index.items())
+    return json.dumps(normalize(snapshot, index), sort_keys=True, separators=(',', ':'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the configuration of an IBM API Connect instance into a snapshot")
+    parser.add_argument("--output", help="Snapshot file, " + SNAPSHOT_FILE_NAME + " in the configuration files directory by default")
+    parser.add_argument("--workers", type=int, default=executor.MAX_WORKERS, help="Maximum number of listings running at the same time")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.environ["CONFIG_FILES_DIR"], SNAPSHOT_FILE_NAME)
+    try:
+        environment_config, toolkit_credentials = config_apicv10.load_configuration(os.environ["CONFIG_FILES_DIR"])
+        client = api_calls.APICClient(pool_size=max(args.workers, api_calls.POOL_SIZE))
+        snapshot = export(environment_config, toolkit_credentials, client=client, workers=args.workers)
+        with open(output, "w") as f:
+            f.write(snapshot_json(snapshot))
+        print(INFO + "Snapshot of " + str(len(snapshot["provider_orgs"])) + " provider organizations written to " + output)
+    except Exception as e:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
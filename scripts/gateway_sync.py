@@ -0,0 +1,146 @@
+import os, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+import log
+import api_calls
+import executor
+import resilience
+import resolver
+import readiness
+
+"""
+
+Verifies that the configuration of the catalogs has reached the gateways. APIC sends it to DataPower asynchronously
+after the configured gateway services are created, so whatever comes next (e.g. publishing APIs) would race it:
+
+    python3 gateway_sync.py --timeout 600
+
+The configured gateway services of the sandbox catalog and of the catalogs listed in APIC_CATALOGS are listed, and the
+gateway processing status of every one of them is polled at the same time until it has no outstanding events (neither
+sent to the gateway nor queued). Each gateway is polled every MIN_INTERVAL seconds at first, twice as rarely every time
+its status does not move, up to MAX_INTERVAL, and again every MIN_INTERVAL as soon as it moves (see
+resilience.poll_until). A status that cannot be read for a while (e.g. the API manager restarting) is polled again
+too. All of them share one timeout, and the verification ends as soon as the last one is synced, with a report of every
+gateway. At most executor.MAX_WORKERS gateways are polled at the same time.
+
+It also runs as the last step of config_apicv10.py when APIC_VERIFY_GATEWAY_SYNC is set.
+
+"""
+
+FILE_NAME = "gateway_sync.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Seconds all the gateways have to be synced within
+SYNC_TIMEOUT = float(os.getenv('APIC_GATEWAY_SYNC_TIMEOUT','600'))
+# When set, config_apicv10.py waits for the gateways to be synced before it ends
+VERIFY_GATEWAY_SYNC = os.getenv('APIC_VERIFY_GATEWAY_SYNC','')
+MIN_INTERVAL = 1.0
+MAX_INTERVAL = 15.0
+
+def configured_gateway_services(api_manager_url, provider_org_id, catalog_names, bearer_token, client=None):
+    """
+    Returns the configured gateway services of the catalogs, each with the
+    name of its catalog added as catalog.
+    """
+    members = []
+    for catalog_name in catalog_names:
+        url = api_manager_url + '/api/catalogs/' + provider_org_id + '/' + catalog_name + '/configured-gateway-services'
+        for member in api_calls.iter_collection(url, bearer_token, client=client):
+            members.append(dict(member, catalog=catalog_name))
+    return members
+
+def sync_status(configured_gateway_service, bearer_token, client=None):
+    """
+    Returns whether the configured gateway service is synced, its number of
+    outstanding events and, when its status cannot be read for the time
+    being (no answer even after the retries of the call, a 429 or a 5xx),
+    why. Raises on any other answer, e.g. a 404 once the gateway service is
+    no longer configured.
+    """
+    url = configured_gateway_service['url'] + '/gateway-processing-status'
+    try:
+        # Every poll must reach the server, so the status is never served from the run memo
+        response = api_calls.make_api_call(url, bearer_token, 'get', client=client, memoize=False)
+    except Exception as e:
+        return False, None, repr(e)
+    if response.status_code == 429 or response.status_code >= 500:
+        return False, None, "return code " + str(response.status_code)
+    if response.status_code != 200:
+        raise Exception("Return code for getting " + url + " isn't 200. It is " + str(response.status_code))
+    status = response.json()
+    outstanding = status.get('outstanding_sent_events', 0) + status.get('outstanding_queued_events', 0)
+    return outstanding == 0, outstanding, ""
+
+def wait_until_synced(configured_gateway_service, bearer_token, deadline, client=None):
+    """
+    Polls the configured gateway service until it is synced or the deadline
+    runs out, and returns its report. A status that cannot be read for the
+    time being is polled again like any other until the deadline.
+    """
+    name = configured_gateway_service['catalog'] + "/" + configured_gateway_service.get('name', configured_gateway_service['id'])
+    report = {"gateway": name, "synced": False, "seconds": 0.0, "polls": 0, "outstanding": None, "error": ""}
+    start = time.time()
+
+    def check():
+        synced, outstanding, error = sync_status(configured_gateway_service, bearer_token, client)
+        report["polls"] += 1
+        report["error"] = error
+        if not error:
+            report["outstanding"] = outstanding
+        return synced, error or outstanding
+
+    def waiting(outcome, wait):
+        if report["error"]:
+            log.warning(INFO + "Getting the status of %s failed (%s), checking again in %.1fs", name, report["error"], wait)
+        else:
+            log.debug(INFO + "%s has %s outstanding events, checking again in %.1fs", name, outcome, wait)
+
+    try:
+        report["synced"], _ = resilience.poll_until(check, deadline, MIN_INTERVAL, MAX_INTERVAL, waiting)
+        if not report["synced"]:
+            report["error"] = ("still failing after " + str(deadline.budget) + "s: " + report["error"] if report["error"]
+                               else "still " + str(report["outstanding"]) + " outstanding events after " + str(deadline.budget) + "s")
+    except Exception as e:
+        report["error"] = repr(e)
+    report["seconds"] = round(time.time() - start, 1)
+    return report
+
+def verify(api_manager_url, provider_org_id, catalog_names, bearer_token, timeout=SYNC_TIMEOUT, client=None):
+    """
+    Waits until every configured gateway service of the catalogs is synced,
+    raising if any is not within the timeout. Returns the reports.
+    """
+    client = client or api_calls.get_client()
+    members = configured_gateway_services(api_manager_url, provider_org_id, catalog_names, bearer_token, client)
+    deadline = resilience.Deadline(timeout)
+    reports = []
+    if members:
+        with ThreadPoolExecutor(max_workers=min(len(members), executor.MAX_WORKERS)) as pool:
+            reports = list(pool.map(lambda member: wait_until_synced(member, bearer_token, deadline, client), members))
+    if not reports:
+        print(INFO + "No gateway service is configured in " + ", ".join(catalog_names))
+    for report in reports:
+        print(INFO + report["gateway"] + ": " + ("synced" if report["synced"] else "NOT synced") + " after " + str(report["seconds"]) + "s and "
+              + str(report["polls"]) + " polls" + (" - " + report["error"] if report["error"] else ""))
+    failed = [report["gateway"] for report in reports if not report["synced"]]
+    if failed:
+        raise Exception("[ERROR] - " + str(len(failed)) + " gateways are not synced: " + ", ".join(failed))
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wait until the configuration of the catalogs has reached the gateways")
+    parser.add_argument("--timeout", type=float, default=SYNC_TIMEOUT, help="Seconds all the gateways have to be synced within")
+    args = parser.parse_args()
+
+    # Imported here as config_apicv10.py imports this module for its last step
+    import config_apicv10
+    try:
+        environment_config, toolkit_credentials = config_apicv10.load_configuration(os.environ["CONFIG_FILES_DIR"])
+        readiness.wait_for(environment_config, ["api_manager"])
+        ctx = {"environment_config": environment_config, "toolkit_credentials": toolkit_credentials, "client": api_calls.get_client()}
+        ctx["resolver"] = resolver.ResourceResolver(ctx["client"])
+        ctx.update(config_apicv10.get_provider_bearer_token(ctx))
+        ctx.update(config_apicv10.get_provider_org_id(ctx))
+        verify('https://' + environment_config["APIC_API_MANAGER_URL"], ctx["provider_org_id"], config_apicv10.catalog_names(environment_config),
+               ctx["provider_bearer_token"], args.timeout, ctx["client"])
+    except Exception as e:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
@@ -0,0 +1,154 @@
+import os, json, time, hashlib, threading
+import log
+import utils
+import transport
+
+FILE_NAME = "http_cache.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# When set, GET responses with an ETag or a Last-Modified header are kept in CONFIG_FILES_DIR and revalidated
+DISK_CACHE = os.getenv('APIC_HTTP_CACHE','')
+# Maximum size of the cache in megabytes, the least recently used responses are dropped beyond it
+MAX_SIZE = float(os.getenv('APIC_HTTP_CACHE_SIZE','50'))
+CACHE_DIR_NAME = "http-cache"
+# Response headers kept along with the body
+KEPT_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+
+class HTTPCache:
+    """
+    Disk cache of GET responses, one file per url and token identity (the
+    same url may list different resources to different users), revalidated
+    with the server on every use: the request carries If-None-Match and
+    If-Modified-Since, and a 304 answer is served from the cached body. So
+    nothing stale is ever returned, and an unchanged resource costs a round
+    trip but no transfer.
+
+    The cache is bounded to max_bytes, dropping the least recently used
+    responses first. Without a directory it caches nothing.
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_SIZE * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # key -> size, last use and url (only known for the entries used by this run)
+        self._entries = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for f in os.scandir(directory):
+                if f.name.endswith('.json'):
+                    stat = f.stat()
+                    self._entries[f.name[:-5]] = {"size": stat.st_size, "used": stat.st_mtime, "url": None}
+
+    def _key(self, url, identity):
+        return hashlib.sha256((url + '|' + (identity or '')).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, url, identity):
+        """
+        Returns the cached entry of the url for the identity, None if there is
+        none.
+        """
+        if not self.directory:
+            return None
+        key = self._key(url, identity)
+        with self._lock:
+            if key not in self._entries:
+                return None
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries[key].update(used=time.time(), url=url)
+        return entry
+
+    def validators(self, entry):
+        headers = {}
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    def put(self, url, identity, response):
+        """
+        Keeps the response if the server sent a validator for it.
+        """
+        if not self.directory or not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            return
+        try:
+            body = response.content.decode('utf-8')
+        except UnicodeDecodeError:
+            return
+        entry = {
+            "url": url,
+            "headers": dict((name, response.headers[name]) for name in KEPT_HEADERS if name in response.headers),
+            "body": body
+        }
+        key = self._key(url, identity)
+        utils.write_atomically(self._path(key), json.dumps(entry), private=True)
+        with self._lock:
+            self._entries[key] = {"size": os.path.getsize(self._path(key)), "used": time.time(), "url": url}
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            total = sum(entry["size"] for entry in self._entries.values())
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key in sorted(self._entries, key=lambda key: self._entries[key]["used"]):
+                if total <= self.max_bytes:
+                    break
+                total -= self._entries.pop(key)["size"]
+                evicted.append(key)
+        for key in evicted:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+        log.debug(INFO + "Evicted %s responses to stay under %s bytes", len(evicted), self.max_bytes)
+
+    def response(self, entry, not_modified):
+        """
+        Builds the response to return for a 304 answer out of the cached entry.
+        """
+        return transport.Response(200, 'OK', transport.Headers(entry["headers"]), entry["body"].encode('utf-8'),
+                                  not_modified.request, not_modified.elapsed.total_seconds())
+
+    def invalidate(self, url):
+        """
+        Drops the cached responses of the url and of everything under it
+        (e.g. a collection after one of its members has been written).
+        Entries not used by this run are only revalidated, never served
+        without asking the server, so they can be left alone.
+        """
+        prefix = url.split('?')[0].rstrip('/')
+        collection = prefix.rsplit('/', 1)[0]
+        with self._lock:
+            keys = []
+            for key, entry in self._entries.items():
+                path = (entry["url"] or '').split('?')[0].rstrip('/')
+                # Anchored on a path segment, so that writing /api/orgs/abc leaves /api/orgs/abcd alone
+                if path and (path == prefix or path.startswith(prefix + '/') or path == collection):
+                    keys.append(key)
+            for key in keys:
+                self._entries.pop(key)
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+def default_cache_dir():
+    if DISK_CACHE and os.getenv('CONFIG_FILES_DIR'):
+        return os.path.join(os.environ['CONFIG_FILES_DIR'], CACHE_DIR_NAME)
+    return None
@@ -0,0 +1,99 @@
+import os, json
+
+"""
+
+Leveled logging for the configuration scripts. Messages keep the usual "[INFO][file] - " prefix given by the caller and
+are only formatted when their level is enabled, so that debug output of large payloads costs nothing when it is off:
+
+    log.debug(INFO + "Response: %s", log.Body(response.json()))
+
+Payloads go through Body, which redacts secrets and truncates the result to APIC_LOG_MAX_BODY characters.
+
+The level is APIC_LOG_LEVEL (DEBUG, INFO, WARNING or ERROR), DEBUG by default when DEBUG is set and INFO otherwise.
+
+"""
+
+FILE_NAME = "log.py"
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+LEVEL = LEVELS[os.getenv('APIC_LOG_LEVEL', 'DEBUG' if os.getenv('DEBUG','') else 'INFO').upper()]
+# Maximum number of characters of a payload that get logged
+MAX_BODY = int(os.getenv('APIC_LOG_MAX_BODY','2000'))
+# Fields and headers whose names contain any of these never get their values logged
+SECRET_FIELDS = ['password', 'secret', '_token', 'authorization']
+REDACTED = "********"
+
+def enabled(level):
+    return level >= LEVEL
+
+def log(level, message, *args):
+    if enabled(level):
+        print(message % args if args else message)
+
+def debug(message, *args):
+    log(DEBUG, message, *args)
+
+def info(message, *args):
+    log(INFO, message, *args)
+
+def warning(message, *args):
+    log(WARNING, message, *args)
+
+def redact(data):
+    """
+    Returns a copy of data with the values of the secret fields replaced.
+    """
+    if isinstance(data, dict):
+        return dict((k, REDACTED if any(field in str(k).lower() for field in SECRET_FIELDS) else redact(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return [redact(item) for item in data]
+    return data
+
+def truncate(text, limit=None):
+    limit = MAX_BODY if limit is None else limit
+    if len(text) <= limit:
+        return text
+    return text[:limit] + "... (" + str(len(text) - limit) + " more characters)"
+
+def mask(token):
+    # Enough to tell tokens apart in the logs, not enough to use them
+    return token[:6] + REDACTED if token else str(token)
+
+class Body:
+    """
+    A payload (anything JSON serializable, or raw bytes or text) formatted
+    only when the message it is part of gets logged.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        data = self.data
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                return truncate(data)
+        return truncate(json.dumps(redact(data)))
+
+class Request:
+    """
+    A prepared request (method, url, headers and body) formatted only when
+    the message it is part of gets logged.
+    """
+
+    def __init__(self, req):
+        self.req = req
+
+    def __str__(self):
+        headers = redact(dict(self.req.headers))
+        text = self.req.method + " " + self.req.url + " " + json.dumps(headers)
+        if self.req.body:
+            text += " " + str(Body(self.req.body))
+        return text
@@ -0,0 +1,213 @@
+import os, re, json, time, threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import utils
+
+FILE_NAME = "metrics.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+JSON_FILE_NAME = "metrics.json"
+PROMETHEUS_FILE_NAME = "apic-config.prom"
+
+# Ids (uuids or long hex strings) are replaced so that calls to the same endpoint are aggregated together
+ID_PATTERN = re.compile(r'^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{16,})$')
+
+def endpoint_template(url):
+    """
+    Returns the path of the url with every id replaced by {id}, e.g.
+    /api/orgs/{id}/tls-server-profiles
+    """
+    segments = urlsplit(url).path.split('/')
+    return '/'.join('{id}' if ID_PATTERN.match(segment) else segment for segment in segments)
+
+class Histogram:
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0,
+            "max": round(self.max, 6)
+        }
+
+    def prometheus(self, name, labels):
+        lines = []
+        for bound, value in zip(BUCKETS, self.buckets):
+            lines.append(name + '_bucket{' + labels + ',le="' + str(bound) + '"} ' + str(value))
+        lines.append(name + '_bucket{' + labels + ',le="+Inf"} ' + str(self.count))
+        lines.append(name + '_sum{' + labels + '} ' + repr(round(self.sum, 6)))
+        lines.append(name + '_count{' + labels + '} ' + str(self.count))
+        return lines
+
+class MetricsRecorder:
+    """
+    Aggregates, per endpoint template and per configuration step, the
+    timing and size of everything a run does. Only aggregates are kept so
+    memory does not grow with the number of calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = {}
+        self.steps = {}
+        self.hosts = {}
+
+    def record_call(self, verb, url, status, latency, retries=0, bytes_sent=0, bytes_received=0, new_connection=False):
+        key = (verb.upper(), endpoint_template(url))
+        with self._lock:
+            endpoint = self.endpoints.get(key)
+            if endpoint is None:
+                endpoint = {
+                    "latency": Histogram(),
+                    "statuses": {},
+                    "retries": 0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "connections_opened": 0,
+                    "connections_reused": 0
+                }
+                self.endpoints[key] = endpoint
+            endpoint["latency"].observe(latency)
+            endpoint["statuses"][str(status)] = endpoint["statuses"].get(str(status), 0) + 1
+            endpoint["retries"] += retries
+            endpoint["bytes_sent"] += bytes_sent
+            endpoint["bytes_received"] += bytes_received
+            if new_connection:
+                endpoint["connections_opened"] += 1
+            else:
+                endpoint["connections_reused"] += 1
+
+    def record_step(self, name, duration, outcome):
+        with self._lock:
+            step = self.steps.get(name)
+            if step is None:
+                step = {"duration": Histogram(), "outcomes": {}}
+                self.steps[name] = step
+            step["duration"].observe(duration)
+            step["outcomes"][outcome] = step["outcomes"].get(outcome, 0) + 1
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {"queue_wait": Histogram(), "throttled": 0}
+        return self.hosts[host]
+
+    def record_queue_wait(self, host, seconds):
+        with self._lock:
+            self._host(host)["queue_wait"].observe(seconds)
+
+    def record_throttle(self, host):
+        with self._lock:
+            self._host(host)["throttled"] += 1
+
+    @contextmanager
+    def step(self, name):
+        start = time.time()
+        outcome = "failed"
+        try:
+            yield
+            outcome = "succeeded"
+        finally:
+            self.record_step(name, time.time() - start, outcome)
+
+    def summary(self):
+        with self._lock:
+            endpoints = []
+            for (verb, template), endpoint in sorted(self.endpoints.items()):
+                entry = {"method": verb, "endpoint": template}
+                entry.update(endpoint["latency"].to_dict())
+                for field in ["statuses", "retries", "bytes_sent", "bytes_received", "connections_opened", "connections_reused"]:
+                    entry[field] = endpoint[field]
+                endpoints.append(entry)
+            steps = []
+            for name, step in sorted(self.steps.items()):
+                entry = {"step": name}
+                entry.update(step["duration"].to_dict())
+                entry["outcomes"] = step["outcomes"]
+                steps.append(entry)
+            hosts = []
+            for host, stats in sorted(self.hosts.items()):
+                entry = {"host": host}
+                entry.update(stats["queue_wait"].to_dict())
+                entry["throttled"] = stats["throttled"]
+                hosts.append(entry)
+        return {
+            "duration": round(time.time() - self.started, 6),
+            "requests": sum(endpoint["count"] for endpoint in endpoints),
+            "endpoints": endpoints,
+            "steps": steps,
+            "hosts": hosts
+        }
+
+    def prometheus(self):
+        lines = [
+            "# HELP apic_config_request_duration_seconds Latency of the IBM API Connect REST calls",
+            "# TYPE apic_config_request_duration_seconds histogram"
+        ]
+        counters = {
+            "apic_config_requests_total": [],
+            "apic_config_request_retries_total": [],
+            "apic_config_request_bytes_sent_total": [],
+            "apic_config_request_bytes_received_total": [],
+            "apic_config_connections_opened_total": [],
+            "apic_config_connections_reused_total": []
+        }
+        with self._lock:
+            for (verb, template), endpoint in sorted(self.endpoints.items()):
+                labels = 'method="' + verb + '",endpoint="' + template + '"'
+                lines.extend(endpoint["latency"].prometheus("apic_config_request_duration_seconds", labels))
+                for status, count in sorted(endpoint["statuses"].items()):
+                    counters["apic_config_requests_total"].append("apic_config_requests_total{" + labels + ',status="' + status + '"} ' + str(count))
+                counters["apic_config_request_retries_total"].append("apic_config_request_retries_total{" + labels + "} " + str(endpoint["retries"]))
+                counters["apic_config_request_bytes_sent_total"].append("apic_config_request_bytes_sent_total{" + labels + "} " + str(endpoint["bytes_sent"]))
+                counters["apic_config_request_bytes_received_total"].append("apic_config_request_bytes_received_total{" + labels + "} " + str(endpoint["bytes_received"]))
+                counters["apic_config_connections_opened_total"].append("apic_config_connections_opened_total{" + labels + "} " + str(endpoint["connections_opened"]))
+                counters["apic_config_connections_reused_total"].append("apic_config_connections_reused_total{" + labels + "} " + str(endpoint["connections_reused"]))
+            for name, values in counters.items():
+                lines.append("# TYPE " + name + " counter")
+                lines.extend(values)
+            lines.append("# HELP apic_config_step_duration_seconds Wall-clock time of the configuration steps")
+            lines.append("# TYPE apic_config_step_duration_seconds histogram")
+            for name, step in sorted(self.steps.items()):
+                lines.extend(step["duration"].prometheus("apic_config_step_duration_seconds", 'step="' + name + '"'))
+            lines.append("# HELP apic_config_queue_wait_seconds Time the calls waited for the rate limiter of their host")
+            lines.append("# TYPE apic_config_queue_wait_seconds histogram")
+            for host, stats in sorted(self.hosts.items()):
+                lines.extend(stats["queue_wait"].prometheus("apic_config_queue_wait_seconds", 'host="' + host + '"'))
+            lines.append("# HELP apic_config_throttled_total Answers with a 429 or a Retry-After, after which the host was held")
+            lines.append("# TYPE apic_config_throttled_total counter")
+            for host, stats in sorted(self.hosts.items()):
+                lines.append('apic_config_throttled_total{host="' + host + '"} ' + str(stats["throttled"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory):
+        """
+        Writes the JSON summary and the Prometheus textfile into the directory
+        and returns their paths.
+        """
+        json_file = os.path.join(directory, JSON_FILE_NAME)
+        prometheus_file = os.path.join(directory, PROMETHEUS_FILE_NAME)
+        utils.write_atomically(json_file, json.dumps(self.summary(), indent=2))
+        # The textfile collector may read the file at any time
+        utils.write_atomically(prometheus_file, self.prometheus())
+        print(INFO + "Metrics written to " + json_file + " and " + prometheus_file)
+        return json_file, prometheus_file
+
+# Recorder shared by every client and step that is not given its own one
+recorder = MetricsRecorder()
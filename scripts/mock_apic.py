@@ -0,0 +1,325 @@
+import os, re, ssl, json, time, uuid, random, hashlib, argparse, tempfile, threading, subprocess
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+"""
+
+Stand-in for the IBM API Connect management endpoints config_apicv10.py uses, so that the configuration can be run and
+benchmarked without an API Connect cluster. It keeps everything in memory and serves HTTPS with a self-signed
+certificate (generated with openssl unless one is given). GET answers carry an ETag, and a conditional GET whose
+If-None-Match still matches gets a 304 without a body.
+
+It can run in process (see start) or on its own, in which case it also writes the config.json and toolkit-creds.json
+files pointing at itself into the given configuration files directory:
+
+    python3 mock_apic.py --port 9443 --latency 0.05 --config-files-dir /tmp/config
+
+"""
+
+FILE_NAME = "mock_apic.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+
+# Collections which can be created, listed and read by name or id
+COLLECTION_PATTERN = re.compile(r'/(availability-zones|user-registries|mail-servers|gateway-services|analytics-services|portal-services|users|catalogs|configured-gateway-services|tls-server-profiles|tls-client-profiles)$')
+
+class MockAPIC:
+    """
+    In memory state of the mock plus the knobs to make it slow, flaky or big:
+
+    - latency: seconds every request takes, plus up to jitter more seconds
+    - error_rate: fraction of the requests answered with error_status
+    - error_methods: only requests with these methods get errors (all by default)
+    - retry_after: seconds sent in a Retry-After header along with the injected errors
+    - tls_profiles, provider_orgs: number of extra resources in those collections
+    - sync_delay: seconds a configured gateway service has outstanding events for after it is created
+    """
+
+    def __init__(self, base_url, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, error_methods=None,
+                 tls_profiles=0, provider_orgs=0, token_lifetime=3600, retry_after=None, sync_delay=0.0):
+        self.base_url = base_url
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_methods = [method.upper() for method in error_methods] if error_methods else None
+        self.token_lifetime = token_lifetime
+        self.retry_after = retry_after
+        self.sync_delay = sync_delay
+        self.lock = threading.Lock()
+        self.collections = {}
+        self.tokens = {}
+        self.created = {}
+        self.settings = {"mail_server_url": None, "email_sender": {}}
+        self.stats = {"requests": 0, "writes": 0, "errors": 0, "not_modified": 0, "connections": 0, "endpoints": {}}
+
+        admin_org = self.add("/api/cloud/orgs", {"name": "admin", "title": "admin", "org_type": "admin"})
+        self.admin_org_id = admin_org["id"]
+        self.registry_url = self.base_url + "/api/user-registries/" + self.admin_org_id + "/api-manager-lur"
+        self.add("/api/orgs/" + self.admin_org_id + "/availability-zones", {"name": "availability-zone-default", "title": "Default Availability Zone"})
+        self.add("/api/orgs/" + self.admin_org_id + "/user-registries", {"name": "api-manager-lur", "title": "API Manager Local User Registry"})
+        for i in range(tls_profiles):
+            self.add("/api/orgs/" + self.admin_org_id + "/tls-server-profiles", {"name": "tls-server-profile-" + str(i)})
+            self.add("/api/orgs/" + self.admin_org_id + "/tls-client-profiles", {"name": "tls-client-profile-" + str(i)})
+        self.add("/api/orgs/" + self.admin_org_id + "/tls-server-profiles", {"name": "tls-server-profile-default"})
+        self.add("/api/orgs/" + self.admin_org_id + "/tls-client-profiles", {"name": "gateway-management-client-default"})
+        for i in range(provider_orgs):
+            self.create_org({"name": "provider-org-" + str(i), "title": "Provider Org " + str(i), "owner_url": None})
+
+    def add(self, collection, resource):
+        resource = dict(resource)
+        resource["id"] = str(uuid.uuid4())
+        resource["url"] = self.base_url + collection + "/" + resource["id"]
+        resource["created_at"] = resource["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+        self.collections.setdefault(collection, []).append(resource)
+        self.created[resource["id"]] = time.time()
+        return resource
+
+    def create_org(self, data):
+        data = dict(data, org_type="provider")
+        org = self.add("/api/cloud/orgs", data)
+        # Every new provider organization comes with the sandbox catalog
+        self.add("/api/orgs/" + org["id"] + "/catalogs", {"name": "sandbox", "title": "Sandbox"})
+        return org
+
+    def find(self, collection, key):
+        for resource in self.collections.get(collection, []):
+            if key in (resource["id"], resource.get("name")):
+                return resource
+        return None
+
+    def page(self, resources, query):
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", [str(len(resources) or 1)])[0])
+        results = resources[offset:offset + limit]
+        if "fields" in query:
+            fields = query["fields"][0].split(",")
+            results = [dict((k, v) for k, v in resource.items() if k in fields) for resource in results]
+        return {"total": len(resources), "results": results}
+
+    def handle(self, method, path, query, data, token):
+        """
+        Returns the status code and the body of the answer to a request.
+        """
+        if path == "/api/token" and method == "POST":
+            access_token = str(uuid.uuid4())
+            self.tokens[access_token] = data.get("username")
+            return 200, {"access_token": access_token, "token_type": "Bearer", "expires_in": self.token_lifetime}
+        if token not in self.tokens:
+            return 401, {"status": 401, "message": ["Invalid token"]}
+        username = self.tokens[token]
+
+        if path == "/api/cloud/settings":
+            if method in ("PUT", "PATCH"):
+                self.settings.update(data)
+            return 200, self.settings
+        if path == "/api/cloud/settings/user-registries":
+            return 200, {"provider_user_registry_default_url": self.registry_url}
+        if path == "/api/cloud/integrations/gateway-service/datapower-api-gateway":
+            return 200, {"name": "datapower-api-gateway", "url": self.base_url + path}
+        if path == "/api/orgs" and method == "GET":
+            # The orgs a provider user can see are the ones it owns
+            owned = [org for org in self.collections["/api/cloud/orgs"]
+                     if org["org_type"] == "admin" and username == "admin"
+                     or org.get("owner_url") and org["owner_url"].rstrip("/").split("/")[-1] in
+                        [user["id"] for user in self.collections.get(urlsplit(self.registry_url).path + "/users", []) if user["name"] == username]]
+            return 200, self.page(owned, query)
+
+        # Catalogs and what is under them are read by name or id, and kept under the id of the catalog
+        match = re.match(r'^/api/catalogs/([^/]+)/([^/]+)(/.*)?$', path)
+        if match:
+            org = self.find("/api/cloud/orgs", match.group(1))
+            catalogs = "/api/orgs/" + (org["id"] if org else match.group(1)) + "/catalogs"
+            catalog = self.find(catalogs, match.group(2))
+            path = catalogs + "/" + (catalog["id"] if catalog else match.group(2)) + (match.group(3) or "")
+
+        if path == "/api/cloud/orgs" or COLLECTION_PATTERN.search(path):
+            resources = self.collections.setdefault(path, [])
+            if method == "GET":
+                return 200, self.page(resources, query)
+            if method == "POST":
+                if path.endswith("/users"):
+                    data = dict(data, name=data.get("username"))
+                    data.pop("password", None)
+                if data.get("name") and self.find(path, data["name"]):
+                    return 409, {"status": 409, "message": [data["name"] + " already exists"]}
+                if path == "/api/cloud/orgs":
+                    return 201, self.create_org(data)
+                return 201, self.add(path, data)
+            return 405, {"status": 405, "message": ["Method not allowed"]}
+
+        if path.endswith("/gateway-processing-status") and method == "GET":
+            # The gateway gets the configuration of the catalog sync_delay seconds after the association
+            resource = self.find(path.rsplit("/", 2)[0], path.rsplit("/", 2)[1])
+            if resource is None:
+                return 404, {"status": 404, "message": [path + " not found"]}
+            outstanding = 1 if time.time() - self.created[resource["id"]] < self.sync_delay else 0
+            return 200, {"outstanding_sent_events": outstanding, "outstanding_queued_events": outstanding}
+
+        collection, _, key = path.rpartition("/")
+        if collection == "/api/orgs":
+            collection = "/api/cloud/orgs"
+        resource = self.find(collection, key)
+        if resource is None:
+            return 404, {"status": 404, "message": [path + " not found"]}
+        if method in ("PATCH", "PUT"):
+            resource.update(data)
+            resource["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+        elif method == "DELETE":
+            self.collections[collection].remove(resource)
+        elif method != "GET":
+            return 405, {"status": 405, "message": ["Method not allowed"]}
+        return 200, resource
+
+    def count(self, method, path, status):
+        endpoint = method + " " + re.sub(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', '{id}', path)
+        self.stats["requests"] += 1
+        self.stats["endpoints"][endpoint] = self.stats["endpoints"].get(endpoint, 0) + 1
+        if method != "GET":
+            self.stats["writes"] += 1
+        if status >= 500:
+            self.stats["errors"] += 1
+
+class Server(ThreadingHTTPServer):
+    # Room for many clients connecting at the same time, as a real cluster has
+    request_queue_size = 128
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.mock.lock:
+            self.server.mock.stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, method):
+        mock = self.server.mock
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        data = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        token = (self.headers.get("Authorization") or "").replace("Bearer ", "")
+        time.sleep(mock.latency + random.uniform(0, mock.jitter))
+        injected = False
+        with mock.lock:
+            if mock.error_rate and random.random() < mock.error_rate and (mock.error_methods is None or method in mock.error_methods):
+                status, body = mock.error_status, {"status": mock.error_status, "message": ["Injected error"]}
+                injected = True
+            else:
+                status, body = mock.handle(method, parts.path, parse_qs(parts.query), data, token)
+            payload = json.dumps(body).encode()
+            etag = '"' + hashlib.md5(payload).hexdigest() + '"' if method == "GET" and status == 200 else None
+            if etag and self.headers.get("If-None-Match") == etag:
+                status, payload = 304, b""
+                mock.stats["not_modified"] += 1
+            mock.count(method, parts.path, status)
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        if status != 304:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+        if injected and mock.retry_after is not None:
+            self.send_header("Retry-After", str(mock.retry_after))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+    def do_PUT(self):
+        self.respond("PUT")
+
+    def do_PATCH(self):
+        self.respond("PATCH")
+
+    def do_DELETE(self):
+        self.respond("DELETE")
+
+def self_signed_certificate():
+    """
+    Generates a throwaway key and self-signed certificate with openssl and
+    returns the path of a file holding both.
+    """
+    directory = tempfile.mkdtemp()
+    key_file = os.path.join(directory, "key.pem")
+    cert_file = os.path.join(directory, "cert.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key_file, "-out", cert_file,
+                    "-days", "1", "-subj", "/CN=localhost"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(cert_file, "a") as f, open(key_file) as k:
+        f.write(k.read())
+    return cert_file
+
+_certificate = None
+_certificate_lock = threading.Lock()
+
+def start(port=0, certfile=None, **options):
+    """
+    Starts a mock on localhost in a background thread and returns the server
+    and the host:port to put in config.json. The mock state and counters
+    are in server.mock, and server.shutdown() stops it.
+    """
+    global _certificate
+    if certfile is None:
+        with _certificate_lock:
+            if _certificate is None:
+                _certificate = self_signed_certificate()
+            certfile = _certificate
+    server = Server(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile)
+    # The TLS handshake happens in the thread of each connection rather than one at a time in the accepting thread
+    server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    host = "127.0.0.1:" + str(server.server_port)
+    server.mock = MockAPIC("https://" + host, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, host
+
+def environment_config(host):
+    """
+    Returns the config.json content pointing every subsystem at the mock.
+    """
+    config = {}
+    for name in ["APIC_ADMIN_URL", "APIC_API_MANAGER_URL", "APIC_GATEWAY_URL", "APIC_GATEWAY_MANAGER_URL",
+                 "APIC_ANALYTICS_CONSOLE_URL", "APIC_PORTAL_DIRECTOR_URL", "APIC_PORTAL_WEB_URL", "APIC_PLATFORM_API_URL"]:
+        config[name] = host
+    config["APIC_ADMIN_PASSWORD"] = "admin-password"
+    return config
+
+def toolkit_credentials():
+    return {"toolkit": {"client_id": "mock-client-id", "client_secret": "mock-client-secret"}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock IBM API Connect management server")
+    parser.add_argument("--port", type=int, default=9443)
+    parser.add_argument("--certfile", help="File with the certificate and private key to serve HTTPS with")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every request takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum extra random seconds every request takes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="Status code of the injected errors")
+    parser.add_argument("--retry-after", type=int, help="Seconds sent in a Retry-After header along with the injected errors")
+    parser.add_argument("--tls-profiles", type=int, default=0, help="Number of extra TLS server and client profiles")
+    parser.add_argument("--provider-orgs", type=int, default=0, help="Number of extra provider organizations")
+    parser.add_argument("--sync-delay", type=float, default=0.0, help="Seconds the gateways take to get the configuration of a catalog")
+    parser.add_argument("--config-files-dir", help="Directory to write the config.json and toolkit-creds.json files into")
+    args = parser.parse_args()
+
+    server, host = start(args.port, args.certfile, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                         error_status=args.error_status, retry_after=args.retry_after, tls_profiles=args.tls_profiles, provider_orgs=args.provider_orgs,
+                         sync_delay=args.sync_delay)
+    if args.config_files_dir:
+        with open(os.path.join(args.config_files_dir, "config.json"), "w") as f:
+            json.dump(environment_config(host), f, indent=4)
+        with open(os.path.join(args.config_files_dir, "toolkit-creds.json"), "w") as f:
+            json.dump(toolkit_credentials(), f, indent=4)
+    print(INFO + "Mock IBM API Connect listening on https://" + host)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.shutdown()
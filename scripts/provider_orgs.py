@@ -0,0 +1,48 @@
+import os
+import reconcile
+
+"""
+
+Provider Organizations and their owners, as step 10 of config_apicv10.py, bulk_onboarding.py and desired_state.py all
+create them: the owner is registered in the default Provider User Registry and the Provider Organization is created in
+the Cloud Manager with that owner. Both are reconciled, so they are only created when missing and patched when they
+differ.
+
+"""
+
+FILE_NAME = "provider_orgs.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+
+def name_from_title(title):
+    # e.g. "Team A" is team-a
+    return title.strip().replace(" ", "-").lower()
+
+def ensure_owner(provider_user_registry_url, owner, bearer_token, client=None):
+    """
+    Makes sure the owner (username, email, first_name, last_name and
+    password) is registered, read by its username. Returns the user and the
+    action taken: created, updated or unchanged.
+    """
+    data = {
+        "username": owner["username"],
+        "email": owner["email"],
+        "first_name": owner["first_name"],
+        "last_name": owner["last_name"],
+        "password": owner["password"]
+    }
+    return reconcile.ensure_resource(provider_user_registry_url + '/users', bearer_token, owner["username"], data, client=client)
+
+def ensure_provider_org(admin_url, name, title, owner_url, bearer_token, client=None):
+    """
+    Makes sure the Provider Organization exists with its title, read by its
+    name. An existing organization keeps its owner, as changing it is a
+    transfer rather than a patch. Returns the organization and the action
+    taken: created, updated or unchanged.
+    """
+    data = {
+        "title": title,
+        "name": name,
+        "owner_url": owner_url
+    }
+    return reconcile.ensure_resource(admin_url + '/api/cloud/orgs', bearer_token, name, data, ignore=['owner_url'], client=client)
@@ -0,0 +1,130 @@
+import os, ssl, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+import utils
+import transport
+import executor
+import resilience
+
+"""
+
+Readiness gate: waits until the IBM API Connect subsystems answer before they are configured, so that a configuration
+started right after the installation does not fail (or wait a padded fixed sleep) while pods are still coming up.
+
+Every subsystem is probed on its own and configuration steps only wait for the subsystems they talk to (see the
+readiness steps in config_apicv10.py). All the probes share a single overall timeout (APIC_READINESS_TIMEOUT seconds, 0
+to skip the probes). It can also be run on its own before any other script:
+
+    python3 readiness.py
+
+"""
+
+FILE_NAME = "readiness.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+READINESS_TIMEOUT = float(os.getenv('APIC_READINESS_TIMEOUT','900'))
+# Polling starts every MIN_INTERVAL seconds and slows down up to MAX_INTERVAL while nothing changes
+MIN_INTERVAL = 1.0
+MAX_INTERVAL = 15.0
+
+# Subsystem and the config.json entry with its url
+SUBSYSTEMS = {
+    "management": "APIC_ADMIN_URL",
+    "api_manager": "APIC_API_MANAGER_URL",
+    "gateway_manager": "APIC_GATEWAY_MANAGER_URL",
+    "analytics": "APIC_ANALYTICS_CONSOLE_URL",
+    "portal": "APIC_PORTAL_DIRECTOR_URL"
+}
+
+def tls_answer(e):
+    """
+    Returns the TLS alert (or certificate) the server failed the TLS
+    handshake with, if that is why the call failed, else None.
+    """
+    seen = []
+    while e is not None and e not in seen:
+        if isinstance(e, ssl.SSLCertVerificationError):
+            return "certificate " + str(e.verify_message)
+        if isinstance(e, ssl.SSLError) and 'ALERT' in str(e.reason or ''):
+            return str(e.reason)
+        seen.append(e)
+        e = e.__cause__ or e.__context__
+    return None
+
+def probe(probe_transport, host):
+    """
+    Returns whether the host is ready and what it answered. Any answer
+    other than a 5xx means the route and the pods behind it are up, even
+    a 401 or a 404 since the probe is not authenticated. So does a TLS
+    alert: the gateway manager, analytics and portal director routes are
+    passed through to pods asking for a client certificate the probe does
+    not send, and the pod is the one that answers with the alert (a route
+    with no pod behind it closes the connection instead).
+    """
+    try:
+        response = probe_transport.request('GET', 'https://' + host + '/', {}, timeout=(5, 10))
+    except transport.TransportError as e:
+        alert = tls_answer(e)
+        if alert:
+            return True, alert
+        return False, type(e).__name__
+    return response.status_code < 500, str(response.status_code)
+
+def wait_until_ready(subsystem, host, deadline):
+    """
+    Polls the host until it is ready or the deadline runs out. The polling
+    interval doubles while the host answers the same, and goes back to the
+    minimum as soon as the answer changes (e.g. from a refused connection to
+    a 503) as the subsystem is then likely to be ready soon.
+    """
+    start = time.time()
+    probe_transport = transport.new_transport(pool_size=1)
+    def waiting(outcome, wait):
+        print(INFO + subsystem + " (" + host + ") is not ready yet (" + outcome + "), checking again in " + ("%.1f" % wait) + "s")
+    try:
+        ready, outcome = resilience.poll_until(lambda: probe(probe_transport, host), deadline, MIN_INTERVAL, MAX_INTERVAL, waiting)
+    finally:
+        probe_transport.close()
+    if not ready:
+        raise Exception("[ERROR] - " + subsystem + " (" + host + ") is still not ready after " + str(deadline.budget) + "s. Last answer: " + outcome)
+    print(INFO + subsystem + " (" + host + ") is ready after " + ("%.1f" % (time.time() - start)) + "s")
+
+def readiness_step(subsystem, host=None, name=None):
+    """
+    Returns the executor step that provides <name>_ready (name is the
+    subsystem unless given, e.g. for the gateway of another availability
+    zone at host). Steps that talk to the subsystem require it, and the
+    context must hold the environment configuration and a
+    resilience.Deadline as readiness_deadline.
+    """
+    name = name or subsystem
+    def check(ctx):
+        if ctx["readiness_deadline"].budget > 0:
+            wait_until_ready(subsystem, host or ctx["environment_config"][SUBSYSTEMS[subsystem]], ctx["readiness_deadline"])
+        return {name + "_ready": True}
+    return executor.Step("ready_" + name, check,
+                         requires=["environment_config", "readiness_deadline"],
+                         provides=[name + "_ready"],
+                         persist=False)
+
+def wait_for(environment_config, subsystems=tuple(SUBSYSTEMS), timeout=READINESS_TIMEOUT):
+    """
+    Probes the subsystems concurrently and returns when all of them are
+    ready, raising if any is not within the timeout.
+    """
+    if timeout <= 0:
+        return
+    deadline = resilience.Deadline(timeout)
+    with ThreadPoolExecutor(max_workers=len(subsystems)) as pool:
+        futures = [pool.submit(wait_until_ready, subsystem, environment_config[SUBSYSTEMS[subsystem]], deadline) for subsystem in subsystems]
+        for future in futures:
+            future.result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wait until the IBM API Connect subsystems are ready")
+    parser.add_argument("--timeout", type=float, default=READINESS_TIMEOUT, help="Seconds to wait for all of them")
+    args = parser.parse_args()
+
+    try:
+        wait_for(utils.get_env_config(os.environ["CONFIG_FILES_DIR"]), timeout=args.timeout)
+    except Exception as e:
+        raise Exception("[ERROR] - Exception in " + FILE_NAME + ": " + repr(e))
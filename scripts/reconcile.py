@@ -0,0 +1,105 @@
+import os
+import api_calls
+
+FILE_NAME = "reconcile.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# When set, every configuration step reads the resource first and only writes what differs
+RECONCILE = os.getenv('RECONCILE','')
+
+# The IBM API Connect REST API never returns secrets back, so these can not be compared
+SECRET_FIELDS = ['password', 'client_secret']
+
+def differences(desired, current, ignore=(), strict=False):
+    """
+    Returns the top level fields of the desired body whose value is not
+    the one the current resource has. Secrets and the ignored fields are
+    not compared, and neither are the fields the resource does not return
+    at all (creation only fields) unless strict is set.
+    """
+    diff = {}
+    for key, value in desired.items():
+        if key in ignore or key in SECRET_FIELDS:
+            continue
+        if key not in current:
+            if strict:
+                diff[key] = value
+            continue
+        if not matches(value, current[key]):
+            diff[key] = value
+    return diff
+
+def matches(desired, current):
+    if isinstance(desired, dict) and isinstance(current, dict):
+        return not differences(desired, current)
+    if isinstance(desired, list) and isinstance(current, list):
+        return len(desired) == len(current) and all(matches(d, c) for d, c in zip(desired, current))
+    return desired == current
+
+def ensure_resource(collection_url, bearer_token, name, data, ignore=(), client=None, resource_url=None):
+    """
+    Makes sure the resource called name in the collection looks like data.
+    It is created when it does not exist, patched with the differing fields
+    when it does and left untouched otherwise. The resource is read from
+    resource_url when it is not addressed as collection_url/name.
+
+    Returns the resource and the action taken: created, updated or unchanged.
+    """
+    response = api_calls.make_api_call(resource_url or collection_url + '/' + name, bearer_token, 'get', client=client)
+    if response.status_code == 404:
+        response = api_calls.make_api_call(collection_url, bearer_token, 'post', data, client=client)
+        if response.status_code != 201:
+            raise Exception("Return code for creating " + name + " isn't 201. It is " + str(response.status_code))
+        action = "created"
+    elif response.status_code == 200:
+        current = response.json()
+        diff = differences(data, current, ignore)
+        if not diff:
+            action = "unchanged"
+        else:
+            response = api_calls.make_api_call(current['url'], bearer_token, 'patch', diff, client=client)
+            if response.status_code != 200:
+                raise Exception("Return code for updating " + name + " isn't 200. It is " + str(response.status_code))
+            action = "updated"
+    else:
+        raise Exception("Return code for getting " + name + " isn't 200 nor 404. It is " + str(response.status_code))
+    print(INFO + name + " " + action)
+    return response.json(), action
+
+def ensure_fields(resource_url, bearer_token, data, verb='patch', client=None):
+    """
+    Makes sure an existing resource (or settings object) has the values in
+    data, writing them with the given verb only when any of them differs.
+
+    Returns the action taken: updated or unchanged.
+    """
+    response = api_calls.make_api_call(resource_url, bearer_token, 'get', client=client)
+    if response.status_code != 200:
+        raise Exception("Return code for getting " + resource_url + " isn't 200. It is " + str(response.status_code))
+    if not differences(data, response.json(), strict=True):
+        action = "unchanged"
+    else:
+        response = api_calls.make_api_call(resource_url, bearer_token, verb, data, client=client)
+        if response.status_code != 200:
+            raise Exception("Return code for updating " + resource_url + " isn't 200. It is " + str(response.status_code))
+        action = "updated"
+    print(INFO + resource_url + " " + action)
+    return action
+
+def ensure_member(collection_url, bearer_token, field, value, data, client=None):
+    """
+    Makes sure the collection has a member whose field ends with value
+    (the resource id at the end of a url), creating it from data otherwise.
+    Used for associations, which are not addressable by a name of our own.
+
+    Returns the member and the action taken: created or unchanged.
+    """
+    for member in api_calls.iter_collection(collection_url, bearer_token, client=client):
+        if str(member.get(field, '')).rstrip('/').split('/')[-1] == value:
+            print(INFO + collection_url + " already has " + value)
+            return member, "unchanged"
+    response = api_calls.make_api_call(collection_url, bearer_token, 'post', data, client=client)
+    if response.status_code != 201:
+        raise Exception("Return code for creating a member of " + collection_url + " isn't 201. It is " + str(response.status_code))
+    print(INFO + collection_url + " created " + value)
+    return response.json(), "created"
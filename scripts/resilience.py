@@ -0,0 +1,297 @@
+import os, time, random, threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import transport
+
+FILE_NAME = "resilience.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Seconds to wait for a connection to be established, for every kind of call
+CONNECT_TIMEOUT = float(os.getenv('APIC_CONNECT_TIMEOUT','10'))
+# Seconds the whole run may take (0 means no limit). Every call's timeout is cut down to what is left
+RUN_DEADLINE = float(os.getenv('APIC_RUN_DEADLINE','0'))
+# Consecutive failures against a host after which calls to it fail fast, and for how many seconds
+BREAKER_THRESHOLD = int(os.getenv('APIC_BREAKER_THRESHOLD','5'))
+BREAKER_RESET = float(os.getenv('APIC_BREAKER_RESET','30'))
+# Requests per second sent to a single host, and how many can be sent at once after a quiet spell (0 means no limit)
+RATE_LIMIT = float(os.getenv('APIC_RATE_LIMIT','0'))
+RATE_BURST = int(os.getenv('APIC_RATE_BURST','0'))
+# Requests in flight at the same time against a single host (0 means no limit)
+MAX_IN_FLIGHT = int(os.getenv('APIC_MAX_IN_FLIGHT','0'))
+
+class RetryPolicy:
+    """
+    How a kind of call is retried: how many attempts in total, on which
+    status codes, whether connection errors are retried when the request may
+    already have reached the server (only safe for idempotent calls), and
+    the read timeout of each attempt.
+
+    Retries wait a jittered exponential backoff (a random time between 0 and
+    backoff * 2^attempt, capped by max_backoff), or what the server asks
+    for in a Retry-After header when it is longer.
+    """
+
+    def __init__(self, attempts, statuses, read_timeout, idempotent=True, backoff=1.0, max_backoff=30.0):
+        self.attempts = attempts
+        self.statuses = set(statuses)
+        self.read_timeout = read_timeout
+        self.idempotent = idempotent
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def retries_error(self, e):
+        if self.idempotent:
+            return isinstance(e, transport.TransportError)
+        return request_not_sent(e)
+
+    def delay(self, attempt, response=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None:
+            delay = max(delay, retry_after(response) or 0)
+        return delay
+
+# The token endpoint has always been retried on any 5xx with a shorter timeout. Creations (POST) are not idempotent,
+# so they are only retried when the server certainly did not process them: it was never reached, or it refused the
+# call with 429 or 503. Every other verb is retried on any sign of a transient failure.
+POLICIES = {
+    "token": RetryPolicy(4, [429, 500, 502, 503, 504], read_timeout=20),
+    "read": RetryPolicy(4, [429, 502, 503, 504], read_timeout=60),
+    "write": RetryPolicy(4, [429, 502, 503, 504], read_timeout=120),
+    "create": RetryPolicy(4, [429, 503], read_timeout=300, idempotent=False)
+}
+
+def endpoint_class(verb, url):
+    if urlsplit(url).path.endswith('/api/token'):
+        return "token"
+    if verb.lower() == 'get':
+        return "read"
+    if verb.lower() == 'post':
+        return "create"
+    return "write"
+
+def policy_for(verb, url):
+    return POLICIES[endpoint_class(verb, url)]
+
+def request_not_sent(e):
+    # e.g. a connect timeout or a refused connection, which happen before a single byte of the request is sent
+    return isinstance(e, transport.TransportError) and not e.sent
+
+def retry_after(response):
+    """
+    Returns the seconds the server asked to wait in the Retry-After header
+    (either a number of seconds or an HTTP date), None if it did not.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+class Deadline:
+    """
+    Time budget of a whole run, started when created. A budget of 0 or
+    less never runs out.
+    """
+
+    def __init__(self, budget=RUN_DEADLINE):
+        self.budget = budget
+        self.expires_at = time.time() + budget if budget > 0 else None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.time()
+
+    def timeout(self, connect_timeout, read_timeout):
+        """
+        Returns the (connect, read) timeout of a call cut down to the time
+        left, raising if there is none left.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return connect_timeout, read_timeout
+        if remaining <= 0:
+            raise Exception("[ERROR] - The run deadline of " + str(self.budget) + "s has been exceeded")
+        return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+    def sleep(self, seconds):
+        """
+        Waits before a retry, raising instead if the wait would not leave time
+        for the retry itself.
+        """
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise Exception("[ERROR] - Not retrying as the run deadline of " + str(self.budget) + "s would be exceeded")
+        time.sleep(seconds)
+
+# Started when the module is first imported, which is when the run starts
+run_deadline = Deadline()
+
+def poll_until(check, deadline, min_interval, max_interval, waiting=None):
+    """
+    Calls check until it returns that it is done or the deadline runs out,
+    and returns whether it is done along with the last outcome. check
+    returns (done, outcome). The polling interval doubles while the outcome
+    stays the same, up to max_interval, and goes back to min_interval as
+    soon as it changes, as what is waited for is then likely to happen soon.
+    Every wait is jittered and waiting(outcome, seconds) is called before it.
+    """
+    interval = min_interval
+    last_outcome = None
+    while True:
+        done, outcome = check()
+        if outcome != last_outcome:
+            interval = min_interval
+        else:
+            interval = min(interval * 2, max_interval)
+        last_outcome = outcome
+        if done:
+            return True, outcome
+        remaining = deadline.remaining()
+        if remaining is not None and remaining <= 0:
+            return False, outcome
+        wait = random.uniform(interval / 2, interval)
+        if remaining is not None:
+            wait = min(wait, remaining)
+        if waiting is not None:
+            waiting(outcome, wait)
+        time.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures (connection errors, timeouts and 5xx)
+    against a host. Once threshold is reached the circuit opens and calls
+    fail fast instead of waiting for their timeout. After reset seconds a
+    single trial call is let through: the circuit closes again if it
+    succeeds, and stays open for another reset seconds if it fails.
+    """
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, reset=BREAKER_RESET):
+        self.host = host
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.time() - self.opened_at < self.reset or self.trial:
+                raise Exception("[ERROR] - Circuit open for " + self.host + " after " + str(self.failures) + " consecutive failures, failing fast")
+            self.trial = True
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print(INFO + "Circuit closed again for " + self.host)
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    print(INFO + "Circuit opened for " + self.host + " after " + str(self.failures) + " consecutive failures")
+                self.opened_at = time.time()
+                self.trial = False
+
+class RateLimiter:
+    """
+    Schedules the calls to a host: at most rate calls per second on
+    average with bursts of up to burst calls (a token bucket), and at most
+    max_in_flight calls at the same time. When the host throttles a call
+    (429, or any answer with a Retry-After) every call to it is held for
+    that long, not only the throttled one, so the host is not hammered
+    by the others meanwhile.
+
+    Calls wait their turn in acquire, and the stats tell how many waited,
+    for how long, and how many were queued at most.
+    """
+
+    def __init__(self, host, rate=RATE_LIMIT, burst=RATE_BURST, max_in_flight=MAX_IN_FLIGHT):
+        self.host = host
+        self.rate = rate
+        self.burst = burst or max(int(rate), 1)
+        self.max_in_flight = max_in_flight
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.stats = {"requests": 0, "waited": 0, "wait_seconds": 0.0, "max_wait": 0.0, "max_queued": 0, "throttled": 0}
+        self._condition = threading.Condition()
+
+    def _delay(self, now):
+        # Seconds until a call can be sent, None until another call ends, 0 when it can be sent now
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return None
+        if self.rate > 0 and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def acquire(self, deadline=None):
+        """
+        Waits until a call can be sent, raising if the deadline runs out
+        first, and returns the seconds waited. Every acquire must be
+        followed by a release once the call is over.
+        """
+        start = time.monotonic()
+        with self._condition:
+            self.queued += 1
+            self.stats["max_queued"] = max(self.stats["max_queued"], self.queued)
+            try:
+                while True:
+                    delay = self._delay(time.monotonic())
+                    if delay == 0:
+                        break
+                    remaining = deadline.remaining() if deadline is not None else None
+                    if remaining is not None:
+                        if remaining <= 0:
+                            raise Exception("[ERROR] - The run deadline of " + str(deadline.budget) + "s has been exceeded waiting to call " + self.host)
+                        delay = remaining if delay is None else min(delay, remaining)
+                    self._condition.wait(delay)
+            finally:
+                self.queued -= 1
+            if self.rate > 0:
+                self.tokens -= 1
+            self.in_flight += 1
+            waited = time.monotonic() - start
+            self.stats["requests"] += 1
+            if waited > 0.001:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += waited
+                self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+        return waited
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def throttle(self, seconds):
+        """
+        Holds every call to the host for seconds, unless it is already held
+        for longer.
+        """
+        with self._condition:
+            self.stats["throttled"] += 1
+            until = time.monotonic() + seconds
+            if until > self.paused_until:
+                self.paused_until = until
+                print(INFO + self.host + " is throttling, holding its calls for " + ("%.1f" % seconds) + "s")
@@ -0,0 +1,92 @@
+import os, threading
+import log
+import api_calls
+
+FILE_NAME = "resolver.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Fields every collection gets indexed by
+INDEXED_FIELDS = ['id', 'name', 'org_type']
+# Fields requested for every resource: the indexed ones and the url
+PROJECTED_FIELDS = INDEXED_FIELDS + ['url']
+
+class ResourceResolver:
+    """
+    Resolves resources of a collection (orgs, TLS profiles, catalogs...) by
+    one of the INDEXED_FIELDS. The collection is fetched once and indexed,
+    so every other lookup in it is a dictionary access. The indexes of a
+    collection are dropped whenever the client writes to it or to any of
+    its members.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or api_calls.get_client()
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._collection_locks = {}
+        self.client.add_write_listener(self.invalidate)
+
+    def _collection_lock(self, key):
+        with self._lock:
+            if key not in self._collection_locks:
+                self._collection_locks[key] = threading.Lock()
+            return self._collection_locks[key]
+
+    def _key(self, collection_url, bearer_token):
+        # The same collection may list different resources to different users. Every
+        # lookup field is in the one index of the collection, whatever it is looked up by
+        return (collection_url, api_calls.tokens.identity(bearer_token) or bearer_token)
+
+    def _index(self, collection_url, bearer_token):
+        key = self._key(collection_url, bearer_token)
+        with self._collection_lock(key):
+            with self._lock:
+                index = self._indexes.get(key)
+            if index is not None:
+                return index
+            index = dict((indexed_field, {}) for indexed_field in INDEXED_FIELDS)
+            for item in api_calls.iter_collection(collection_url, bearer_token, fields=PROJECTED_FIELDS, client=self.client):
+                for indexed_field in INDEXED_FIELDS:
+                    if indexed_field in item:
+                        # Keep the first match for fields that are not unique such as org_type
+                        index[indexed_field].setdefault(item[indexed_field], item)
+            log.debug(INFO + "Indexed %s resources of %s", len(index['id']), collection_url)
+            with self._lock:
+                self._indexes[key] = index
+            return index
+
+    def find(self, collection_url, bearer_token, field, value, direct_url=None):
+        """
+        Returns the resource of the collection whose field has the value, or
+        None if there is none.
+
+        direct_url is the url that addresses that very resource (e.g. by
+        name) when APIC supports one. It is used instead of fetching the
+        whole collection as long as the collection has not been indexed yet.
+        """
+        key = self._key(collection_url, bearer_token)
+        with self._lock:
+            indexed = key in self._indexes
+        if direct_url and not indexed:
+            response = api_calls.make_api_call(direct_url, bearer_token, 'get', client=self.client)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code == 404:
+                return None
+            raise Exception("Return code for getting " + direct_url + " isn't 200 nor 404. It is " + str(response.status_code))
+        return self._index(collection_url, bearer_token)[field].get(value)
+
+    def close(self):
+        """
+        Stops listening to the writes of the client.
+        """
+        self.client.remove_write_listener(self.invalidate)
+
+    def invalidate(self, url):
+        """
+        Drops the indexes of the collections the url belongs to.
+        """
+        with self._lock:
+            for key in list(self._indexes.keys()):
+                if url == key[0] or url.startswith(key[0] + '/'):
+                    del self._indexes[key]
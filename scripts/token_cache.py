@@ -0,0 +1,131 @@
+import os, json, time, threading
+import log
+import utils
+
+FILE_NAME = "token_cache.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# Tokens are refreshed this many seconds before they expire
+REFRESH_MARGIN = int(os.getenv('APIC_TOKEN_REFRESH_MARGIN','60'))
+# When set, tokens are also kept in CONFIG_FILES_DIR so that repeated runs can reuse them
+DISK_CACHE = os.getenv('APIC_TOKEN_CACHE','')
+CACHE_FILE_NAME = "token-cache.json"
+
+class TokenManager:
+    """
+    Caches bearer tokens per (host, username, realm, client id) until
+    shortly before they expire.
+
+    Tokens handed out are remembered so that the token a caller holds can
+    be swapped for the current one of the same identity (see current and
+    refresh), which lets callers keep passing around the token string they
+    got the first time.
+    """
+
+    def __init__(self, cache_file=None, refresh_margin=REFRESH_MARGIN):
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self._entries = {}
+        self._fetchers = {}
+        self._identities = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._load()
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def _valid(self, entry):
+        if entry is None:
+            return False
+        return entry['expires_at'] is None or entry['expires_at'] - time.time() > self.refresh_margin
+
+    def get(self, key, fetch):
+        """
+        Returns a valid token for key. fetch is called to get a new one when
+        there is none or it is about to expire, and must return the token
+        and its lifetime in seconds (None when unknown).
+        """
+        with self._key_lock(key):
+            self._fetchers[key] = fetch
+            entry = self._entries.get(key)
+            if self._valid(entry):
+                return entry['token']
+            return self._fetch(key)
+
+    def _fetch(self, key):
+        token, expires_in = self._fetchers[key]()
+        entry = {
+            "token": token,
+            "expires_at": time.time() + expires_in if expires_in else None
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._identities[token] = key
+        # The client id, last in the key, is left out
+        log.debug(INFO + "New token for %s valid for %s seconds", key.rsplit('|', 1)[0], expires_in)
+        self._save()
+        return token
+
+    def current(self, token):
+        """
+        Returns the token to use in place of the given one: the latest token
+        of the same identity, refreshed if it is about to expire. Unknown
+        tokens are returned as they are.
+        """
+        key = self._identities.get(token)
+        if key is None or key not in self._fetchers:
+            return token
+        return self.get(key, self._fetchers[key])
+
+    def refresh(self, token):
+        """
+        Discards the token (e.g. after a 401) and returns a new one for the
+        same identity, or None if the token is unknown. If another caller
+        already refreshed it, the newer token is returned without fetching.
+        """
+        key = self._identities.get(token)
+        if key is None or key not in self._fetchers:
+            return None
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is not None and entry['token'] != token and self._valid(entry):
+                return entry['token']
+            return self._fetch(key)
+
+    def identity(self, token):
+        """
+        Returns the identity (host, username, realm and client id) the token
+        was issued to, or None if the token is unknown.
+        """
+        return self._identities.get(token)
+
+    def _load(self):
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as f:
+                entries = json.load(f)
+        except ValueError:
+            return
+        for key, entry in entries.items():
+            self._entries[key] = entry
+            self._identities[entry['token']] = key
+
+    def _save(self):
+        if not self.cache_file:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        utils.write_atomically(self.cache_file, json.dumps(entries), private=True)
+
+def token_key(apic_url, apic_username, apic_realm, apic_rest_clientid):
+    return "|".join([apic_url, apic_username, apic_realm, apic_rest_clientid])
+
+def default_cache_file():
+    if DISK_CACHE and os.getenv('CONFIG_FILES_DIR'):
+        return os.path.join(os.environ['CONFIG_FILES_DIR'], CACHE_FILE_NAME)
+    return None
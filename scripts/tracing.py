@@ -0,0 +1,151 @@
+import os, json, time, pstats, cProfile, itertools, threading
+from contextlib import contextmanager
+
+"""
+
+Optional tracing of a configuration run. When APIC_TRACE_FILE is set, every step, every call to the APIC REST API and
+each of its attempts and backoff sleeps, and every token request is recorded as a span, and the spans are written to
+that file in the Chrome trace event format when the run ends. Open the file in https://ui.perfetto.dev (or
+chrome://tracing) to see which steps overlap and where the time goes:
+
+    APIC_TRACE_FILE=/tmp/apic-trace.json python3 config_apicv10.py
+
+Spans are nested on the thread they ran on, and carry the id of their parent span, including across threads (a step
+has the run as parent).
+
+When APIC_PROFILE_FILE is set, the run is also profiled with cProfile, in every thread, and the merged statistics are
+written to that file (open it with python3 -m pstats or snakeviz).
+
+"""
+
+FILE_NAME = "tracing.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+TRACE_FILE = os.getenv('APIC_TRACE_FILE','')
+PROFILE_FILE = os.getenv('APIC_PROFILE_FILE','')
+
+class Tracer:
+    """
+    Records spans as Chrome trace complete events. Disabled, a span costs a
+    function call and nothing is kept.
+    """
+
+    def __init__(self, enabled=bool(TRACE_FILE)):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.events = []
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self):
+        """
+        Returns the id of the span open in this thread, None if there is none.
+        """
+        stack = self._stack() if self.enabled else None
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, category, parent=None, **args):
+        """
+        Records the time spent in the block. The parent is the span open in
+        this thread unless given. The block gets the args of the span and can
+        add to them (e.g. the status code of a call).
+        """
+        if not self.enabled:
+            yield args
+            return
+        stack = self._stack()
+        span_id = next(self._ids)
+        args["id"] = span_id
+        args["parent"] = parent if parent is not None else (stack[-1] if stack else None)
+        stack.append(span_id)
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((start - self.started) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def write(self, path):
+        with self._lock:
+            events = list(self.events)
+        # Name the threads (e.g. ThreadPoolExecutor-0_3) so they can be told apart in the viewer
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": names.get(tid, str(tid))}}
+                    for tid in sorted(set(event["tid"] for event in events))]
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f, default=str)
+        print(INFO + str(len(events)) + " spans written to " + path)
+
+# Tracer shared by the executor and every client
+tracer = Tracer()
+
+def span(name, category, parent=None, **args):
+    return tracer.span(name, category, parent, **args)
+
+def current():
+    return tracer.current()
+
+@contextmanager
+def profile(path=PROFILE_FILE):
+    """
+    Profiles the block with cProfile, in this thread and in every thread
+    started while it runs, and writes the merged statistics to path. Does
+    nothing without a path.
+
+    A profiler cannot be stopped from another thread, so the profile of a
+    thread is only complete, and merged, once the thread has finished. The
+    worker pools started in the block have, as they are all joined before
+    it ends. Threads still running when it ends are left out.
+    """
+    if not path:
+        yield
+        return
+    profiles = []
+    lock = threading.Lock()
+
+    def start_thread_profile(*args):
+        # Called once in every new thread, enabling a profiler replaces this very hook
+        thread_profile = cProfile.Profile()
+        with lock:
+            profiles.append((threading.current_thread(), thread_profile))
+        thread_profile.enable()
+
+    main = cProfile.Profile()
+    threading.setprofile(start_thread_profile)
+    main.enable()
+    try:
+        yield
+    finally:
+        main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main)
+        with lock:
+            finished = [thread_profile for thread, thread_profile in profiles if not thread.is_alive()]
+            running = len(profiles) - len(finished)
+        for thread_profile in finished:
+            stats.add(thread_profile)
+        stats.dump_stats(path)
+        print(INFO + "Profile of " + str(len(finished) + 1) + " threads written to " + path
+              + (" (" + str(running) + " threads still running left out)" if running else ""))
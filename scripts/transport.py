@@ -0,0 +1,312 @@
+import os, ssl, gzip, json, time, socket, select, threading, http.client
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+"""
+
+HTTP transports the APIC client sends its calls through. A transport only sends one request and returns one response:
+retries, caching, metrics and tokens are the client's business (see api_calls.py).
+
+- HTTPClientTransport (the default) is built on http.client from the standard library, so nothing has to be installed
+  before the scripts can run. It keeps a pool of keep-alive connections per host.
+- RequestsTransport goes through the requests package when it is installed and chosen with APIC_TRANSPORT=requests,
+  e.g. to go through the proxy set in HTTPS_PROXY.
+
+Both are safe to use from many threads at once, which is how calls run concurrently (see executor.py).
+
+"""
+
+FILE_NAME = "transport.py"
+INFO = "[INFO]["+ FILE_NAME +"] - "
+DEBUG = os.getenv('DEBUG','')
+# http.client (default) or requests
+TRANSPORT = os.getenv('APIC_TRANSPORT','http.client')
+# Methods whose requests can be sent twice with the same effect as once
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']
+# Seconds a keep-alive connection may stay idle in the pool before it is closed rather than reused, as routers and
+# ingresses close idle connections on their side sooner or later
+IDLE_TIMEOUT = float(os.getenv('APIC_IDLE_TIMEOUT','30'))
+
+class TransportError(Exception):
+    """
+    The call failed without a response. sent tells whether the request may
+    have reached the server, which matters to know if it can be retried.
+    """
+
+    def __init__(self, message, sent=True):
+        super().__init__(message)
+        self.sent = sent
+
+class ConnectError(TransportError):
+    def __init__(self, message):
+        super().__init__(message, sent=False)
+
+class ConnectTimeout(ConnectError):
+    pass
+
+class ReadTimeout(TransportError):
+    pass
+
+class Headers(dict):
+    """
+    Case insensitive headers, as HTTP header names are.
+    """
+
+    def __init__(self, items=()):
+        super().__init__((name.lower(), value) for name, value in (items.items() if hasattr(items, 'items') else items))
+
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+class Request:
+    def __init__(self, method, url, headers, body=None):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+class Response:
+    """
+    What every transport returns, with the attributes of a requests
+    Response the scripts use.
+    """
+
+    def __init__(self, status_code, reason, headers, content, request, elapsed=0.0):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.request = request
+        self.url = request.url
+        self.elapsed = timedelta(seconds=elapsed)
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+def encode(data):
+    return json.dumps(data).encode('utf-8') if data else None
+
+def connection_dropped(connection):
+    """
+    Tells whether the server has closed an idle connection (or sent
+    something unasked on it): its socket is then readable, at EOF.
+    """
+    sock = connection.sock
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+def ssl_context(verify):
+    context = ssl.create_default_context()
+    if not verify:
+        # The APIC routes usually serve certificates signed by the cluster's own CA
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+class HTTPClientTransport:
+    """
+    Transport on top of http.client keeping up to pool_size idle keep-alive
+    connections per host. A connection is only used by one call at a time,
+    so concurrent calls open more connections as needed. Idle connections
+    are only reused if they have been idle for less than idle_timeout
+    seconds and the server has not closed them meanwhile.
+    """
+
+    def __init__(self, pool_size=10, verify=False, idle_timeout=IDLE_TIMEOUT):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._context = ssl_context(verify)
+        self._idle = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _base_url(self, parts):
+        return parts.scheme + "://" + parts.netloc
+
+    def _connection(self, parts, connect_timeout):
+        base_url = self._base_url(parts)
+        while True:
+            with self._lock:
+                self._stats.setdefault(base_url, {"opened": 0, "requests": 0})
+                idle = self._idle.setdefault(base_url, [])
+                if not idle:
+                    break
+                connection, released_at = idle.pop()
+            if time.time() - released_at < self.idle_timeout and not connection_dropped(connection):
+                return connection, True
+            connection.close()
+        if parts.scheme == 'https':
+            connection = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=connect_timeout, context=self._context)
+        else:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=connect_timeout)
+        try:
+            connection.connect()
+        except socket.timeout as e:
+            connection.close()
+            raise ConnectTimeout("Connecting to " + base_url + " timed out: " + repr(e))
+        except OSError as e:
+            connection.close()
+            raise ConnectError("Could not connect to " + base_url + ": " + repr(e))
+        with self._lock:
+            self._stats[base_url]["opened"] += 1
+        return connection, False
+
+    def _release(self, parts, connection):
+        with self._lock:
+            idle = self._idle.setdefault(self._base_url(parts), [])
+            if len(idle) < self.pool_size:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def request(self, method, url, headers, data=None, timeout=(10, 60)):
+        parts = urlsplit(url)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        body = encode(data)
+        start = time.time()
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        while True:
+            connection, reused = self._connection(parts, timeout[0])
+            connection.sock.settimeout(timeout[1])
+            try:
+                connection.request(method, path, body=body, headers=headers)
+            except (ConnectionResetError, BrokenPipeError) as e:
+                connection.close()
+                # The request was not written in full, so the server cannot have processed it
+                if reused:
+                    continue
+                raise TransportError(method + " " + url + " failed: " + repr(e), sent=False)
+            except socket.timeout as e:
+                connection.close()
+                raise ReadTimeout(method + " " + url + " timed out after " + str(timeout[1]) + "s: " + repr(e))
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise TransportError(method + " " + url + " failed: " + repr(e), sent=False)
+            try:
+                raw = connection.getresponse()
+                content = raw.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                connection.close()
+                # Most likely the server closed the idle connection before getting the request, but it may have
+                # processed it, so only a request that can safely be repeated is sent again on a new connection
+                if reused and idempotent:
+                    continue
+                raise TransportError(method + " " + url + " failed: " + repr(e))
+            except socket.timeout as e:
+                connection.close()
+                raise ReadTimeout(method + " " + url + " timed out after " + str(timeout[1]) + "s: " + repr(e))
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise TransportError(method + " " + url + " failed: " + repr(e))
+            break
+        with self._lock:
+            self._stats[self._base_url(parts)]["requests"] += 1
+        if raw.will_close:
+            connection.close()
+        else:
+            self._release(parts, connection)
+        response_headers = Headers(raw.getheaders())
+        if response_headers.get('Content-Encoding') == 'gzip' and content:
+            content = gzip.decompress(content)
+        return Response(raw.status, raw.reason, response_headers, content, Request(method, url, headers, body), time.time() - start)
+
+    def stats(self):
+        """
+        Returns, per host, how many connections have been opened and how many
+        requests have been made.
+        """
+        with self._lock:
+            return dict((base_url, dict(stats)) for base_url, stats in self._stats.items())
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+class RequestsTransport:
+    """
+    Transport on top of a requests Session per host, for when the requests
+    package is installed and wanted (it honours the proxy variables).
+    """
+
+    def __init__(self, pool_size=10, verify=False):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        self._adapter = HTTPAdapter
+        self.pool_size = pool_size
+        self.verify = verify
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, base_url):
+        with self._lock:
+            if base_url not in self._sessions:
+                s = self._requests.Session()
+                s.mount(base_url, self._adapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0))
+                self._sessions[base_url] = s
+            return self._sessions[base_url]
+
+    def request(self, method, url, headers, data=None, timeout=(10, 60)):
+        parts = urlsplit(url)
+        body = encode(data)
+        exceptions = self._requests.exceptions
+        try:
+            r = self._session(parts.scheme + "://" + parts.netloc).request(method, url, headers=headers, data=body, verify=self.verify, timeout=timeout)
+        except exceptions.ConnectTimeout as e:
+            raise ConnectTimeout(method + " " + url + " failed: " + repr(e))
+        except exceptions.ReadTimeout as e:
+            raise ReadTimeout(method + " " + url + " failed: " + repr(e))
+        except exceptions.RequestException as e:
+            # A refused connection is the only failure known to happen before anything is sent
+            if type(getattr(e.args[0], 'reason', None) if e.args else None).__name__ == 'NewConnectionError':
+                raise ConnectError(method + " " + url + " failed: " + repr(e))
+            raise TransportError(method + " " + url + " failed: " + repr(e))
+        return Response(r.status_code, r.reason, Headers(r.headers), r.content, Request(method, url, headers, body), r.elapsed.total_seconds())
+
+    def stats(self):
+        stats = {}
+        with self._lock:
+            sessions = dict(self._sessions)
+        for base_url, s in sessions.items():
+            pools = [adapter.poolmanager.pools.get(key) for adapter in set(s.adapters.values()) for key in adapter.poolmanager.pools.keys()]
+            pools = [pool for pool in pools if pool is not None]
+            stats[base_url] = {
+                "opened": sum(pool.num_connections for pool in pools),
+                "requests": sum(pool.num_requests for pool in pools)
+            }
+        return stats
+
+    def close(self):
+        with self._lock:
+            for s in self._sessions.values():
+                s.close()
+            self._sessions = {}
+
+def new_transport(pool_size=10, verify=False):
+    if TRANSPORT == 'requests':
+        return RequestsTransport(pool_size, verify)
+    if TRANSPORT != 'http.client':
+        raise Exception("[ERROR] - Unknown transport " + TRANSPORT + ", it must be http.client or requests")
+    return HTTPClientTransport(pool_size, verify)
@@ -1,9 +1,28 @@
-import os, json
+import os, json, tempfile
 
 FILE_NAME = "utils.py"
 INFO = "[INFO]["+ FILE_NAME +"] - " 
 DEBUG = os.getenv('DEBUG','')
 
+def write_atomically(path, content, private=False):
+    """
+    Writes the content to a temporary file next to path and then moves it
+    over path, so that whoever reads the file (e.g. another run, or the
+    node exporter textfile collector) never sees it half written. The file
+    is only readable by its owner when private is set.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        if not private:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
 def get_toolkit_credentials(CONFIG_FILES_DIR):
     toolkit_credentials = None
     if os.path.isfile(CONFIG_FILES_DIR + "/toolkit-creds.json"):
@@ -21,19 +40,3 @@ def get_env_config(CONFIG_FILES_DIR):
     else:
         env_config = {}
     return env_config
-
-def pretty_print_request(req):
-    """
-    At this point it is completely built and ready
-    to be fired; it is "prepared".
-
-    However pay attention at the formatting used in 
-    this function because it is programmed to be pretty 
-    printed and may differ from the actual request.
-    """
-    print(INFO + "---------- Request start ----------")
-    print(INFO + req.method + ' ' + req.url)
-    for k, v in req.headers.items():
-        print(INFO + '{}: {}'.format(k, v))
-    print(INFO, req.body)
-    print(INFO + "---------- Request end ----------")
\ No newline at end of file